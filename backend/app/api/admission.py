@@ -0,0 +1,68 @@
+import logging
+
+from fastapi.responses import JSONResponse
+
+from app.core.config import get_settings
+from app.core.resilience import admission, deadline_scope, llm_backend
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+REQUEST_TIMEOUT = settings.request_timeout
+OVERLOAD_RETRY_AFTER = settings.overload_retry_after
+
+# 需要准入控制的接口前缀 -> 必需的上游后端；查询、统计、静态文件不做准入控制。
+# 转写只用本地 Whisper 模型，LLM 熔断时照常处理
+ADMISSION_PATHS = {
+    "/story/process": (llm_backend,),
+    "/story/transcribe": (),
+}
+
+
+def _request_timeout(scope, default):
+    """客户端可以用 X-Request-Timeout（秒）缩短截止时间，不能超过服务端的上限"""
+    for name, value in scope.get("headers", ()):
+        if name == b"x-request-timeout":
+            try:
+                requested = float(value)
+            except ValueError:
+                break
+            if requested > 0:
+                return min(requested, default) if default else requested
+            break
+    return default or None
+
+
+class AdmissionMiddleware:
+    """纯 ASGI 中间件：准入控制，并给整个请求（包括流式响应）设置截止时间
+
+    不用 BaseHTTPMiddleware，是因为它会在另一个任务里运行接口，截止时间的 contextvar 传不过去；
+    名额在响应（包括流式响应的最后一行）发送完之后才释放。
+    """
+
+    def __init__(self, app, controller=admission, paths=ADMISSION_PATHS,
+                 timeout=REQUEST_TIMEOUT, retry_after=OVERLOAD_RETRY_AFTER):
+        self.app = app
+        self.controller = controller
+        self.paths = dict(paths)
+        self._prefixes = tuple(self.paths)
+        self.timeout = timeout
+        self.retry_after = retry_after
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self._prefixes):
+            await self.app(scope, receive, send)
+            return
+        required = next(backends for prefix, backends in self.paths.items() if scope["path"].startswith(prefix))
+        reason = self.controller.try_admit(required)
+        if reason is not None:
+            logger.warning("Rejected %s: %s", scope["path"], reason)
+            response = JSONResponse({"detail": f"service unavailable ({reason}), retry later"},
+                                    status_code=503, headers={"Retry-After": str(self.retry_after)})
+            await response(scope, receive, send)
+            return
+        try:
+            with deadline_scope(_request_timeout(scope, self.timeout)):
+                await self.app(scope, receive, send)
+        finally:
+            self.controller.release()
@@ -1,7 +1,20 @@
-from fastapi import APIRouter, BackgroundTasks, HTTPException
+import base64
+import os
+from datetime import datetime, timezone
+from typing import Optional
+from fastapi import APIRouter, BackgroundTasks, File, Form, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from app.core.agents.story_agent import process_with_langchain
-from app.core.memory.session_manager import get_all_conversation_memory
+from app.core.agents.llm_batcher import llm_batcher
+from app.core.agents.llm_cache import llm_cache
+from app.core.agents.story_agent import process_with_langchain, process_events, speculator
+from app.core.jobs.job_queue import aget_job
+from app.core.memory.session_cache import sessions
+from app.core.memory.session_manager import (
+    CONVERSATION_MAX_PAGE_SIZE, CONVERSATION_PAGE_SIZE, aget_conversations_page, aiter_conversation_pages)
+from app.core.rendering.tts_controller import tts_cache
+from app.core.resilience import BackendUnavailable, admission, backends
+from app.core.speech.transcriber import TranscriptionUnavailable, UploadTooLarge, save_upload, transcriber
 import json
 
 router = APIRouter()
@@ -9,20 +22,159 @@ router = APIRouter()
 class UserRequest(BaseModel):
     user_id: str
     user_input: str
+    # 为 True 时图片和语音交给后台任务，响应里只返回 image_job_id / audio_job_id
+    defer_media: bool = False
 
 @router.post("/process")
 async def process_request(request: UserRequest, background_tasks: BackgroundTasks):
     try:
-        response_data = process_with_langchain(request.user_id, request.user_input)
+        response_data = await process_with_langchain(
+            request.user_id, request.user_input, request.defer_media)
 
         return response_data
+    except BackendUnavailable as e:
+        # LLM 熔断或者截止时间已到：让客户端稍后重试，而不是当作服务端错误
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/process/stream")
+async def process_request_stream(request: UserRequest):
+    """流式版本：每行一个 JSON 事件（NDJSON），故事文本先到，图片和语音完成后再各发一行"""
+    async def ndjson():
+        try:
+            async for event in process_events(request.user_id, request.user_input, request.defer_media):
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"event": "error", "detail": str(e)}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+async def _transcribe_upload(audio: UploadFile):
+    """保存上传的音频并转写；没装 Whisper 返回 503，文件过大返回 413"""
+    try:
+        path = await save_upload(audio)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        return await transcriber.transcribe_file(path)
+    except TranscriptionUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"could not transcribe audio: {e}")
+    finally:
+        os.remove(path)
+
+@router.post("/transcribe")
+async def transcribe_request(audio: UploadFile = File(...)):
+    """语音转文字：返回 text / language / duration"""
+    return await _transcribe_upload(audio)
+
+@router.post("/process/voice")
+async def process_voice_request(user_id: str = Form(...), audio: UploadFile = File(...),
+                                defer_media: bool = Form(False), stream: bool = Form(False)):
+    """语音输入版本的 /process：先转写，再按文字输入处理；stream 为 True 时返回 NDJSON，第一行是 transcript 事件"""
+    transcript = await _transcribe_upload(audio)
+    user_input = transcript["text"]
+    if not user_input:
+        raise HTTPException(status_code=422, detail="no speech recognized")
+
+    if stream:
+        async def ndjson():
+            yield json.dumps({"event": "transcript", **transcript}, ensure_ascii=False) + "\n"
+            try:
+                async for event in process_events(user_id, user_input, defer_media):
+                    yield json.dumps(event, ensure_ascii=False) + "\n"
+            except Exception as e:
+                yield json.dumps({"event": "error", "detail": str(e)}, ensure_ascii=False) + "\n"
+
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    try:
+        response_data = await process_with_langchain(user_id, user_input, defer_media)
+    except BackendUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"transcript": transcript, **response_data}
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    job = await aget_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job
+
+def _db_time(value):
+    """查询参数里的时间转成数据库 created_at 的格式（UTC），不带时区的按 UTC 处理"""
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+def _encode_cursor(row):
+    return base64.urlsafe_b64encode(json.dumps([row["created_at"], row["id"]]).encode()).decode()
+
+def _decode_cursor(cursor):
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(created_at), int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
 @router.get("/conversations")
-async def get_conversations():
+async def get_conversations(user_id: Optional[str] = None, since: Optional[datetime] = None,
+                            until: Optional[datetime] = None, cursor: Optional[str] = None,
+                            limit: int = Query(CONVERSATION_PAGE_SIZE, ge=1, le=CONVERSATION_MAX_PAGE_SIZE)):
+    """按时间顺序分页返回对话记录；把响应里的 next_cursor 传回来取下一页，为 null 时已经取完"""
+    after = _decode_cursor(cursor) if cursor else None
     try:
-        conversations = get_all_conversation_memory()
-        return {"conversations": conversations}
+        conversations = await aget_conversations_page(user_id, _db_time(since), _db_time(until), after, limit)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    next_cursor = _encode_cursor(conversations[-1]) if len(conversations) == limit else None
+    return {"conversations": conversations, "next_cursor": next_cursor}
+
+@router.get("/conversations/export")
+async def export_conversations(user_id: Optional[str] = None, since: Optional[datetime] = None,
+                               until: Optional[datetime] = None):
+    """导出符合条件的全部对话记录，每行一个 JSON（NDJSON），内存占用和表的大小无关"""
+    async def ndjson():
+        # 每页拼成一个块发送，避免逐行的发送开销
+        async for rows in aiter_conversation_pages(user_id, _db_time(since), _db_time(until)):
+            yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@router.get("/stats/tts-cache")
+async def get_tts_cache_stats():
+    return tts_cache.stats()
+
+@router.get("/stats/speculation")
+async def get_speculation_stats():
+    return speculator.stats()
+
+@router.get("/stats/llm-cache")
+async def get_llm_cache_stats():
+    return llm_cache.stats()
+
+@router.get("/stats/llm-batch")
+async def get_llm_batch_stats():
+    return llm_batcher.stats()
+
+@router.get("/stats/sessions")
+async def get_session_stats():
+    return sessions.stats()
+
+@router.get("/stats/transcriber")
+async def get_transcriber_stats():
+    return transcriber.stats()
+
+@router.get("/stats/backends")
+async def get_backend_stats():
+    return {name: backend.stats() for name, backend in backends.items()}
+
+@router.get("/stats/admission")
+async def get_admission_stats():
+    return admission.stats()
@@ -0,0 +1,210 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+from app.core.config import get_settings
+
+# 本地快速意图分类：规则 + 小型朴素贝叶斯模型，只在高置信度时跳过对话 LLM 调用。
+# 需要 LLM 生成回复的意图（ask_question / user_dialogue）始终交给 LLM。
+FAST_PATH_THRESHOLD = get_settings().intent_fast_path_threshold
+FAST_PATH_INTENTS = ("choose_character", "continue_story", "change_character")
+
+# 支持的角色及其在孩子输入里可能出现的说法
+CHARACTER_KEYWORDS = {
+    "Thomas": ["thomas", "thomas the tank engine", "托马斯", "小火车"],
+    "Cinderella": ["cinderella", "灰姑娘", "辛德瑞拉"],
+    "Snow White": ["snow white", "snow white princess", "snowwhite", "白雪公主"],
+    "My Little Pony": ["my little pony", "little pony", "pony", "小马宝莉", "小马宝利", "小马"],
+    "Paw Patrol": ["paw patrol", "pawpatrol", "汪汪队", "汪汪队立大功"],
+}
+
+CONTINUE_PHRASES = [
+    "continue", "go on", "next", "more", "keep going", "what happens next", "and then",
+    "继续", "然后呢", "接着讲", "下一个", "还要", "再讲",
+]
+CHANGE_PHRASES = ["change", "switch", "another", "instead", "换", "改成"]
+# 否定或者结束的说法：“no more”“next time”“不要了”不是要继续，交给 LLM
+STOP_PHRASES = [
+    "no", "not", "don't", "dont", "stop", "enough", "bye", "goodbye", "later", "next time",
+    "不要", "不想", "别", "停", "够了", "不听", "再见", "下次",
+]
+# 否定：“don't change to cinderella”“我不换”不是要换角色
+_NEGATION = re.compile(r"\b(?:not|no|never|don't|dont)\b|n't\b|不|别|没")
+
+
+def _phrase_pattern(phrases):
+    """英文短语按整词匹配（"no more" 里的 "more" 算，"nevermore" 不算），中文短语按子串匹配"""
+    parts = [re.escape(p) if _CJK.search(p) else rf"\b{re.escape(p)}\b"
+             for p in sorted(phrases, key=len, reverse=True)]
+    return re.compile("|".join(parts))
+
+
+# 规则的置信度，和模型的概率一样要达到 INTENT_FAST_PATH_THRESHOLD 才跳过 LLM。
+# 已经选了某个角色又只说了这个角色名时，LLM 自己的标注也在 continue / choose / user_dialogue 之间摇摆，
+# 这种输入交给 LLM 判断
+RULE_CONFIDENCE = {
+    "choose_character": 1.0,     # 还没有角色，只说了角色名
+    "change_character": 0.95,    # 说了另一个角色名，或者“换成 X”
+    "repeat_character": 0.6,     # 说了当前的角色名
+    "continue_story": 0.95,      # “继续”“what happens next” 之类的短句
+}
+
+# 只包含角色名和这些填充词的输入视为“直接说出了角色名”（中文按单字切分，所以这里是单字）
+FILLER_WORDS = {
+    "i", "want", "wanna", "to", "go", "play", "with", "choose", "pick", "like", "love", "the",
+    "please", "let's", "lets", "adventure", "an", "a", "on", "and", "me", "my", "is", "it",
+} | set("我想要和跟一起去冒险选喜欢吧的玩呀啊")
+
+# 模型的训练样本：覆盖常见的说法，真实对话记录可以通过 train() 追加
+SEED_EXAMPLES = [
+    ("continue", "continue_story"), ("go on please", "continue_story"),
+    ("what happens next", "continue_story"), ("tell me more", "continue_story"),
+    ("next story", "continue_story"), ("keep going", "continue_story"),
+    ("and then", "continue_story"), ("more story please", "continue_story"),
+    ("继续讲", "continue_story"), ("然后呢", "continue_story"), ("接着讲故事", "continue_story"),
+    ("我还想听", "continue_story"), ("再讲一个", "continue_story"),
+    ("i want to change my friend", "change_character"), ("switch to another friend", "change_character"),
+    ("i want a different character", "change_character"), ("change character", "change_character"),
+    ("我想换一个", "change_character"), ("换一个角色", "change_character"), ("我不要这个了", "change_character"),
+    ("i choose", "choose_character"), ("i want to go with", "choose_character"),
+    ("let's go on an adventure with", "choose_character"), ("我选", "choose_character"),
+    ("我想和她一起去冒险", "choose_character"), ("我要和他一起玩", "choose_character"),
+    ("why is the sky blue", "ask_question"), ("where are you going", "ask_question"),
+    ("what is your name", "ask_question"), ("do you like apples", "ask_question"),
+    ("are you happy", "ask_question"), ("你叫什么名字", "ask_question"), ("你要去哪里", "ask_question"),
+    ("为什么", "ask_question"), ("你喜欢什么颜色", "ask_question"),
+    ("hello", "user_dialogue"), ("i am five years old", "user_dialogue"), ("my dog is big", "user_dialogue"),
+    ("i had ice cream today", "user_dialogue"), ("你好", "user_dialogue"), ("我今天去公园了", "user_dialogue"),
+    ("i don't know", "user_dialogue"), ("我不知道", "user_dialogue"), ("haha", "user_dialogue"),
+]
+
+_WORD = re.compile(r"[a-z']+|[一-鿿]")
+_CJK = re.compile(r"[一-鿿]")
+_CONTINUE = _phrase_pattern(CONTINUE_PHRASES)
+_CHANGE = _phrase_pattern(CHANGE_PHRASES)
+_STOP = _phrase_pattern(STOP_PHRASES)
+
+
+def _normalize(text):
+    return " ".join((text or "").lower().replace("！", "!").replace("？", "?").split())
+
+
+def _features(text):
+    """英文按单词、中文按单字和相邻两字切分"""
+    tokens = _WORD.findall(_normalize(text))
+    features = list(tokens)
+    features += [a + b for a, b in zip(tokens, tokens[1:]) if _CJK.match(a) and _CJK.match(b)]
+    return features
+
+
+def find_character(text):
+    """返回输入里提到的支持角色（取最长匹配），没有则返回 None"""
+    normalized = _normalize(text)
+    best, best_len = None, 0
+    for character, keywords in CHARACTER_KEYWORDS.items():
+        for keyword in keywords:
+            if keyword in normalized and len(keyword) > best_len:
+                best, best_len = character, len(keyword)
+    return best
+
+
+def _strip_character(text):
+    normalized = _normalize(text)
+    for keywords in CHARACTER_KEYWORDS.values():
+        for keyword in sorted(keywords, key=len, reverse=True):
+            normalized = normalized.replace(keyword, " ")
+    return normalized
+
+
+class NaiveBayesIntentModel:
+    """多项式朴素贝叶斯，训练和预测都是纯 Python 的计数运算，单次预测在微秒级"""
+
+    def __init__(self, examples=()):
+        self.class_counts = Counter()
+        self.feature_counts = defaultdict(Counter)
+        self.vocabulary = set()
+        self.train(examples)
+
+    def train(self, examples):
+        for text, intent in examples:
+            features = _features(text)
+            self.class_counts[intent] += 1
+            self.feature_counts[intent].update(features)
+            self.vocabulary.update(features)
+        self._totals = {intent: sum(counts.values()) for intent, counts in self.feature_counts.items()}
+
+    def predict(self, text):
+        """返回 (intent, probability)"""
+        features = [f for f in _features(text) if f in self.vocabulary]
+        if not features or not self.class_counts:
+            return None, 0.0
+        total_examples = sum(self.class_counts.values())
+        vocab_size = len(self.vocabulary)
+        scores = {}
+        for intent, count in self.class_counts.items():
+            score = math.log(count / total_examples)
+            denominator = self._totals[intent] + vocab_size
+            for feature in features:
+                score += math.log((self.feature_counts[intent][feature] + 1) / denominator)
+            scores[intent] = score
+        best = max(scores, key=scores.get)
+        top = scores[best]
+        probability = 1.0 / sum(math.exp(score - top) for score in scores.values())
+        return best, probability
+
+
+model = NaiveBayesIntentModel(SEED_EXAMPLES)
+
+
+def classify_intent(user_input, current_character=None, threshold=None):
+    """本地判断意图；高置信度时返回 dict(intent, character, confidence, source)，否则返回 None 交给 LLM"""
+    threshold = FAST_PATH_THRESHOLD if threshold is None else threshold
+    text = _normalize(user_input)
+    if not text:
+        return None
+    character = find_character(text)
+    # 已选角色也归一到规范名（例如 "Snow White Princess" -> "Snow White"）再比较
+    if current_character:
+        current_character = find_character(current_character) or current_character
+    rest = _strip_character(text)
+    rest_words = set(_WORD.findall(rest))
+    stopping = bool(_STOP.search(text)) or bool(_NEGATION.search(text))
+
+    # 规则 1：只说了角色名（可能带“我想和…一起去冒险”之类的填充词）
+    if character and rest_words <= FILLER_WORDS:
+        if current_character is None:
+            intent, rule = "choose_character", "choose_character"
+        elif current_character.lower() == character.lower():
+            intent, rule = "continue_story", "repeat_character"
+        else:
+            intent, rule = "change_character", "change_character"
+        return _rule_result(intent, character, RULE_CONFIDENCE[rule], threshold)
+
+    # 规则 2：换角色的说法 + 另一个角色名，并且没有否定或结束的说法
+    if character and current_character and current_character.lower() != character.lower() \
+            and not stopping and _CHANGE.search(rest):
+        return _rule_result("change_character", character, RULE_CONFIDENCE["change_character"], threshold)
+
+    # 规则 3：继续故事的短句，且已经有选好的角色，并且没有否定或结束的说法
+    if current_character and not character and len(rest_words) <= 4 and not stopping \
+            and _CONTINUE.search(text):
+        return _rule_result("continue_story", current_character, RULE_CONFIDENCE["continue_story"], threshold)
+
+    # 其余交给模型；只有不需要生成回复的意图、并且角色已知时才走快速路径
+    intent, probability = model.predict(text)
+    if intent not in FAST_PATH_INTENTS or probability < threshold:
+        return None
+    if intent in ("continue_story", "change_character") and stopping:
+        return None
+    if intent == "continue_story":
+        character = character or current_character
+    if character is None:
+        return None
+    return {"intent": intent, "character": character, "confidence": probability, "source": "model"}
+
+
+def _rule_result(intent, character, confidence, threshold):
+    """规则命中但置信度不够时返回 None，交给 LLM"""
+    if confidence < threshold:
+        return None
+    return {"intent": intent, "character": character, "confidence": confidence, "source": "rule"}
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+from collections import Counter
+
+from app.core.config import get_settings
+from app.core.resilience import (
+    BackendUnavailable, DeadlineExceeded, cap_timeout, current_deadline, is_transient, llm_backend, use_deadline)
+from app.utils.metrics import LLM_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+# 并发用户的 prompt 在一个很短的窗口内攒成一批，用一次 completions 请求（prompt 是列表）发给上游，
+# 每个结果按顺序交回各自的调用方。参数（max_tokens 等）不同的请求不会放进同一批。
+# 发给上游的每个请求（一整批算一个）都经过 llm_backend 的并发上限、限速、重试和熔断。
+settings = get_settings()
+LLM_BATCH_ENABLED = settings.llm_batch_enabled
+LLM_BATCH_MAX_SIZE = settings.llm_batch_max_size
+LLM_BATCH_WINDOW = settings.llm_batch_window
+LLM_REQUEST_TIMEOUT = settings.llm_request_timeout
+
+
+class LLMBatcher:
+    """包装 LangChain LLM，调用方式不变：await llm.ainvoke(prompt, **kwargs)"""
+
+    def __init__(self, llm=None, max_batch=LLM_BATCH_MAX_SIZE, window=LLM_BATCH_WINDOW,
+                 timeout=LLM_REQUEST_TIMEOUT, enabled=LLM_BATCH_ENABLED, backend=llm_backend):
+        self.llm = llm
+        self.backend = backend
+        self.max_batch = max_batch
+        self.window = window
+        self.timeout = timeout
+        self.enabled = enabled
+        self._pending = {}  # 参数 key -> (kwargs, [(prompt, future, 调用方的截止时间)])
+        self._timers = {}
+        self._tasks = set()
+        self.requests = 0
+        self.batches = 0
+        self.batched_prompts = 0
+        self.max_batch_seen = 0
+        self.batch_sizes = Counter()
+        self.fallbacks = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    async def ainvoke(self, prompt, **kwargs):
+        self.requests += 1
+        if not self.enabled or self.max_batch <= 1:
+            return await self._wait(self.backend.call(self.llm.ainvoke, prompt, **kwargs))
+
+        key = json.dumps(kwargs, sort_keys=True, default=str)
+        future = asyncio.get_running_loop().create_future()
+        _, batch = self._pending.setdefault(key, (kwargs, []))
+        batch.append((prompt, future, current_deadline()))
+        if len(batch) >= self.max_batch:
+            self._dispatch(key)
+        elif len(batch) == 1:
+            self._timers[key] = asyncio.get_running_loop().call_later(self.window, self._dispatch, key)
+        try:
+            # 超时或取消只影响这一个调用方，同批的其他请求照常完成
+            return await self._wait(asyncio.shield(future))
+        except BaseException:
+            # 还没发出去的 prompt 不再发送
+            future.cancel()
+            raise
+
+    async def _wait(self, awaitable):
+        timeout = cap_timeout(self.timeout)
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except TimeoutError:
+            self.timeouts += 1
+            if timeout != self.timeout:
+                raise DeadlineExceeded("LLM call cut off by the request deadline") from None
+            raise
+
+    def _dispatch(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        kwargs, batch = self._pending.pop(key, (None, []))
+        batch = [entry for entry in batch if not entry[1].done()]
+        if not batch:
+            return
+        # 一批请求为所有调用方服务，按其中最晚的截止时间调用上游（有调用方不限时则不限）
+        deadlines = [deadline for _, _, deadline in batch]
+        deadline = None if None in deadlines else max(deadlines)
+        task = asyncio.ensure_future(self._send(batch, kwargs, deadline))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch, kwargs, deadline=None):
+        with use_deadline(deadline):
+            await self._send_batch(batch, kwargs)
+
+    async def _send_batch(self, batch, kwargs):
+        size = len(batch)
+        self.batches += 1
+        self.batched_prompts += size
+        self.max_batch_seen = max(self.max_batch_seen, size)
+        self.batch_sizes[size] += 1
+        LLM_BATCH_SIZE.observe(size)
+        try:
+            result = await self.backend.call(self.llm.agenerate, [prompt for prompt, _, _ in batch], **kwargs)
+            texts = [generations[0].text for generations in result.generations]
+        except Exception as e:
+            # 上游故障（已经重试过）、熔断或截止时间已到时，逐个重试也不会成功
+            if size == 1 or isinstance(e, BackendUnavailable) or is_transient(e):
+                self.errors += 1
+                for _, future, _ in batch:
+                    _resolve(future, error=e)
+                return
+            # 整批失败时逐个重试，一个有问题的 prompt 不会拖累同批的其他请求
+            self.fallbacks += 1
+            logger.warning("Batched LLM call with %d prompts failed (%s), retrying individually", size, e)
+            await asyncio.gather(*(self._send_one(prompt, future, kwargs) for prompt, future, _ in batch))
+            return
+        for (_, future, _), text in zip(batch, texts):
+            _resolve(future, text)
+
+    async def _send_one(self, prompt, future, kwargs):
+        if future.done():
+            return
+        try:
+            _resolve(future, await self.backend.call(self.llm.ainvoke, prompt, **kwargs))
+        except Exception as e:
+            self.errors += 1
+            _resolve(future, error=e)
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def __repr__(self):
+        return f"LLMBatcher({self.llm!r})"
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "requests": self.requests,
+            "batches": self.batches,
+            "avg_batch_size": self.batched_prompts / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch_seen,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "fallbacks": self.fallbacks,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+        }
+
+
+def _resolve(future, result=None, error=None):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+# 上游 LLM 在第一次 get_llm() 时才创建并挂到这里
+llm_batcher = LLMBatcher()
@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+
+from app.core.config import get_settings
+from app.core.memory.session_manager import pool
+from app.core.resilience import use_deadline, wait_shared
+from app.utils.metrics import DB_SECONDS, timed
+
+logger = logging.getLogger(__name__)
+
+# LLM 响应缓存：重试、前端重复点击、重复的演示会话会发出完全相同的 prompt
+settings = get_settings()
+LLM_CACHE_ENABLED = settings.llm_cache_enabled
+LLM_CACHE_MAX_ENTRIES = settings.llm_cache_max_entries
+LLM_CACHE_TTL = settings.llm_cache_ttl
+# 每写入这么多条，顺便清理一次磁盘层里过期的记录
+LLM_CACHE_PURGE_EVERY = 100
+
+SELECT_CACHE = "SELECT response, latency FROM llm_cache WHERE key = ? AND expires_at > ?"
+UPSERT_CACHE = (
+    "INSERT INTO llm_cache (key, response, latency, created_at, expires_at) VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT(key) DO UPDATE SET response = excluded.response, latency = excluded.latency, "
+    "created_at = excluded.created_at, expires_at = excluded.expires_at"
+)
+PURGE_CACHE = "DELETE FROM llm_cache WHERE expires_at <= ?"
+
+_SPACES = re.compile(r"[ \t]+")
+
+
+def normalize_prompt(prompt):
+    """去掉行尾空白、多余空格和空行；模板渲染的空白差异不应该导致缓存未命中"""
+    lines = (_SPACES.sub(" ", line).strip() for line in prompt.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def get_cached_response(key, now):
+    with pool.connection() as conn:
+        return conn.execute(SELECT_CACHE, (key, now)).fetchone()
+
+def save_cached_response(key, response, latency, now, ttl, purge=False):
+    with pool.transaction() as conn:
+        conn.execute(UPSERT_CACHE, (key, response, latency, now, now + ttl))
+        if purge:
+            conn.execute(PURGE_CACHE, (now,))
+
+
+class LLMCache:
+    """两级缓存：进程内 LRU + SQLite（带 TTL）；相同 key 的并发请求共享一次上游调用"""
+
+    def __init__(self, max_entries=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL, persistent=True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persistent = persistent
+        self._entries = OrderedDict()  # key -> (response, latency, expires_at)
+        self._inflight = {}
+        self._writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def key(prompt, params):
+        payload = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(f"{payload}\0{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, response, latency, expires_at):
+        self._entries[key] = (response, latency, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def lookup(self, key):
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[2] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.saved_seconds += entry[1]
+                return entry[0]
+            del self._entries[key]
+        if not self.persistent:
+            return None
+        with timed("get_cached_response", DB_SECONDS):
+            row = await asyncio.to_thread(get_cached_response, key, now)
+        if row is None:
+            return None
+        response, latency = row
+        # 磁盘层命中后提升到内存层
+        self._remember(key, response, latency, now + self.ttl)
+        self.disk_hits += 1
+        self.saved_seconds += latency
+        return response
+
+    async def store(self, key, response, latency):
+        now = time.time()
+        self._remember(key, response, latency, now + self.ttl)
+        if self.persistent:
+            self._writes += 1
+            with timed("save_cached_response", DB_SECONDS):
+                await asyncio.to_thread(save_cached_response, key, response, latency, now, self.ttl,
+                                        self._writes % LLM_CACHE_PURGE_EVERY == 0)
+
+    async def get_or_create(self, key, generate):
+        """命中缓存直接返回；否则调用 generate()，同一个 key 的并发请求共享这一次调用"""
+        response = await self.lookup(key)
+        if response is not None:
+            return response
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            response, latency = await wait_shared(task)
+            self.saved_seconds += latency
+            return response
+
+        self.misses += 1
+
+        async def run():
+            try:
+                started = time.monotonic()
+                response = await generate()
+                latency = time.monotonic() - started
+                # 空响应多半是上游出错，不缓存，下次重新生成
+                if response and response.strip():
+                    try:
+                        await self.store(key, response, latency)
+                    except Exception as e:
+                        self.errors += 1
+                        logger.warning("LLM cache write failed: %s", e)
+                return response, latency
+            finally:
+                self._inflight.pop(key, None)
+
+        # 共享的调用不继承第一个调用方的截止时间；每个调用方只按自己的截止时间放弃等待
+        with use_deadline(None):
+            task = asyncio.ensure_future(run())
+        self._inflight[key] = task
+        response, _ = await wait_shared(task)
+        return response
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.disk_hits + self.coalesced) / lookups if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "errors": self.errors,
+        }
+
+
+class CachedLLM:
+    """给 LangChain LLM 加上缓存，调用方式不变：await llm.ainvoke(prompt, **kwargs)"""
+
+    def __init__(self, llm, cache, enabled=LLM_CACHE_ENABLED):
+        self.llm = llm
+        self.cache = cache
+        self.enabled = enabled
+
+    def _params(self, kwargs):
+        # 模型名、温度、max_tokens 等都进 key，参数不同的请求不会互相命中
+        params = dict(getattr(self.llm, "_identifying_params", {}) or {})
+        params.update(kwargs)
+        return params
+
+    async def ainvoke(self, prompt, **kwargs):
+        if not self.enabled:
+            return await self.llm.ainvoke(prompt, **kwargs)
+        key = self.cache.key(prompt, self._params(kwargs))
+        return await self.cache.get_or_create(key, lambda: self.llm.ainvoke(prompt, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def __repr__(self):
+        return f"CachedLLM({self.llm!r})"
+
+
+llm_cache = LLMCache()
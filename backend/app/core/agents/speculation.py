@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import re
+import time
+
+from app.core.config import get_settings
+from app.utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 推测式生成：章节发出后，针对最可能的几个回答在后台提前生成下一章
+settings = get_settings()
+SPECULATION_ENABLED = settings.speculation_enabled
+SPECULATION_TOP_K = settings.speculation_top_k
+# 每个用户在一个时间窗口内允许推测消耗的估算 token 数
+SPECULATION_TOKEN_BUDGET = settings.speculation_token_budget
+SPECULATION_BUDGET_WINDOW = settings.speculation_budget_window
+# 单个候选章节的估算输出 token 数，用于预先检查预算
+SPECULATION_COMPLETION_TOKENS = 700
+
+_LETTERED_OPTION = re.compile(r"(?:^|\s)\(?([A-Da-d])[).:]\s*([^,;?()]+?)(?=\s+\(?[A-Da-d][).:]|[,;?]|$)")
+_WORD = re.compile(r"[a-z0-9']+|[一-鿿]+")
+_OPTION_SPLIT = re.compile(r",\s*(?:or\s+)?|\s+or\s+|还是|或者")
+# 孩子的回答里有否定时（"not the forest"、"不要森林"）不知道他选了哪个，算作未命中
+_NEGATION = re.compile(r"\b(?:not|no|nope|never|don't|dont)\b|n't\b|不|别")
+# 第一个选项前面的问句部分到最后一个虚词 / 常见动词为止，例如 "do you want to go to | the forest"、
+# "should Thomas go | left"；句中大写的词（人名）也算问句部分
+CLAUSE_WORDS = {
+    "what", "which", "who", "where", "when", "why", "how", "whether", "if",
+    "do", "does", "did", "is", "are", "was", "were", "be", "am", "can", "could", "should", "would",
+    "will", "shall", "may", "might", "must", "let's", "lets",
+    "i", "you", "we", "they", "he", "she", "it", "him", "her", "them", "us",
+    "to", "at", "in", "on", "into", "onto", "from", "with", "for", "by", "of", "about", "over",
+    "under", "through", "toward", "towards", "near", "inside", "outside", "behind",
+    "go", "goes", "going", "want", "wants", "like", "likes", "think", "choose", "pick", "prefer",
+    "visit", "see", "take", "play", "eat", "have", "get", "try", "find", "wear", "ride", "help",
+    "say", "tell", "ask", "use", "make", "give", "bring", "open", "meet", "stay",
+}
+# 句首的助动词后面紧跟的是主语，例如 "is | the cat happy"
+AUXILIARIES = {
+    "is", "are", "was", "were", "am", "do", "does", "did", "can", "could", "should", "would",
+    "will", "shall", "may", "might", "must",
+}
+# 中文没有空格，问句部分到最后一个这些字为止，例如 "你想去|森林"
+_CJK_CLAUSE = re.compile(r"[去到选要想是在和跟欢爱吃看玩]")
+_CJK = re.compile(r"[一-鿿]")
+# 去掉问句部分后第一个选项仍然太长时，只保留最后这么多个词
+MAX_OPTION_WORDS = 6
+
+
+def _normalize(text):
+    return " ".join(_WORD.findall((text or "").lower()))
+
+
+def _strip_clause(first, width=None):
+    """去掉第一个选项前面的问句部分：从后往前取词，遇到问句用词或句中的大写词为止
+
+    问句直接以助动词开头时（"Is the cat happy or sad"），剩下的部分还带着主语，
+    这时只保留和其他选项一样多的词（width）。
+    """
+    if _CJK.search(first):
+        return _CJK_CLAUSE.split(first)[-1] or first
+    words = first.split()
+    kept = []
+    for index in range(len(words) - 1, -1, -1):
+        word = words[index]
+        bare = word.strip("\"'.,!:;").lower()
+        if kept and (bare in CLAUSE_WORDS or (index > 0 and word[:1].isupper())):
+            if index == 0 and bare in AUXILIARIES and width:
+                kept = kept[:width]
+            break
+        kept.append(word)
+    return " ".join(reversed(kept[:MAX_OPTION_WORDS]))
+
+
+def _option_words(option):
+    return re.sub(r"^(?:the|a|an|to)\s+", "", _normalize(option)).split()
+
+
+def predict_answers(question, k=None):
+    """从章节末尾的问题里猜孩子最可能的回答（选择题的选项），按出现顺序返回最多 k 个"""
+    k = SPECULATION_TOP_K if k is None else k
+    if not question:
+        return []
+    # 只看最后一个问句，例如 "... What color was the bird? Red or blue?"
+    sentences = [s for s in re.split(r"(?<=[?？])", question) if s.strip()]
+    last = sentences[-1] if sentences else question
+
+    options = [option for _, option in _LETTERED_OPTION.findall(last)]
+    if not options:
+        tail = last.split(":")[-1].strip(" ?？.!")
+        # 逗号前以动词 / 虚词结尾的是引导语而不是选项，例如 "Which do you like, apples or bananas"
+        intro = re.match(r"([^,]*),\s*(?!or\b)", tail)
+        if intro and intro.group(1).split() and intro.group(1).split()[-1].lower() in CLAUSE_WORDS:
+            tail = tail[intro.end():]
+        parts = _OPTION_SPLIT.split(tail)
+        if len(parts) >= 2:
+            width = max(len(_option_words(part)) for part in parts[1:])
+            options = [_strip_clause(parts[0], width)] + parts[1:]
+    answers = []
+    for option in options:
+        option = " ".join(_option_words(option))
+        if option and option not in answers:
+            answers.append(option)
+    return answers[:k]
+
+
+def match_answer(user_input, candidates):
+    """孩子的回答按整词恰好提到一个候选选项、并且没有否定时返回该选项，否则返回 None"""
+    text = _normalize(user_input)
+    if _NEGATION.search(text):
+        return None
+    padded = f" {text} "
+    matches = [c for c in candidates if f" {c} " in padded]
+    return matches[0] if len(matches) == 1 else None
+
+
+class Speculator:
+    """每个用户最多保留一组候选章节；真实回答到来时命中则直接使用，否则全部丢弃"""
+
+    def __init__(self, generate, enabled=None, top_k=None, token_budget=None, budget_window=None):
+        # generate(state, character_name, answer, difficulty_level) -> (prompt, response)
+        self.generate = generate
+        self.enabled = SPECULATION_ENABLED if enabled is None else enabled
+        self.top_k = SPECULATION_TOP_K if top_k is None else top_k
+        self.token_budget = SPECULATION_TOKEN_BUDGET if token_budget is None else token_budget
+        self.budget_window = SPECULATION_BUDGET_WINDOW if budget_window is None else budget_window
+        self._candidates = {}  # user_id -> dict(version, character, tasks={answer: task})
+        self._spent = {}  # user_id -> [(timestamp, tokens)]
+        self.scheduled = 0
+        self.hits = 0
+        self.misses = 0
+        self.skipped_budget = 0
+        self.used_tokens = 0
+        self.wasted_tokens = 0
+
+    def _budget_left(self, user_id, now):
+        # 保留原来的预占记录对象，生成完成后 _run 还要修正其中的 token 数
+        spent = [reservation for reservation in self._spent.get(user_id, [])
+                 if now - reservation[0] < self.budget_window]
+        self._spent[user_id] = spent
+        return self.token_budget - sum(tokens for _, tokens in spent)
+
+    def schedule(self, user_id, state, character_name, question, difficulty_level=3):
+        """章节发出后调用：为预测的回答在后台生成候选的下一章"""
+        self.discard(user_id)
+        if not self.enabled or self.top_k <= 0:
+            return []
+        answers = predict_answers(question, self.top_k)
+        if not answers:
+            return []
+        entry = {"version": state["chapter_count"], "character": (character_name or "").lower(), "tasks": {}}
+        now = time.monotonic()
+        for answer in answers:
+            if self._budget_left(user_id, now) < SPECULATION_COMPLETION_TOKENS:
+                self.skipped_budget += 1
+                continue
+            # 先按输出上限预占预算，完成后再按实际 prompt + 输出修正
+            reservation = [now, SPECULATION_COMPLETION_TOKENS]
+            self._spent.setdefault(user_id, []).append(reservation)
+            entry["tasks"][answer] = asyncio.ensure_future(
+                self._run(state, character_name, answer, difficulty_level, reservation))
+            self.scheduled += 1
+        if entry["tasks"]:
+            self._candidates[user_id] = entry
+        return list(entry["tasks"])
+
+    async def _run(self, state, character_name, answer, difficulty_level, reservation):
+        prompt, response = await self.generate(state, character_name, answer, difficulty_level)
+        reservation[1] = estimate_tokens(prompt) + estimate_tokens(response)
+        return response, reservation[1]
+
+    async def take(self, user_id, user_input, character_name, version):
+        """真实回答到来时调用：命中返回候选的 LLM 输出，未命中返回 None；该用户的其余候选都会被丢弃"""
+        entry = self._candidates.pop(user_id, None)
+        if entry is None:
+            return None
+        answer = match_answer(user_input, list(entry["tasks"]))
+        task = entry["tasks"].pop(answer, None) if answer else None
+        self._drop(entry["tasks"].values())
+        if task is None or entry["version"] != version or entry["character"] != (character_name or "").lower():
+            if task is not None:
+                self._drop([task])
+            self.misses += 1
+            return None
+        try:
+            # 还在生成中的候选也比重新请求快，直接等待它完成
+            response, tokens = await task
+        except Exception as e:
+            logger.warning("Speculative chapter failed: %s", e)
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.used_tokens += tokens
+        return response
+
+    def discard(self, user_id):
+        entry = self._candidates.pop(user_id, None)
+        if entry is not None:
+            self._drop(entry["tasks"].values())
+
+    def _drop(self, tasks):
+        # 取消并不能停下已经发出的上游请求（LLM 缓存的共享调用、已经发出的批次都会跑完），
+        # 所以不取消，等它完成后按实际的 prompt + 输出计入浪费；结果仍会进入 LLM 缓存
+        for task in tasks:
+            task.add_done_callback(self._count_wasted)
+
+    def _count_wasted(self, task):
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logger.debug("Discarded speculative chapter failed: %s", task.exception())
+            return
+        self.wasted_tokens += task.result()[1]
+
+    def stats(self):
+        resolved = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "scheduled": self.scheduled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / resolved if resolved else 0.0,
+            "skipped_budget": self.skipped_budget,
+            "used_tokens": self.used_tokens,
+            "wasted_tokens": self.wasted_tokens,
+        }
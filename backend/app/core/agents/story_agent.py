@@ -1,51 +1,102 @@
-import os
 import json
-from jinja2 import Template
-from langchain.prompts import PromptTemplate
-from langchain_openai import OpenAI
-from langchain.memory import ConversationBufferMemory
-from app.core.memory.session_manager import (
-    get_story_state, add_story_state, 
-    get_conversation_memory, add_conversation_memory, 
-    get_user_character, update_user_character
+import asyncio
+import copy
+import functools
+import inspect
+import logging
+import time
+import uuid
+from app.core.memory.session_cache import sessions
+from app.core.memory.story_state import (
+    load_story_state, update_story_state, render_story_context, dump_story_state
 )
-from app.core.rendering.image_controller import generate_image
-from dotenv import load_dotenv
-
-# 加载 .env 文件中的环境变量
-load_dotenv()
-
-# 读取 OpenAI API 密钥
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("请设置环境变量 OPENAI_API_KEY，否则无法调用 OpenAI API！")
-
-# 初始化 OpenAI LLM
-llm = OpenAI(api_key=api_key)
-
-# 读取对话模板
-with open("app/utils/prompts/dialog.jinja2", "r", encoding="utf-8") as file:
-    PROMPT_TEMPLATE = Template(file.read())
+from app.core.memory.conversation_summary import get_conversation_context, schedule_summary_refresh
+from app.core.agents.intent_classifier import classify_intent
+from app.core.clients import get_llm
+from app.core.config import get_settings
+from app.core.agents.speculation import Speculator
+from app.core.agents.structured_output import parse_structured, split_question
+from app.models.schemas import DialogResult, StoryResult
+from app.core.jobs.job_queue import job_queue
+from app.core.rendering.image_controller import FULL_TIER, PREVIEW_TIER, generate_image
+from app.core.rendering.media_store import record_audio
+from app.core.rendering.character_assets import character_image_path
+from app.core.resilience import backends, cap_timeout
+from app.utils.metrics import DB_SECONDS, LLM_TOKENS, STAGE_ERRORS, STAGE_SECONDS, timed
+from app.utils.templates import get_template
+from app.utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 对话和故事生成的提示词模板（包内相对路径，第一次使用时编译）
+DIALOG_TEMPLATE = "dialog.jinja2"
+STORY_TEMPLATE = "generate_story.jinja2"
+
+# 图片和语音互不依赖，并发生成；单个任务超时后只返回已完成的部分
+IMAGE_TASK_TIMEOUT = get_settings().image_task_timeout
+TTS_TASK_TIMEOUT = get_settings().tts_task_timeout
+
+
+async def invoke_llm(stage, prompt, **kwargs):
+    """调用 LLM，记录耗时和估算的 prompt / completion token 数"""
+    LLM_TOKENS.inc(estimate_tokens(prompt), call=stage, kind="prompt")
+    with timed(stage):
+        response = await get_llm().ainvoke(prompt, **kwargs)
+    LLM_TOKENS.inc(estimate_tokens(response or ""), call=stage, kind="completion")
+    return response
+
+
+async def process_user_input(user_id, user_input, turn=None):
+    """处理用户输入，并从 LLM 生成响应
+
+    传入 turn 字典时，对话记录先暂存在 turn 里，由调用方和本轮其他写入一起提交。
+    """
+    # 明显的输入（只说了角色名、“继续”等）由本地分类器直接判断，省掉一次对话 LLM 调用
+    current_character = (await sessions.get(user_id)).character
+    with timed("intent_classifier"):
+        fast_intent = classify_intent(user_input, current_character)
+    if fast_intent is not None:
+        logger.info("Fast intent %s (character=%s, confidence=%.2f)", fast_intent["intent"],
+                    fast_intent["character"], fast_intent["confidence"],
+                    extra={"user_id": user_id, "intent_source": fast_intent["source"]})
+        response_json = {
+            "intent": fast_intent["intent"],
+            "character": fast_intent["character"],
+            "next_action": "generate_story",
+            "reply": None,
+            "source": fast_intent["source"],
+        }
+    else:
+        response_json = await _llm_intent(user_id, user_input)
 
-# 读取故事生成模板
-with open("app/utils/prompts/generate_story.jinja2", "r", encoding="utf-8") as file:
-    STORY_PROMPT_TEMPLATE = Template(file.read())
+    intent = response_json.get("intent")
+    character = response_json.get("character")
+    next_action = response_json.get("next_action")
+    reply = response_json.get("reply")
+    
+    # 记录对话历史
+    if turn is None:
+        await sessions.record_turn(user_id, conversation=(user_input, json.dumps(response_json)))
+    else:
+        turn["conversation"] = (user_input, json.dumps(response_json))
 
-# 初始化 LangChain 内存
-conversation_memory = ConversationBufferMemory(memory_key="conversation_history")
+    return intent, character, next_action, reply
 
 
-def process_user_input(user_id, user_input):
-    """处理用户输入，并从 LLM 生成响应"""
-    conversation_history = get_conversation_memory(user_id)
+async def _llm_intent(user_id, user_input):
+    """调用对话 LLM 识别意图，返回解析后的 JSON"""
+    # 滚动摘要 + 摘要之后的最近几轮对话，prompt 长度不随会话变长而增长
+    conversation_summary, conversation_history = await get_conversation_context(user_id)
     #current_state = get_story_state(user_id) or "Once upon a time..."
 
     # 渲染 Jinja2 提示词模板
-    prompt = PROMPT_TEMPLATE.render(
-        user_input=user_input,
-        conversation_history=conversation_history,
-        #current_state=current_state
-    )
+    with timed("prompt_render", prompt="dialog"):
+        prompt = get_template(DIALOG_TEMPLATE).render(
+            user_input=user_input,
+            conversation_summary=conversation_summary,
+            conversation_history=conversation_history,
+            #current_state=current_state
+        )
     # 创建 LangChain PromptTemplate
     #prompt_template = PromptTemplate(
     #    input_variables=["user_input", "conversation_history"],# "current_state"], 
@@ -59,55 +110,41 @@ def process_user_input(user_id, user_input):
         #"current_state": current_state
     #}
     #)
-    response = llm.invoke(prompt)
-    print("control agent Info:===>", llm)
+    response = await invoke_llm("intent_llm", prompt)
 
     if response is None:
-        print("\n⚠️ Warning: LLM returned None!\n")
+        logger.warning("Intent LLM returned None", extra={"user_id": user_id})
     elif isinstance(response, str) and response.strip() == "":
-        print("\n⚠️ Warning: LLM returned an empty string!\n")
+        logger.warning("Intent LLM returned an empty string", extra={"user_id": user_id})
     else:
-        print("response:======>", response)
-
-    # 解析 JSON 响应
-    try:
-        # 尝试将字符串转换为 JSON（Python 字典）
-        response_json = json.loads(response)
-        print("response JSON 转换成功！")
-    except json.JSONDecodeError as e:
-        # 如果转换失败，捕获异常并打印错误信息
-        print("JSON 转换失败！")
-        print(f"错误信息：{e}")
-        response_json = json.loads(json.dumps({
+        logger.debug("Intent LLM response: %s", response)
+
+    # 解析 JSON 响应：先在本地修复格式问题；不是 JSON 的纯文本当作对孩子说的话
+    result, status = parse_structured(response, DialogResult, text_field="reply")
+    if result is None:
+        STAGE_ERRORS.inc(stage="intent_parse", error="unparseable")
+        logger.warning("Intent response could not be parsed", extra={"user_id": user_id})
+        return {
         'intent': 'user_dialogue', 
         'reply': 'I am sorry, I am not able to understand you. do you like Cinderella?'
-        }))
-    intent = response_json.get("intent")
-    character = response_json.get("character")
-    next_action = response_json.get("next_action")
-    reply = response_json.get("reply")
-    
-    # 记录对话历史
-    add_conversation_memory(user_id, user_input, json.dumps(response_json))
-
-    return intent, character, next_action, reply
+        }
+    logger.debug("Intent response parsed (%s)", status)
+    return result.model_dump()
 
 
-def generate_story(user_id, user_input, character_name, difficulty_level=3):
-    """生成故事"""
-    conversation_history = get_conversation_memory(user_id)
-    current_state = get_story_state(user_id) or "Once upon a time..."
+def render_story_prompt(state, character_name, user_input, difficulty_level=3):
+    """根据结构化的故事状态渲染故事生成的提示词"""
+    # 结构化的故事状态，渲染成长度有上限的上下文
+    current_state = render_story_context(state) or "Once upon a time..."
 
     # 渲染 Jinja2 提示词模板
-    prompt = STORY_PROMPT_TEMPLATE.render(
-        difficulty_level=difficulty_level,
-        character_name=character_name,
-        current_state=current_state,
-        last_question_answer=user_input
-    )
-    print("*************")
-    print("prompt:======>", character_name,prompt)
-    print("*************")
+    with timed("prompt_render", prompt="story"):
+        prompt = get_template(STORY_TEMPLATE).render(
+            difficulty_level=difficulty_level,
+            character_name=character_name,
+            current_state=current_state,
+            last_question_answer=user_input
+        )
     # 创建 PromptTemplate
     #prompt_template = PromptTemplate(
     #    input_variables=["difficulty_level", "character_name", "character_source", "current_state", "conversation_history"], 
@@ -123,88 +160,306 @@ def generate_story(user_id, user_input, character_name, difficulty_level=3):
     #    "current_state": current_state,
     #    "conversation_history": conversation_history
     #})
-    
-    response = llm.invoke(prompt,max_tokens=1000)
-    try:
-        # 尝试将字符串转换为 JSON（Python 字典）
-        response_json = json.loads(response)
-        story_data = {'story_text': response_json.get("Story")+"-->"+response_json.get("Question")}
-        print("story JSON 转换成功！")
-    except json.JSONDecodeError as e:
-        # 如果转换失败，捕获异常并打印错误信息
-        print("story JSON 转换失败！")
-        print(f"错误信息：{e}")
-        story_data = {'story_text': response}
-
-    add_story_state(user_id, "child reply:"+user_input+" "+response)
-    return story_data
+    return prompt
+
+
+async def _generate_candidate(state, character_name, answer, difficulty_level):
+    """推测式生成：用假设的回答生成候选的下一章，不写入任何状态"""
+    prompt = render_story_prompt(state, character_name, answer, difficulty_level)
+    return prompt, await invoke_llm("speculative_story_llm", prompt, max_tokens=1000)
+
 
+speculator = Speculator(_generate_candidate)
 
-def generate_image_task(story_text, character_name):
-    """生成故事对应的图片"""
-    print("DBG===> starting generate image")
-    character_image_path = f"character_images/{character_name.lower()}.png"
-    return generate_image(story_text, character_image_path)
 
+async def generate_story(user_id, user_input, character_name, difficulty_level=3, turn=None):
+    """生成故事"""
+    state = load_story_state((await sessions.get(user_id)).story_state)
+
+    # 孩子的回答和提前生成的候选章节一致时直接使用，省掉一次故事 LLM 调用
+    response = await speculator.take(user_id, user_input, character_name, state["chapter_count"])
+    if response is not None:
+        logger.info("Speculative chapter hit", extra={"user_id": user_id})
+    else:
+        prompt = render_story_prompt(state, character_name, user_input, difficulty_level)
+        logger.debug("Story prompt for %s: %s", character_name, prompt)
+        response = await invoke_llm("story_llm", prompt, max_tokens=1000)
+
+    # 字段名大小写、代码块、截断等问题在本地修复；实在不是 JSON 时整段文本当作故事
+    result, status = parse_structured(response, StoryResult, text_field="story")
+    if result is None:
+        STAGE_ERRORS.inc(stage="story_parse", error="unparseable")
+        logger.warning("Story response could not be parsed", extra={"user_id": user_id})
+        story, question, words = response or "", None, []
+    else:
+        logger.debug("Story response parsed (%s)", status)
+        story, question = result.story, result.question
+        if question is None:
+            story, question = split_question(story)
+        words = [result.word1, result.word2, result.word3]
+    story_data = {'story_text': f"{story}-->{question}" if question else story}
+
+    # 只保存解析后的章节摘要、角色、单词和未回答的问题，而不是原始 LLM 输出
+    update_story_state(state, character_name, user_input, story, question, words)
+    new_state = dump_story_state(state)
+    if turn is None:
+        await sessions.record_turn(user_id, story_state=new_state)
+    else:
+        turn["story_state"] = new_state
 
-def generate_tts_task(response_text):
-    """生成故事的语音"""
-    from app.core.rendering.tts_controller import generate_tts
-    print("DBG===> starting generate tts")
-    return generate_tts(response_text, voice="fable")
+    # 章节发出后，在后台为最可能的回答提前生成下一章
+    speculator.schedule(user_id, copy.deepcopy(state), character_name, question, difficulty_level)
+    return story_data
 
 
-def process_with_langchain(user_id, user_input):
+async def generate_image_task(story_text, character_name, user_id=None, turn_id=None, with_preview=True):
+    """生成故事对应的图片：预览图和完整渲染同时开始，预览图先到时先产出 image_preview，最后产出 image_url"""
+    path = character_image_path(character_name)
+    started = time.perf_counter()
+    full = asyncio.ensure_future(generate_image(story_text, path, user_id, FULL_TIER, turn_id))
+    preview = None
+    if with_preview and PREVIEW_TIER is not None:
+        preview = asyncio.ensure_future(generate_image(story_text, path, user_id, PREVIEW_TIER, turn_id))
+    try:
+        if preview is not None:
+            await asyncio.wait({preview, full}, return_when=asyncio.FIRST_COMPLETED)
+            # 完整渲染先完成（或预览失败）时不再发预览图
+            if not full.done() and preview.done() and not preview.exception() and preview.result():
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage="image_preview")
+                yield "image_preview", preview.result()
+        image_url = await full
+        if image_url is None and preview is not None:
+            # 完整渲染失败（例如熔断试探期间被拒绝）时用预览图代替
+            image_url = await preview
+    finally:
+        for task in (preview, full):
+            if task is not None:
+                task.cancel()
+    STAGE_SECONDS.observe(time.perf_counter() - started, stage="image")
+    if image_url is None:
+        STAGE_ERRORS.inc(stage="image", error="no_image")
+    yield "image_url", image_url
+
+
+async def generate_tts_task(response_text):
+    """生成故事的语音：分句并行合成，按顺序产出每一段，最后产出拼接好的完整音频"""
+    from app.core.rendering.tts_controller import iter_tts_chunks, stitch_audio
+    started = time.perf_counter()
+    playlist = []
+    async for index, url in iter_tts_chunks(response_text, voice="fable"):
+        if not playlist:
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage="tts_first_chunk")
+        playlist.append(url)
+        yield "audio_segment", {"index": index, "url": url}
+    yield "audio_playlist", playlist
+    audio_url = await stitch_audio(playlist)
+    STAGE_SECONDS.observe(time.perf_counter() - started, stage="tts")
+    yield "audio_url", audio_url
+
+
+async def _drain_media_source(final_key, result, timeout, queue):
+    """把一个媒体任务的结果放进队列；任务可以是协程（只有最终结果）或逐步产出的异步生成器"""
+    produced_final = False
+    try:
+        async with asyncio.timeout(timeout):
+            if inspect.isasyncgen(result):
+                async for key, value in result:
+                    produced_final = produced_final or key == final_key
+                    await queue.put((key, value))
+            else:
+                await queue.put((final_key, await result))
+                produced_final = True
+    except TimeoutError:
+        STAGE_ERRORS.inc(stage=final_key, error="timeout")
+        logger.warning("%s task timed out after %ss", final_key, timeout)
+    except Exception as e:
+        STAGE_ERRORS.inc(stage=final_key, error=type(e).__name__)
+        logger.warning("%s task failed: %s", final_key, e)
+    finally:
+        if not produced_final:
+            await queue.put((final_key, None))
+        await queue.put(None)
+
+
+async def iter_media(story_text, character_name=None, with_image=True,
+                     image_backend=None, tts_backend=None,
+                     image_timeout=None, tts_timeout=None, user_id=None, turn_id=None, with_audio=True):
+    """并发生成图片和语音，按完成的先后顺序产出 (key, value)
+
+    最终结果是 image_url / audio_url（超时或失败的为 None），图片可能先产出 image_preview，
+    语音还会先逐段产出 audio_segment。
+    """
+    image_backend = image_backend or functools.partial(generate_image_task, user_id=user_id, turn_id=turn_id)
+    tts_backend = tts_backend or generate_tts_task
+
+    # 两个任务同时开始，各自有独立的超时（不超过请求剩余的时间），总等待时间是较慢任务的耗时而不是两者之和
+    queue = asyncio.Queue()
+    tasks = []
+    if with_audio:
+        tasks.append(asyncio.ensure_future(_drain_media_source(
+            "audio_url", tts_backend(story_text),
+            cap_timeout(TTS_TASK_TIMEOUT if tts_timeout is None else tts_timeout), queue)))
+    if with_image:
+        tasks.append(asyncio.ensure_future(_drain_media_source(
+            "image_url", image_backend(story_text, character_name),
+            cap_timeout(IMAGE_TASK_TIMEOUT if image_timeout is None else image_timeout), queue)))
+
+    remaining = len(tasks)
+    try:
+        while remaining:
+            item = await queue.get()
+            if item is None:
+                remaining -= 1
+            else:
+                yield item
+    finally:
+        # 调用方提前停止（例如流式请求的客户端断开）时取消还没完成的任务
+        for task in tasks:
+            task.cancel()
+
+
+def degraded_media(with_image=True):
+    """熔断中的媒体后端本轮直接跳过（只返回文字），不再等它失败或超时"""
+    skipped = []
+    if with_image and not backends["image"].available:
+        skipped.append("image")
+    if not backends["tts"].available:
+        skipped.append("audio")
+    for media in skipped:
+        STAGE_ERRORS.inc(stage=media, error="circuit_open")
+    return skipped
+
+
+async def generate_media(story_text, character_name=None, with_image=True, **kwargs):
+    """并发生成图片和语音，返回 image_url / audio_url / audio_playlist（超时或失败的为 None）"""
+    media = {}
+    async for key, value in iter_media(story_text, character_name, with_image, **kwargs):
+        if key != "audio_segment":
+            media[key] = value
+    return media
+
+
+async def _image_job(payload):
+    # 后台任务的结果只在完成后才能查询到，预览图没有意义；上游错误原样抛出，由任务队列判断是否重试
+    with timed("image"):
+        image_url = await generate_image(payload["story_text"], character_image_path(payload["character"]),
+                                         payload.get("user_id"), FULL_TIER, payload.get("turn_id"),
+                                         raise_errors=True)
+    if image_url is None:
+        raise RuntimeError("image generation returned no image")
+    return {"image_url": image_url}
+
+
+async def _tts_job(payload):
+    media = {}
+    async for key, value in generate_tts_task(payload["story_text"]):
+        media[key] = value
+    if not media.get("audio_url"):
+        raise RuntimeError("TTS returned no audio")
+    with timed("record_audio", DB_SECONDS):
+        await asyncio.to_thread(record_audio, payload.get("user_id"), media["audio_url"])
+    return {"audio_url": media["audio_url"], "audio_playlist": media["audio_playlist"]}
+
+
+job_queue.register("image", _image_job)
+job_queue.register("tts", _tts_job)
+
+
+async def enqueue_media_jobs(user_id, story_text, character_name=None, with_image=True, turn_id=None,
+                             with_audio=True):
+    """把图片和语音交给后台任务队列，立即返回任务 ID"""
+    jobs = {}
+    if with_audio:
+        jobs["audio_job_id"] = await job_queue.enqueue(
+            user_id, "tts", {"story_text": story_text, "user_id": user_id})
+    if with_image:
+        jobs["image_job_id"] = await job_queue.enqueue(
+            user_id, "image", {"story_text": story_text, "character": character_name,
+                               "user_id": user_id, "turn_id": turn_id})
+    return jobs
+
+
+async def process_with_langchain(user_id, user_input, defer_media=False):
     """主逻辑：处理用户输入，执行对应任务"""
-    intent, character, next_action, reply = process_user_input(user_id, user_input)
-    print(f"Intent: ====> {intent}, Character: {character}, Next Action: {next_action}, reply :{reply}")
+    story_data = {}
+    async for event in process_events(user_id, user_input, defer_media):
+        if event["event"] in ("story", "degraded", "image_preview", "image_url", "audio_url", "audio_playlist",
+                              "jobs"):
+            story_data.update({k: v for k, v in event.items() if k != "event"})
+    return story_data
+
+
+async def process_events(user_id, user_input, defer_media=False):
+    """主逻辑的流式版本：意图、故事文本、图片、语音依次在就绪时产出事件
 
+    defer_media 为 True 时不等待媒体生成，而是产出 jobs 事件，媒体结果通过 /story/jobs/{id} 查询。
+    """
+    turn = {}
+    started = time.perf_counter()
+    try:
+        async for event in _intent_events(user_id, user_input, turn, defer_media):
+            yield event
+    finally:
+        # 本轮的对话记录和故事状态一起记到会话上，由会话缓存在后台和其他写入一起落库
+        if turn:
+            await sessions.record_turn(user_id, **turn)
+            schedule_summary_refresh(user_id, get_llm())
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="turn")
+
+
+async def _intent_events(user_id, user_input, turn, defer_media=False):
+    intent, character, next_action, reply = await process_user_input(user_id, user_input, turn)
+    logger.info("Intent %s, character %s, next action %s", intent, character, next_action,
+                extra={"user_id": user_id})
+    yield {"event": "intent", "intent": intent, "character": character,
+           "next_action": next_action, "reply": reply}
+
+    with_image = True
     if True: # intent == "choose_character":
-        # 更新用户选择的角色
-        update_user_character(user_input, character)
+        # 更新用户选择的角色；意图里没有角色时沿用会话里的角色
+        character = character or (await sessions.get(user_id)).character or "Cinderella"
+        await sessions.update_character(user_id, character)
         
         # 生成故事    user_id, user_input, character_name, difficulty_level=5
-        story_data = generate_story(user_id, user_input, character)
-        print(f"Story Text: {story_data['story_text']}")
-
-        # 生成图片 & 语音
-        story_data['image_url'] = generate_image_task(story_data["story_text"], character)
-        story_data['audio_url'] = generate_tts_task(story_data["story_text"])
-        print("DBG==> finish generate image and tts")
-        return story_data
+        story_data = await generate_story(user_id, user_input, character, turn=turn)
     elif intent == "continue_story":
-        character_name = get_user_character(user_id) or "Cinderella"
-        update_user_character(user_id, character_name)
+        character = (await sessions.get(user_id)).character or "Cinderella"
+        await sessions.update_character(user_id, character)
 
         # 生成故事
-        story_data = generate_story(user_id, user_input, character_name)
-        print(f"Story Text: {story_data['story_text']}")
-
-        # 生成图片 & 语音
-        story_data['image_url'] = generate_image_task(story_data["story_text"],character_name)
-        story_data['audio_url'] = generate_tts_task(story_data["story_text"])
-
-        return story_data
-
+        story_data = await generate_story(user_id, user_input, character, turn=turn)
     elif intent == "change_character":
-        update_user_character(user_id, character)
-        print(f"Change Character: {character}")
-        story_data = generate_story(user_id, user_input, character)
-        print(f"Story Text: {story_data['story_text']}")
-
-        # 生成图片 & 语音
-        story_data['image_url'] = generate_image_task(story_data["story_text"],character_name)
-        story_data['audio_url'] = generate_tts_task(story_data["story_text"])
-
-        return story_data
-    elif intent == 'ask_question':
-        story_data = {}
-        story_data['story_text'] = reply
-        story_data['audio_url'] = generate_tts_task(story_data["story_text"])
-        return story_data
-    else:   #"user_dialogue"
-        story_data = {}
-        story_data['story_text'] = reply
-        story_data['audio_url'] = generate_tts_task(story_data["story_text"])
-        return story_data
-
+        await sessions.update_character(user_id, character)
+        logger.info("Change character to %s", character, extra={"user_id": user_id})
+        story_data = await generate_story(user_id, user_input, character, turn=turn)
+    else:   # "ask_question" / "user_dialogue"：直接朗读回复，不生成图片
+        story_data = {'story_text': reply}
+        with_image = False
+    logger.debug("Story text: %s", story_data['story_text'])
+    yield {"event": "story", **story_data}
+
+    # 图片或语音的后端熔断时降级：这一轮只有文字（或者只少图片），而不是拖慢或者整轮失败
+    degraded = degraded_media(with_image)
+    if degraded:
+        logger.info("Skipping %s, backend unavailable", ", ".join(degraded), extra={"user_id": user_id})
+        yield {"event": "degraded", "degraded": degraded}
+    with_image = with_image and "image" not in degraded
+    with_audio = "audio" not in degraded
+
+    # 同一轮生成的预览图和完整图片用 turn_id 关联
+    turn_id = uuid.uuid4().hex
+    if defer_media:
+        jobs = await enqueue_media_jobs(user_id, story_data["story_text"], character, with_image, turn_id,
+                                        with_audio)
+        yield {"event": "jobs", **jobs}
+        yield {"event": "done"}
+        return
+
+    # 并发生成图片 & 语音，哪个先完成先发哪个；图片先发预览图，语音按段发送，第一段合成完就可以开始播放
+    async for key, value in iter_media(story_data["story_text"], character, with_image,
+                                       user_id=user_id, turn_id=turn_id, with_audio=with_audio):
+        if key == "audio_url":
+            with timed("record_audio", DB_SECONDS):
+                await asyncio.to_thread(record_audio, user_id, value)
+        yield {"event": key, key: value}
+    yield {"event": "done"}
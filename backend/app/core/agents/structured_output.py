@@ -0,0 +1,221 @@
+import ast
+import json
+import re
+from collections import Counter
+
+from pydantic import ValidationError
+
+# LLM 的 JSON 输出经常带代码块、前后说明文字、大小写不一致的字段名，或者因为 max_tokens 被截断。
+# 这里尽量在本地修复并校验，而不是丢掉一次又慢又贵的生成结果。
+
+# 统一成小写下划线后的字段别名
+KEY_ALIASES = {
+    "story_text": "story",
+    "chapter": "story",
+    "content": "story",
+    "text": "story",
+    "questions": "question",
+    "nextaction": "next_action",
+    "action": "next_action",
+    "response": "reply",
+    "answer": "reply",
+    "character_name": "character",
+    "role": "character",
+}
+# 单词可能以列表形式给出
+WORD_LIST_KEYS = ("words", "vocabulary", "vocab", "key_words", "keywords")
+
+_FENCE = re.compile(r"```[a-zA-Z]*\s*(.*?)```", re.S)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+_PY_LITERALS = re.compile(r"\b(True|False|None)\b")
+_SENTENCE = re.compile(r"[^.!?。！？]*[?？]\s*$")
+
+# 统计每种模型的解析结果：ok / repaired / labels / text / failed
+parse_stats = Counter()
+
+
+def normalize_key(key):
+    key = re.sub(r"[\s\-]+", "_", str(key).strip().strip("*#").strip()).lower()
+    return KEY_ALIASES.get(key, key)
+
+
+def normalize_keys(data):
+    """字段名统一成小写，单词列表展开成 word1..word3"""
+    normalized = {}
+    for key, value in data.items():
+        key = normalize_key(key)
+        if key in WORD_LIST_KEYS and isinstance(value, list):
+            for i, word in enumerate(value[:3], start=1):
+                normalized.setdefault(f"word{i}", word)
+            continue
+        # 重复的字段（如 Story 和 story）保留第一个非空值
+        if normalized.get(key) in (None, ""):
+            normalized[key] = value
+    return normalized
+
+
+def _find_object(text):
+    """返回第一个 JSON 对象的文本；被截断时返回到结尾的部分"""
+    start = text.find("{")
+    if start < 0:
+        return None
+    depth, in_string, escaped = 0, False, False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]
+
+
+def _close_truncated(text):
+    """补全被截断的字符串和括号"""
+    stack, in_string, escaped = [], False, False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    if escaped:
+        text = text[:-1]
+    if in_string:
+        text += '"'
+    text = re.sub(r"[,:\s]+$", "", text)
+    # 以键名结尾（"key" 后面没有值）时补一个 null
+    if re.search(r'[{,]\s*"[^"]*"$', text):
+        text += ": null"
+    return text + "".join(reversed(stack))
+
+
+def _loads(candidate):
+    try:
+        value = json.loads(candidate, strict=False)
+    except json.JSONDecodeError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def _literal_eval(candidate):
+    # 单引号的 Python 字典写法
+    try:
+        value = ast.literal_eval(candidate)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def extract_json(text):
+    """从 LLM 输出里取出 JSON 对象，返回 (dict, 是否经过修复)；找不到时返回 (None, False)"""
+    if not text:
+        return None, False
+    text = text.strip()
+    fenced = _FENCE.search(text)
+    candidate = _find_object(fenced.group(1) if fenced else text)
+    if candidate is None:
+        return None, False
+
+    data = _loads(candidate)
+    if data is not None:
+        return data, candidate != text
+
+    repairs = (
+        lambda s: s.translate(_SMART_QUOTES),
+        lambda s: _TRAILING_COMMA.sub(r"\1", s),
+        _close_truncated,
+        lambda s: _PY_LITERALS.sub(lambda m: {"True": "true", "False": "false", "None": "null"}[m.group(1)], s),
+    )
+    repaired = candidate
+    for repair in repairs:
+        repaired = repair(repaired)
+        data = _loads(repaired) or _literal_eval(repaired)
+        if data is not None:
+            return data, True
+    return None, False
+
+
+def extract_labels(text, fields):
+    """没有 JSON 时，按 "Story: ..." / "**Question**: ..." 这样的标签提取字段"""
+    names = sorted({name for name in fields} | {alias for alias, name in KEY_ALIASES.items() if name in fields},
+                   key=len, reverse=True)
+    label = re.compile(r"^[\s*#>-]*(%s)[\s*]*[:：]\s*" % "|".join(re.escape(n) for n in names), re.I | re.M)
+    matches = list(label.finditer(text))
+    data = {}
+    for match, following in zip(matches, matches[1:] + [None]):
+        end = following.start() if following else len(text)
+        value = text[match.end():end].strip().strip("*").strip()
+        data.setdefault(normalize_key(match.group(1)), value)
+    return data
+
+
+def _coerce(data, model):
+    """只保留模型里的字段，把数字、列表等转成字符串"""
+    coerced = {}
+    for name in model.model_fields:
+        value = data.get(name)
+        if value is None or isinstance(value, str):
+            coerced[name] = value.strip() if isinstance(value, str) else None
+        elif isinstance(value, (list, tuple)):
+            coerced[name] = ", ".join(str(v) for v in value)
+        else:
+            coerced[name] = str(value)
+    return {k: v for k, v in coerced.items() if v not in (None, "")}
+
+
+def _validate(data, model):
+    try:
+        return model.model_validate(_coerce(data, model))
+    except ValidationError:
+        return None
+
+
+def parse_structured(text, model, text_field=None):
+    """把 LLM 输出解析成 pydantic 模型，返回 (result, status)
+
+    依次尝试：直接解析 JSON、修复后的 JSON、按标签提取；
+    都不行时如果给了 text_field，把整段文本放进这个字段。全部失败返回 (None, "failed")。
+    """
+    fields = list(model.model_fields)
+    data, repaired = extract_json(text)
+    status = "repaired" if repaired else "ok"
+    if data is None:
+        data, status = extract_labels(text or "", fields), "labels"
+    data = normalize_keys(data)
+
+    result = _validate(data, model) if data else None
+    if result is None and text_field and text and text.strip():
+        # 模型没有按格式输出，但内容本身（故事正文或对孩子说的话）仍然可用
+        result, status = _validate({**data, text_field: data.get(text_field) or text.strip()}, model), "text"
+    if result is None:
+        status = "failed"
+    parse_stats[f"{model.__name__}.{status}"] += 1
+    return result, status
+
+
+def split_question(story):
+    """故事里没有单独的问题字段时，把结尾的问句拆出来"""
+    match = _SENTENCE.search(story or "")
+    if not match or match.start() == 0:
+        return story, None
+    return story[:match.start()].rstrip(), match.group(0).strip()
@@ -0,0 +1,71 @@
+import logging
+
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# 共享的上游客户端，第一次使用时才创建（LangChain / openai 的导入本身就要几百毫秒），
+# 缺少 API key 时也只在真正调用时报错，而不是导入模块时。
+
+_llm = None
+_openai_client = None
+_http_client = None
+
+
+def get_llm():
+    """故事和对话共用的 LLM，带响应缓存，未命中缓存的请求和其他用户的并发请求攒批发送"""
+    global _llm
+    if _llm is None:
+        from langchain_openai import OpenAI
+        from app.core.agents.llm_batcher import llm_batcher
+        from app.core.agents.llm_cache import CachedLLM, llm_cache
+
+        settings = get_settings()
+        if not settings.openai_api_key:
+            raise ValueError("请设置环境变量 OPENAI_API_KEY，否则无法调用 OpenAI API！")
+        # 相同的 prompt（重试、重复点击、重复的演示会话）直接复用缓存，并发的相同请求只调用一次上游。
+        # 重试和超时由 app.core.resilience 统一处理，客户端自己不再重试
+        llm_batcher.llm = OpenAI(api_key=settings.openai_api_key, base_url=settings.openai_base_url,
+                                 max_retries=0)
+        _llm = CachedLLM(llm_batcher, llm_cache, enabled=settings.llm_cache_enabled)
+    return _llm
+
+
+def get_openai_client():
+    """异步 OpenAI 客户端（TTS），请求不会阻塞事件循环"""
+    global _openai_client
+    if _openai_client is None:
+        import openai
+
+        settings = get_settings()
+        _openai_client = openai.AsyncOpenAI(api_key=settings.openai_api_key, base_url=settings.openai_base_url,
+                                            max_retries=0)
+    return _openai_client
+
+
+def get_http_client():
+    """复用连接池的异步 HTTP 客户端（图片生成）"""
+    global _http_client
+    if _http_client is None:
+        import httpx
+
+        _http_client = httpx.AsyncClient(timeout=None)
+    return _http_client
+
+
+def warm_clients():
+    """启动时在线程里创建客户端（导入 LangChain / openai），第一个请求不再承担这部分延迟"""
+    try:
+        get_llm()
+        get_openai_client()
+    except ValueError as e:
+        logger.warning("LLM client not configured: %s", e)
+
+
+async def aclose_clients():
+    global _llm, _openai_client, _http_client
+    if _openai_client is not None:
+        await _openai_client.close()
+    if _http_client is not None:
+        await _http_client.aclose()
+    _llm = _openai_client = _http_client = None
@@ -0,0 +1,161 @@
+import functools
+import os
+from dataclasses import dataclass, field, fields
+from typing import Optional
+
+# 所有配置集中在这里：每个字段对应一个环境变量。
+# 库模块导入时不做任何文件 I/O；backend/.env 由入口（run_agent.py 等）调用 load_env_file() 读取。
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _env(name, default, **kwargs):
+    return field(default=default, metadata={"env": name}, **kwargs)
+
+
+@dataclass(frozen=True)
+class Settings:
+    # 上游服务（*_BASE_URL / STABILITY_API_URL 可指向本地 stub 服务）
+    openai_api_key: Optional[str] = _env("OPENAI_API_KEY", None)
+    openai_base_url: Optional[str] = _env("OPENAI_BASE_URL", None)
+    stability_api_key: Optional[str] = _env("STABILITY_API_KEY", None)
+    stability_api_url: str = _env(
+        "STABILITY_API_URL",
+        "https://api.stability.ai/v1/generation/stable-diffusion-xl-1024-v1-0/image-to-image")
+    tts_model: str = _env("TTS_MODEL", "tts-1")
+
+    # 存储（默认路径都相对 backend/，和启动时的工作目录无关）
+    database: str = _env("STORYBOT_DB", os.path.join(BACKEND_DIR, "storybot.db"))
+    media_root: str = _env("MEDIA_ROOT", os.path.join(BACKEND_DIR, "static"))
+    db_pool_size: int = _env("STORYBOT_DB_POOL_SIZE", 5)
+    character_image_dir: str = _env("CHARACTER_IMAGE_DIR", os.path.join(BACKEND_DIR, "character_images"))
+
+    # 对话和故事上下文
+    conversation_history_turns: int = _env("CONVERSATION_HISTORY_TURNS", 20)
+    summary_recent_turns: int = _env("SUMMARY_RECENT_TURNS", 6)
+    summary_token_threshold: int = _env("SUMMARY_TOKEN_THRESHOLD", 800)
+    summary_max_words: int = _env("SUMMARY_MAX_WORDS", 150)
+    story_recent_chapters: int = _env("STORY_RECENT_CHAPTERS", 3)
+    story_earlier_chapters: int = _env("STORY_EARLIER_CHAPTERS", 6)
+    intent_fast_path_threshold: float = _env("INTENT_FAST_PATH_THRESHOLD", 0.9)
+
+    # 进程内的会话缓存：活跃会话的状态留在内存里，写入攒批后在后台落库
+    session_cache_size: int = _env("SESSION_CACHE_SIZE", 10000)
+    session_idle_seconds: float = _env("SESSION_IDLE_SECONDS", 1800.0)
+    session_flush_interval: float = _env("SESSION_FLUSH_INTERVAL", 1.0)
+
+    # LLM 缓存、批处理和推测式生成
+    llm_cache_enabled: bool = _env("LLM_CACHE_ENABLED", True)
+    llm_cache_max_entries: int = _env("LLM_CACHE_MAX_ENTRIES", 256)
+    llm_cache_ttl: float = _env("LLM_CACHE_TTL", 24 * 3600.0)
+    llm_batch_enabled: bool = _env("LLM_BATCH_ENABLED", True)
+    llm_batch_max_size: int = _env("LLM_BATCH_MAX_SIZE", 8)
+    llm_batch_window: float = _env("LLM_BATCH_WINDOW", 0.01)
+    llm_request_timeout: float = _env("LLM_REQUEST_TIMEOUT", 60.0)
+    speculation_enabled: bool = _env("SPECULATION_ENABLED", False)
+    speculation_top_k: int = _env("SPECULATION_TOP_K", 2)
+    speculation_token_budget: int = _env("SPECULATION_TOKEN_BUDGET", 6000)
+    speculation_budget_window: float = _env("SPECULATION_BUDGET_WINDOW", 600.0)
+
+    # 媒体生成
+    image_task_timeout: float = _env("IMAGE_TASK_TIMEOUT", 60.0)
+    # 图片分两档：先出低步数的预览图，再用完整渲染替换。SDXL 只接受 1024 的初始图，
+    # 想要更小的预览尺寸时把 IMAGE_PREVIEW_API_URL 指向支持 512 的引擎（例如 stable-diffusion-v1-6）
+    image_preview_enabled: bool = _env("IMAGE_PREVIEW_ENABLED", True)
+    image_preview_api_url: Optional[str] = _env("IMAGE_PREVIEW_API_URL", None)
+    image_preview_steps: int = _env("IMAGE_PREVIEW_STEPS", 10)
+    image_preview_size: int = _env("IMAGE_PREVIEW_SIZE", 1024)
+    image_preview_output_size: int = _env("IMAGE_PREVIEW_OUTPUT_SIZE", 384)
+    image_preview_quality: int = _env("IMAGE_PREVIEW_QUALITY", 60)
+    image_steps: int = _env("IMAGE_STEPS", 50)
+    image_size: int = _env("IMAGE_SIZE", 1024)
+    # 保存到 static/ 之前缩小并重新编码，减少前端下载的字节数
+    image_output_size: int = _env("IMAGE_OUTPUT_SIZE", 768)
+    image_quality: int = _env("IMAGE_QUALITY", 80)
+    image_output_format: str = _env("IMAGE_OUTPUT_FORMAT", "webp")
+    tts_task_timeout: float = _env("TTS_TASK_TIMEOUT", 30.0)
+    tts_cache_max_bytes: int = _env("TTS_CACHE_MAX_BYTES", 200 * 1024 * 1024)
+    tts_first_chunk_chars: int = _env("TTS_FIRST_CHUNK_CHARS", 120)
+    tts_chunk_chars: int = _env("TTS_CHUNK_CHARS", 400)
+    tts_chunk_concurrency: int = _env("TTS_CHUNK_CONCURRENCY", 4)
+    media_max_bytes: int = _env("MEDIA_MAX_BYTES", 2 * 1024 * 1024 * 1024)
+    media_max_age_seconds: float = _env("MEDIA_MAX_AGE_SECONDS", 7 * 24 * 3600.0)
+    media_in_use_seconds: float = _env("MEDIA_IN_USE_SECONDS", 3600.0)
+    media_janitor_interval: float = _env("MEDIA_JANITOR_INTERVAL", 600.0)
+
+    # 语音输入（本地 Whisper，CPU）：模型越大越准也越慢，tiny / base / small / medium
+    whisper_model: str = _env("WHISPER_MODEL", "base")
+    whisper_device: str = _env("WHISPER_DEVICE", "cpu")
+    whisper_language: Optional[str] = _env("WHISPER_LANGUAGE", None)
+    whisper_preload: bool = _env("WHISPER_PRELOAD", False)
+    whisper_max_batch: int = _env("WHISPER_MAX_BATCH", 4)
+    whisper_batch_window: float = _env("WHISPER_BATCH_WINDOW", 0.05)
+    whisper_max_upload_bytes: int = _env("WHISPER_MAX_UPLOAD_BYTES", 25 * 1024 * 1024)
+
+    # 上游调用的弹性策略：每个后端的并发上限、令牌桶限速（每秒请求数，0 表示不限）和单次请求超时，
+    # 共用的重试（带抖动的指数退避）和熔断参数
+    llm_concurrency: int = _env("LLM_CONCURRENCY", 16)
+    llm_rate_limit: float = _env("LLM_RATE_LIMIT", 0.0)
+    llm_rate_burst: int = _env("LLM_RATE_BURST", 10)
+    image_concurrency: int = _env("IMAGE_CONCURRENCY", 8)
+    image_rate_limit: float = _env("IMAGE_RATE_LIMIT", 0.0)
+    image_rate_burst: int = _env("IMAGE_RATE_BURST", 8)
+    image_request_timeout: float = _env("IMAGE_REQUEST_TIMEOUT", 45.0)
+    tts_concurrency: int = _env("TTS_CONCURRENCY", 8)
+    tts_rate_limit: float = _env("TTS_RATE_LIMIT", 0.0)
+    tts_rate_burst: int = _env("TTS_RATE_BURST", 8)
+    tts_request_timeout: float = _env("TTS_REQUEST_TIMEOUT", 20.0)
+    backend_max_attempts: int = _env("BACKEND_MAX_ATTEMPTS", 3)
+    backend_retry_base_delay: float = _env("BACKEND_RETRY_BASE_DELAY", 0.5)
+    backend_retry_max_delay: float = _env("BACKEND_RETRY_MAX_DELAY", 8.0)
+    circuit_failure_threshold: int = _env("CIRCUIT_FAILURE_THRESHOLD", 5)
+    circuit_reset_timeout: float = _env("CIRCUIT_RESET_TIMEOUT", 30.0)
+
+    # 准入控制：同时处理的 /story/process* 请求上限（0 表示不限），超过时立即返回 503；
+    # 每个请求的截止时间（客户端可以用 X-Request-Timeout 头缩短）
+    max_in_flight_requests: int = _env("MAX_IN_FLIGHT_REQUESTS", 64)
+    request_timeout: float = _env("REQUEST_TIMEOUT", 120.0)
+    overload_retry_after: int = _env("OVERLOAD_RETRY_AFTER", 5)
+
+    # 后台任务：每种任务有自己的 worker，JOB_*_CONCURRENCY 是它的 worker 数，其他种类的任务用 JOB_WORKERS 个
+    job_workers: int = _env("JOB_WORKERS", 4)
+    job_max_attempts: int = _env("JOB_MAX_ATTEMPTS", 3)
+    job_retry_base_delay: float = _env("JOB_RETRY_BASE_DELAY", 1.0)
+    job_image_concurrency: int = _env("JOB_IMAGE_CONCURRENCY", 2)
+    job_tts_concurrency: int = _env("JOB_TTS_CONCURRENCY", 4)
+
+    # 日志
+    log_level: str = _env("LOG_LEVEL", "INFO")
+    log_format: str = _env("LOG_FORMAT", "text")
+
+    @classmethod
+    def from_env(cls, environ=None):
+        environ = os.environ if environ is None else environ
+        values = {}
+        for f in fields(cls):
+            raw = environ.get(f.metadata["env"])
+            if raw is None or raw == "":
+                continue
+            if f.type in (bool, "bool"):
+                values[f.name] = raw.strip().lower() in ("1", "true", "yes", "on")
+            elif f.type in (int, "int"):
+                values[f.name] = int(raw)
+            elif f.type in (float, "float"):
+                values[f.name] = float(raw)
+            else:
+                values[f.name] = raw
+        return cls(**values)
+
+
+def load_env_file(path=None):
+    """把 backend/.env 读进环境变量（已有的环境变量优先），需要在第一次 get_settings() 之前调用"""
+    from dotenv import load_dotenv
+
+    load_dotenv(path or os.path.join(BACKEND_DIR, ".env"))
+    get_settings.cache_clear()
+
+
+@functools.lru_cache(maxsize=None)
+def get_settings():
+    """进程内唯一的配置对象"""
+    return Settings.from_env()
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import logging
+import random
+import uuid
+
+from app.core.config import get_settings
+from app.core.memory.session_manager import pool
+from app.core.resilience import already_retried
+from app.utils.metrics import DB_SECONDS, timed
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+JOB_WORKERS = settings.job_workers
+JOB_MAX_ATTEMPTS = settings.job_max_attempts
+JOB_RETRY_BASE_DELAY = settings.job_retry_base_delay
+# 每种任务的 worker 数（并发上限），图片生成最慢也最贵，默认并发最小；没有单独配置的任务用 JOB_WORKERS 个
+JOB_CONCURRENCY = {
+    "image": settings.job_image_concurrency,
+    "tts": settings.job_tts_concurrency,
+}
+
+INSERT_JOB = (
+    "INSERT INTO media_jobs (id, user_id, kind, status, payload) VALUES (?, ?, ?, 'queued', ?)"
+)
+UPDATE_JOB = (
+    "UPDATE media_jobs SET status = ?, result = ?, error = ?, attempts = ?, "
+    "updated_at = CURRENT_TIMESTAMP WHERE id = ?"
+)
+SELECT_JOB = (
+    "SELECT id, user_id, kind, status, payload, result, error, attempts, created_at, updated_at "
+    "FROM media_jobs WHERE id = ?"
+)
+SELECT_UNFINISHED_JOBS = (
+    "SELECT id, kind FROM media_jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+)
+
+
+def insert_job(job_id, user_id, kind, payload):
+    with pool.transaction() as conn:
+        conn.execute(INSERT_JOB, (job_id, user_id, kind, json.dumps(payload, ensure_ascii=False)))
+
+def update_job(job_id, status, result=None, error=None, attempts=0):
+    with pool.transaction() as conn:
+        conn.execute(UPDATE_JOB, (
+            status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+            error, attempts, job_id,
+        ))
+
+def get_job(job_id):
+    with pool.connection() as conn:
+        row = conn.execute(SELECT_JOB, (job_id,)).fetchone()
+    if row is None:
+        return None
+    keys = ("id", "user_id", "kind", "status", "payload", "result", "error",
+            "attempts", "created_at", "updated_at")
+    job = dict(zip(keys, row))
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+def get_unfinished_jobs():
+    with pool.connection() as conn:
+        return [(row[0], row[1]) for row in conn.execute(SELECT_UNFINISHED_JOBS)]
+
+async def _db(func, *args, **kwargs):
+    """在线程池里执行数据库调用，耗时（包括切换线程）记到 db 阶段"""
+    with timed(func.__name__, DB_SECONDS):
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+
+class JobQueue:
+    """持久化的后台任务队列：任务记录在 media_jobs 表里，每种任务有自己的队列和固定数量的 worker
+
+    worker 数就是这种任务的并发上限，慢的图片任务占满时不会挡住语音任务；
+    重试的退避期间任务不占用 worker，到时间后重新排队。
+    """
+
+    def __init__(self, workers=JOB_WORKERS, max_attempts=JOB_MAX_ATTEMPTS,
+                 retry_base_delay=JOB_RETRY_BASE_DELAY, concurrency=None):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.concurrency = dict(JOB_CONCURRENCY if concurrency is None else concurrency)
+        self._handlers = {}
+        self._queues = {}
+        self._tasks = []
+        self._retry_timers = set()
+        self.running = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+
+    def register(self, kind, handler):
+        """注册任务处理函数：async handler(payload) -> 可 JSON 序列化的结果"""
+        self._handlers[kind] = handler
+
+    async def start(self):
+        self._queues = {kind: asyncio.Queue() for kind in self._handlers}
+        # 上次进程退出时还没完成的任务重新排队
+        for job_id, kind in await _db(get_unfinished_jobs):
+            if kind in self._queues:
+                self._queues[kind].put_nowait(job_id)
+        for kind, queue in self._queues.items():
+            workers = self.concurrency.get(kind, self.workers)
+            self._tasks.extend(asyncio.ensure_future(self._worker(queue)) for _ in range(workers))
+        logger.info("Started %d media job workers", len(self._tasks))
+
+    async def stop(self):
+        for timer in self._retry_timers:
+            timer.cancel()
+        self._retry_timers.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(self, user_id, kind, payload):
+        """持久化一个任务并排队，返回任务 ID"""
+        if kind not in self._handlers:
+            raise ValueError(f"no handler registered for job kind {kind!r}")
+        job_id = uuid.uuid4().hex
+        await _db(insert_job, job_id, user_id, kind, payload)
+        queue = self._queues.get(kind)
+        if queue is not None:
+            queue.put_nowait(job_id)
+        return job_id
+
+    async def _worker(self, queue):
+        while True:
+            job_id = await queue.get()
+            try:
+                await self._run(job_id, queue)
+            except Exception:
+                logger.exception("Media job %s crashed", job_id)
+
+    async def _run(self, job_id, queue):
+        job = await _db(get_job, job_id)
+        if job is None or job["status"] not in ("queued", "running"):
+            return
+        handler = self._handlers[job["kind"]]
+        attempts = job["attempts"] + 1
+        await _db(update_job, job_id, "running", attempts=attempts)
+        try:
+            result = await self._call(handler, job["payload"])
+        except Exception as e:
+            # 上游调用已经按后端的策略重试过（或者后端熔断中），任务层面再重试只会放大对上游的请求
+            if attempts >= self.max_attempts or already_retried(e):
+                self.failed += 1
+                logger.warning("Media job %s failed after %d attempts: %s", job_id, attempts, e)
+                await _db(update_job, job_id, "failed", error=str(e), attempts=attempts)
+                return
+            # 指数退避加随机抖动，避免同时失败的任务一起重试；等待期间不占用 worker
+            delay = self.retry_base_delay * 2 ** (attempts - 1) * random.uniform(0.5, 1.5)
+            self.retries += 1
+            logger.info("Media job %s attempt %d failed (%s), retrying in %.1fs", job_id, attempts, e, delay)
+            await _db(update_job, job_id, "queued", error=str(e), attempts=attempts)
+            self._schedule_retry(job_id, queue, delay)
+            return
+        self.succeeded += 1
+        await _db(update_job, job_id, "succeeded", result=result, attempts=attempts)
+
+    def _schedule_retry(self, job_id, queue, delay):
+        def requeue():
+            self._retry_timers.discard(timer)
+            queue.put_nowait(job_id)
+
+        timer = asyncio.get_running_loop().call_later(delay, requeue)
+        self._retry_timers.add(timer)
+
+    async def _call(self, handler, payload):
+        self.running += 1
+        try:
+            return await handler(payload)
+        finally:
+            self.running -= 1
+
+    def stats(self):
+        return {
+            "queued": sum(queue.qsize() for queue in self._queues.values()),
+            "running": self.running,
+            "waiting_retry": len(self._retry_timers),
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retries": self.retries,
+            "workers": len(self._tasks),
+        }
+
+
+job_queue = JobQueue()
+
+
+async def aget_job(job_id):
+    return await _db(get_job, job_id)
@@ -0,0 +1,78 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class ConnectionPool:
+    """可复用的 SQLite 连接池，连接开启 WAL 模式并缓存预编译语句"""
+
+    def __init__(self, database, size=5, cached_statements=256):
+        self.database = database
+        self.size = size
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # check_same_thread=False：连接会在 asyncio.to_thread 的不同线程间复用，但同一时刻只借给一个线程
+        conn = sqlite3.connect(
+            self.database,
+            timeout=30,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        # WAL 模式下读写互不阻塞；NORMAL 同步级别在 WAL 下足够安全，且每次提交不必 fsync
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        # 连接都被借出时等待归还
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self):
+        """借出一个连接，用完归还到池里"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        """在一个事务里执行，正常退出时提交，出错时回滚"""
+        with self.connection() as conn:
+            with conn:
+                yield conn
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+
+from app.core.config import get_settings
+from app.core.memory.session_cache import sessions
+from app.core.memory.session_manager import HISTORY_TURNS, asave_conversation_summary
+from app.utils.metrics import LLM_TOKENS, timed
+from app.utils.templates import get_template
+from app.utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 最近 N 轮对话始终原样保留在 prompt 里，更早的对话折叠进滚动摘要
+settings = get_settings()
+SUMMARY_RECENT_TURNS = settings.summary_recent_turns
+# 待折叠的对话超过这个估算 token 数时才调用 LLM 刷新摘要，而不是每轮都刷新
+SUMMARY_TOKEN_THRESHOLD = settings.summary_token_threshold
+SUMMARY_MAX_WORDS = settings.summary_max_words
+
+# 摘要模板（包内相对路径，第一次使用时编译）
+SUMMARY_TEMPLATE = "summarize_conversation.jinja2"
+
+# 正在刷新摘要的用户 -> 后台任务，避免同一用户并发重复折叠，同时保留任务引用
+_refreshing = {}
+
+
+def _turn_tokens(turns):
+    return sum(estimate_tokens(message) + estimate_tokens(response) for _, message, response in turns)
+
+
+async def get_conversation_context(user_id):
+    """返回 (summary, recent_turns)，recent_turns 是摘要之后最近 HISTORY_TURNS 轮的 (message, response)
+
+    摘要刷新失败时摘要之后的对话会一直累积，prompt 里仍然只放最近的这些轮。
+    """
+    session = await sessions.get(user_id)
+    return session.summary, session.history(HISTORY_TURNS)
+
+
+async def refresh_summary(user_id, llm, threshold=None, keep_recent=None):
+    """待折叠的对话超过阈值时，把它们合并进摘要；返回是否刷新了摘要
+
+    llm 只需要提供 `await llm.ainvoke(prompt)`，测试时可以传入确定性的假 LLM。
+    """
+    threshold = SUMMARY_TOKEN_THRESHOLD if threshold is None else threshold
+    keep_recent = SUMMARY_RECENT_TURNS if keep_recent is None else keep_recent
+
+    session = await sessions.get(user_id)
+    summary, turns = session.summary, list(session.turns)
+    foldable = turns[:-keep_recent] if keep_recent else turns
+    # 只折叠已经落库（有行 ID）的对话，摘要记录的 last_message_id 才有意义
+    foldable = [turn for turn in foldable if turn[0] is not None]
+    if not foldable or _turn_tokens(foldable) < threshold:
+        return False
+
+    prompt = get_template(SUMMARY_TEMPLATE).render(
+        previous_summary=summary,
+        turns=[(message, response) for _, message, response in foldable],
+        max_words=SUMMARY_MAX_WORDS,
+    )
+    LLM_TOKENS.inc(estimate_tokens(prompt), call="summary_llm", kind="prompt")
+    with timed("summary_llm"):
+        new_summary = (await llm.ainvoke(prompt)).strip()
+    LLM_TOKENS.inc(estimate_tokens(new_summary), call="summary_llm", kind="completion")
+    if not new_summary:
+        return False
+    await asave_conversation_summary(user_id, new_summary, foldable[-1][0])
+    sessions.apply_summary(user_id, new_summary, foldable[-1][0])
+    return True
+
+
+def schedule_summary_refresh(user_id, llm):
+    """在后台检查并刷新摘要，不占用当前请求的延迟"""
+    if user_id in _refreshing:
+        return None
+
+    async def run():
+        try:
+            await refresh_summary(user_id, llm)
+        except Exception as e:
+            logger.warning("Failed to refresh conversation summary for %s: %s", user_id, e)
+        finally:
+            _refreshing.pop(user_id, None)
+
+    task = asyncio.get_running_loop().create_task(run())
+    _refreshing[user_id] = task
+    return task
@@ -0,0 +1,106 @@
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+# 按版本号顺序执行的 schema 迁移，当前版本记录在 PRAGMA user_version 里。
+# 新的迁移只能追加到末尾，已发布的迁移不要修改。
+MIGRATIONS = [
+    (1, [
+        # 按用户读最近的对话/故事状态，避免全表扫描和额外排序
+        "CREATE INDEX IF NOT EXISTS idx_conversation_memory_user_created "
+        "ON conversation_memory (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_story_state_user_created "
+        "ON story_state (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_images_user_created "
+        "ON images (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_audio_responses_user_created "
+        "ON audio_responses (user_id, created_at)",
+    ]),
+    (2, [
+        # 每个用户一行的滚动摘要，last_message_id 之前（含）的对话都已折叠进 summary
+        """
+        CREATE TABLE IF NOT EXISTS conversation_summary (
+            user_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        """,
+    ]),
+    (3, [
+        # 后台媒体生成任务（图片、语音），和 images / audio_responses 放在同一个库里
+        """
+        CREATE TABLE IF NOT EXISTS media_jobs (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_media_jobs_status ON media_jobs (status, created_at)",
+    ]),
+    (4, [
+        # 媒体清理器按时间查询最近仍在使用的文件
+        "CREATE INDEX IF NOT EXISTS idx_images_created ON images (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_audio_responses_created ON audio_responses (created_at)",
+    ]),
+    (5, [
+        # LLM 响应缓存的磁盘层，key 是规范化后的 prompt 和模型参数的哈希
+        """
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            latency REAL NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_llm_cache_expires ON llm_cache (expires_at)",
+    ]),
+    (6, [
+        # 不按用户过滤的对话分页和导出按 (created_at, id) 顺序扫描
+        "CREATE INDEX IF NOT EXISTS idx_conversation_memory_created ON conversation_memory (created_at)",
+    ]),
+    (7, [
+        # 同一轮的预览图和完整渲染图通过 turn_id 关联，tier 区分是哪一档
+        "ALTER TABLE images ADD COLUMN tier TEXT NOT NULL DEFAULT 'full'",
+        "ALTER TABLE images ADD COLUMN turn_id TEXT",
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(conn):
+    """把数据库升级到最新的 schema 版本，已经是最新版本时什么都不做"""
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info("Applying schema migration %s...", version)
+        with conn:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+    return max(current, SCHEMA_VERSION)
+
+
+if __name__ == "__main__":
+    # 升级已有的数据库：python -m app.core.memory.migrations storybot.db
+    import sqlite3
+
+    from app.core.config import get_settings
+
+    logging.basicConfig(level=logging.INFO)
+    database = sys.argv[1] if len(sys.argv) > 1 else get_settings().database
+    with sqlite3.connect(database) as conn:
+        print(f"{database} is at schema version {migrate(conn)}")
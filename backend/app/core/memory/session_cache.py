@@ -0,0 +1,241 @@
+import asyncio
+import collections
+import logging
+import time
+
+from app.core.config import get_settings
+from app.core.memory.session_manager import MAX_SESSION_TURNS, aload_session, asave_sessions
+from app.utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 进程内的会话缓存：活跃用户的角色、故事状态、滚动摘要和最近的对话留在内存里，
+# 热会话每一轮都不需要读数据库。写入先记在会话上，由后台任务每隔一小段时间攒批在一个事务里落库；
+# 空闲太久或被 LRU 淘汰的会话先落库再移出内存。进程崩溃时最多丢失最后一个落库间隔内的写入。
+# 缓存只在本进程内有效，多个 worker 时同一用户的请求需要落到同一个进程上。
+settings = get_settings()
+SESSION_CACHE_SIZE = settings.session_cache_size
+SESSION_IDLE_SECONDS = settings.session_idle_seconds
+SESSION_FLUSH_INTERVAL = settings.session_flush_interval
+
+
+class Session:
+    """一个用户的会话状态；turns 是摘要之后的 [id, message, response]，还没落库的行 id 为 None"""
+
+    def __init__(self, user_id, character=None, story_state=None, summary=None, turns=()):
+        self.user_id = user_id
+        self.character = character
+        self.story_state = story_state
+        self.summary = summary
+        self.turns = collections.deque((list(turn) for turn in turns), maxlen=MAX_SESSION_TURNS)
+        self.last_used = time.monotonic()
+        # 等待落库的写入
+        self.pending_character = None
+        self.pending_story_state = None
+        self.pending_turns = []
+
+    @property
+    def dirty(self):
+        return bool(self.pending_turns) or self.pending_character is not None \
+            or self.pending_story_state is not None
+
+    def history(self, limit=None, max_tokens=None):
+        """摘要之后按时间顺序的 (message, response)
+
+        和 session_manager.get_conversation_memory 一样，limit 是最多返回的最近轮数，
+        max_tokens 限制返回内容的估算 token 总数（至少保留最近一轮）。
+        """
+        turns = list(self.turns)
+        if limit is not None:
+            turns = turns[-limit:] if limit > 0 else []
+        rows, used = [], 0
+        for _, message, response in reversed(turns):
+            if max_tokens is not None:
+                used += estimate_tokens(message) + estimate_tokens(response)
+                if used > max_tokens and rows:
+                    break
+            rows.append((message, response))
+        rows.reverse()
+        return rows
+
+
+class SessionCache:
+    def __init__(self, max_size=SESSION_CACHE_SIZE, idle_seconds=SESSION_IDLE_SECONDS,
+                 flush_interval=SESSION_FLUSH_INTERVAL):
+        self.max_size = max_size
+        self.idle_seconds = idle_seconds
+        self.flush_interval = flush_interval
+        self._sessions = collections.OrderedDict()
+        # 已经移出 LRU 但还有写入没落库的会话，落库前再次访问时直接取回
+        self._retired = {}
+        self._dirty = {}
+        self._loading = {}
+        self._flusher = None
+        self._flush_lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.flushed_turns = 0
+        self.flush_errors = 0
+        self.evictions = 0
+        self.expired = 0
+
+    async def get(self, user_id):
+        """返回用户的会话，不在内存里时从数据库加载（同一用户并发的加载只读一次库）"""
+        session = self._sessions.get(user_id)
+        if session is not None:
+            self.hits += 1
+            self._sessions.move_to_end(user_id)
+            session.last_used = time.monotonic()
+            return session
+        session = self._retired.pop(user_id, None)
+        if session is not None:
+            self.hits += 1
+        else:
+            loading = self._loading.get(user_id)
+            if loading is None:
+                self.misses += 1
+                loading = asyncio.ensure_future(aload_session(user_id))
+                self._loading[user_id] = loading
+                loading.add_done_callback(lambda _: self._loading.pop(user_id, None))
+            state = await asyncio.shield(loading)
+            # 并发等待同一次加载的请求里，第一个放进缓存的会话胜出
+            session = self._sessions.get(user_id)
+            if session is not None:
+                return session
+            session = Session(user_id, **state)
+        session.last_used = time.monotonic()
+        self._insert(session)
+        return session
+
+    def _insert(self, session):
+        self._sessions[session.user_id] = session
+        self._sessions.move_to_end(session.user_id)
+        while len(self._sessions) > self.max_size:
+            _, evicted = self._sessions.popitem(last=False)
+            self.evictions += 1
+            self._retire(evicted)
+
+    def _retire(self, session):
+        if session.dirty:
+            self._retired[session.user_id] = session
+
+    def _mark_dirty(self, session):
+        self._dirty[session.user_id] = session
+        if self._flusher is None or self._flusher.done() \
+                or self._flusher.get_loop() is not asyncio.get_running_loop():
+            self._flusher = asyncio.ensure_future(self._run_flusher())
+
+    async def record_turn(self, user_id, conversation=None, story_state=None):
+        """记录一轮的对话 (message, response) 和新的故事状态，稍后和其他会话的写入一起落库"""
+        session = await self.get(user_id)
+        if conversation is not None:
+            turn = [None, *conversation]
+            session.turns.append(turn)
+            session.pending_turns.append(turn)
+        if story_state is not None:
+            session.story_state = story_state
+            session.pending_story_state = story_state
+        self._mark_dirty(session)
+
+    async def update_character(self, user_id, character):
+        session = await self.get(user_id)
+        if character and character != session.character:
+            session.character = character
+            session.pending_character = character
+        # 新用户即使没有角色也要落库一行 users
+        self._mark_dirty(session)
+
+    def apply_summary(self, user_id, summary, last_message_id):
+        """滚动摘要刷新后，丢掉已经折叠进摘要的对话"""
+        session = self._sessions.get(user_id) or self._retired.get(user_id)
+        if session is None:
+            return
+        session.summary = summary
+        while session.turns and session.turns[0][0] is not None and session.turns[0][0] <= last_message_id:
+            session.turns.popleft()
+
+    async def flush(self):
+        """把所有会话积攒的写入在一个事务里落库"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+            sessions, self._dirty = list(self._dirty.values()), {}
+            batch, taken = [], []
+            for session in sessions:
+                pending = (session.pending_character, session.pending_turns, session.pending_story_state)
+                session.pending_character, session.pending_turns, session.pending_story_state = None, [], None
+                taken.append(pending)
+                batch.append((session.user_id, pending[0],
+                              [(message, response) for _, message, response in pending[1]], pending[2]))
+            try:
+                ids = await asave_sessions(batch)
+            except Exception:
+                self.flush_errors += 1
+                logger.exception("Failed to flush %d sessions, will retry", len(sessions))
+                # 落库期间又有新的写入时，新的写入优先
+                for session, (character, turns, story_state) in zip(sessions, taken):
+                    session.pending_turns[:0] = turns
+                    if session.pending_character is None:
+                        session.pending_character = character
+                    if session.pending_story_state is None:
+                        session.pending_story_state = story_state
+                    self._dirty.setdefault(session.user_id, session)
+                    if session.user_id not in self._sessions:
+                        self._retired[session.user_id] = session
+                return 0
+            for session, (_, turns, _), turn_ids in zip(sessions, taken, ids):
+                for turn, turn_id in zip(turns, turn_ids):
+                    turn[0] = turn_id
+                self.flushed_turns += len(turns)
+                if not session.dirty and self._retired.get(session.user_id) is session:
+                    del self._retired[session.user_id]
+            self.flushes += 1
+            return len(sessions)
+
+    def expire_idle(self):
+        """把空闲超过 idle_seconds 的会话移出内存（还有未落库写入的留到落库之后）"""
+        cutoff = time.monotonic() - self.idle_seconds
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if session.last_used > cutoff:
+                break
+            del self._sessions[user_id]
+            self.expired += 1
+            self._retire(session)
+
+    async def _run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            self.expire_idle()
+
+    async def start(self):
+        self._flusher = asyncio.ensure_future(self._run_flusher())
+
+    async def close(self):
+        """停止后台落库并把剩下的写入落库"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._sessions),
+            "retired": len(self._retired),
+            "dirty": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "flushes": self.flushes,
+            "flushed_turns": self.flushed_turns,
+            "flush_errors": self.flush_errors,
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
+
+
+sessions = SessionCache()
@@ -1,129 +1,286 @@
-import sqlite3
+import asyncio
+import functools
 from datetime import datetime
 
-DATABASE = "storybot.db"
+from app.core.config import get_settings
+from app.core.memory.connection_pool import ConnectionPool
+from app.core.memory.migrations import migrate
+from app.utils.metrics import DB_SECONDS, timed
+from app.utils.tokens import estimate_tokens
+
+settings = get_settings()
+DATABASE = settings.database
+
+# 默认只读最近 N 轮对话，避免 prompt 和查询随历史无限增长
+HISTORY_TURNS = settings.conversation_history_turns
+
+# 一个会话最多读出（和在内存里保留）的摘要之后的对话轮数
+MAX_SESSION_TURNS = 200
+
+# 所有函数共用一个连接池，不再每次调用都重新 connect / close
+pool = ConnectionPool(DATABASE, size=settings.db_pool_size)
+
+# SQL 保持为常量字符串，sqlite3 会按语句文本缓存预编译结果
+# 用户不存在时创建；character_name 为 NULL 时保留已有的角色
+UPSERT_USER = (
+    "INSERT INTO users (user_id, character_name) VALUES (?, ?) ON CONFLICT (user_id) DO UPDATE SET "
+    "character_name = COALESCE(excluded.character_name, users.character_name)"
+)
+UPDATE_USER_CHARACTER = "UPDATE users SET character_name = ? WHERE user_id = ?"
+SELECT_USER_CHARACTER = "SELECT character_name FROM users WHERE user_id = ?"
+INSERT_CONVERSATION = "INSERT INTO conversation_memory (user_id, message, response) VALUES (?, ?, ?)"
+# 倒序读最近的行再翻转，配合 (user_id, created_at) 索引只扫描需要的行
+SELECT_RECENT_CONVERSATION = (
+    "SELECT message, response FROM conversation_memory WHERE user_id = ? "
+    "ORDER BY created_at DESC, id DESC LIMIT ?"
+)
+INSERT_STORY_STATE = "INSERT INTO story_state (user_id, current_state) VALUES (?, ?)"
+# 故事状态原地更新用户最新的一行，表不再每轮增长
+UPDATE_STORY_STATE = (
+    "UPDATE story_state SET current_state = ?, created_at = CURRENT_TIMESTAMP WHERE id = ("
+    "SELECT id FROM story_state WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT 1)"
+)
+SELECT_STORY_STATE = (
+    "SELECT current_state FROM story_state WHERE user_id = ? "
+    "ORDER BY created_at DESC, id DESC LIMIT 1"
+)
+SELECT_CONVERSATION_SUMMARY = (
+    "SELECT summary, last_message_id FROM conversation_summary WHERE user_id = ?"
+)
+# 摘要之后还没有折叠的对话，数量受摘要阈值约束，不会随历史增长
+SELECT_CONVERSATION_AFTER = (
+    "SELECT id, message, response FROM conversation_memory WHERE user_id = ? AND id > ? "
+    "ORDER BY created_at DESC, id DESC LIMIT ?"
+)
+UPSERT_CONVERSATION_SUMMARY = (
+    "INSERT INTO conversation_summary (user_id, summary, last_message_id) VALUES (?, ?, ?) "
+    "ON CONFLICT (user_id) DO UPDATE SET summary = excluded.summary, "
+    "last_message_id = excluded.last_message_id, updated_at = CURRENT_TIMESTAMP "
+    "WHERE excluded.last_message_id > conversation_summary.last_message_id"
+)
+INSERT_IMAGE = "INSERT INTO images (user_id, image_url, tier, turn_id) VALUES (?, ?, ?, ?)"
+INSERT_AUDIO = "INSERT INTO audio_responses (user_id, audio_url) VALUES (?, ?)"
+SELECT_RECENT_MEDIA_URLS = (
+    "SELECT image_url FROM images WHERE created_at >= datetime('now', ?) "
+    "UNION SELECT audio_url FROM audio_responses WHERE created_at >= datetime('now', ?)"
+)
+# 按 (created_at, id) 做键集分页：下一页从上一页最后一行之后开始，不用 OFFSET，翻到多深都只扫描一页的行
+SELECT_CONVERSATIONS_PAGE = (
+    "SELECT id, user_id, message, response, created_at FROM conversation_memory "
+    "WHERE {conditions} ORDER BY created_at, id LIMIT ?"
+)
+CONVERSATION_COLUMNS = ("id", "user_id", "message", "response", "created_at")
+# 分页的默认和最大页大小
+CONVERSATION_PAGE_SIZE = 100
+CONVERSATION_MAX_PAGE_SIZE = 1000
 
 def create_tables():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT NOT NULL UNIQUE,
-            character_name TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS conversation_memory (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT NOT NULL,
-            message TEXT NOT NULL,
-            response TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-    """)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS story_state (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT NOT NULL,
-            current_state TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-    """)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS images (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT NOT NULL,
-            image_url TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-    """)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS audio_responses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT NOT NULL,
-            audio_url TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-    """)
-    conn.commit()
-    conn.close()
+    with pool.transaction() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL UNIQUE,
+                character_name TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS conversation_memory (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                message TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS story_state (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                current_state TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS images (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                image_url TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS audio_responses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                audio_url TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        """)
+    # 已有的数据库在这里补上索引等后续的 schema 变更
+    with pool.connection() as conn:
+        migrate(conn)
 
 def add_user(user_id, character_name=None):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO users (user_id, character_name) VALUES (?, ?)", (user_id, character_name))
-    conn.commit()
-    conn.close()
+    """创建用户（已存在时只在给出 character_name 时更新角色）"""
+    with pool.transaction() as conn:
+        conn.execute(UPSERT_USER, (user_id, character_name))
 
 def update_user_character(user_id, character_name):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET character_name = ? WHERE user_id = ?", (character_name, user_id))
-    conn.commit()
-    conn.close()
+    with pool.transaction() as conn:
+        conn.execute(UPDATE_USER_CHARACTER, (character_name, user_id))
 
 def get_user_character(user_id):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT character_name FROM users WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    conn.close()
+    with pool.connection() as conn:
+        result = conn.execute(SELECT_USER_CHARACTER, (user_id,)).fetchone()
     return result[0] if result else None
 
 def add_conversation_memory(user_id, message, response):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO conversation_memory (user_id, message, response) VALUES (?, ?, ?)", (user_id, message, response))
-    conn.commit()
-    conn.close()
-
-def get_conversation_memory(user_id):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT message, response FROM conversation_memory WHERE user_id = ? ORDER BY created_at", (user_id,))
-    result = cursor.fetchall()
-    conn.close()
-    return result
+    with pool.transaction() as conn:
+        conn.execute(INSERT_CONVERSATION, (user_id, message, response))
+
+def get_conversation_memory(user_id, limit=None, max_tokens=None):
+    """按时间顺序返回最近的 (message, response)
+
+    limit 是最多返回的轮数（默认 HISTORY_TURNS），max_tokens 限制返回内容的估算 token 总数。
+    """
+    limit = HISTORY_TURNS if limit is None else limit
+    with pool.connection() as conn:
+        cursor = conn.execute(SELECT_RECENT_CONVERSATION, (user_id, limit))
+        if max_tokens is None:
+            rows = cursor.fetchall()
+        else:
+            rows, used = [], 0
+            for message, response in cursor:
+                used += estimate_tokens(message) + estimate_tokens(response)
+                if used > max_tokens and rows:
+                    break
+                rows.append((message, response))
+    rows.reverse()
+    return rows
+
+def _save_story_state(conn, user_id, current_state):
+    if conn.execute(UPDATE_STORY_STATE, (current_state, user_id)).rowcount == 0:
+        conn.execute(INSERT_STORY_STATE, (user_id, current_state))
 
 def add_story_state(user_id, current_state):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO story_state (user_id, current_state) VALUES (?, ?)", (user_id, current_state))
-    conn.commit()
-    conn.close()
+    with pool.transaction() as conn:
+        _save_story_state(conn, user_id, current_state)
 
 def get_story_state(user_id):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT current_state FROM story_state WHERE user_id = ? ORDER BY created_at DESC LIMIT 1", (user_id,))
-    result = cursor.fetchone()
-    conn.close()
+    with pool.connection() as conn:
+        result = conn.execute(SELECT_STORY_STATE, (user_id,)).fetchone()
     return result[0] if result else None
 
-def add_image(user_id, image_url):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO images (user_id, image_url) VALUES (?, ?)", (user_id, image_url))
-    conn.commit()
-    conn.close()
+def save_conversation_summary(user_id, summary, last_message_id):
+    """保存新的滚动摘要；如果已有更新的摘要（并发折叠）则保留已有的"""
+    with pool.transaction() as conn:
+        conn.execute(UPSERT_CONVERSATION_SUMMARY, (user_id, summary, last_message_id))
+
+def record_turn(user_id, conversation=None, story_state=None):
+    """一轮对话的 conversation_memory 和 story_state 写入放在同一个事务里提交
+
+    conversation 是 (message, response)，story_state 是新的故事状态文本，不需要写的传 None。
+    """
+    with pool.transaction() as conn:
+        if conversation is not None:
+            conn.execute(INSERT_CONVERSATION, (user_id, *conversation))
+        if story_state is not None:
+            _save_story_state(conn, user_id, story_state)
+
+def load_session(user_id, max_turns=MAX_SESSION_TURNS):
+    """用一个连接读出一个会话需要的全部状态：角色、最新故事状态、滚动摘要和摘要之后的对话"""
+    with pool.connection() as conn:
+        character = conn.execute(SELECT_USER_CHARACTER, (user_id,)).fetchone()
+        story_state = conn.execute(SELECT_STORY_STATE, (user_id,)).fetchone()
+        row = conn.execute(SELECT_CONVERSATION_SUMMARY, (user_id,)).fetchone()
+        summary, last_message_id = row if row else (None, 0)
+        turns = conn.execute(SELECT_CONVERSATION_AFTER, (user_id, last_message_id, max_turns)).fetchall()
+    turns.reverse()
+    return {
+        "character": character[0] if character else None,
+        "story_state": story_state[0] if story_state else None,
+        "summary": summary,
+        "turns": turns,
+    }
+
+def save_sessions(batch):
+    """把多个会话积攒的写入放在一个事务里提交
+
+    batch 是 [(user_id, character, conversations, story_state)]，conversations 是 [(message, response)]，
+    没有变化的 character / story_state 传 None。返回每个会话新写入的对话行 ID 列表。
+    """
+    ids = []
+    with pool.transaction() as conn:
+        for user_id, character, conversations, story_state in batch:
+            conn.execute(UPSERT_USER, (user_id, character))
+            ids.append([conn.execute(INSERT_CONVERSATION, (user_id, message, response)).lastrowid
+                        for message, response in conversations])
+            if story_state is not None:
+                _save_story_state(conn, user_id, story_state)
+    return ids
+
+def add_image(user_id, image_url, tier="full", turn_id=None):
+    with pool.transaction() as conn:
+        conn.execute(INSERT_IMAGE, (user_id, image_url, tier, turn_id))
 
 def add_audio_response(user_id, audio_url):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO audio_responses (user_id, audio_url) VALUES (?, ?)", (user_id, audio_url))
-    conn.commit()
-    conn.close()
-
-def get_all_conversation_memory():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM conversation_memory ORDER BY created_at")
-    result = cursor.fetchall()
-    conn.close()
-    return result
+    with pool.transaction() as conn:
+        conn.execute(INSERT_AUDIO, (user_id, audio_url))
+
+def get_recent_media_urls(seconds):
+    """最近 seconds 秒内记录过的图片和语音 URL"""
+    window = f"-{int(seconds)} seconds"
+    with pool.connection() as conn:
+        return {row[0] for row in conn.execute(SELECT_RECENT_MEDIA_URLS, (window, window))}
+
+def get_conversations_page(user_id=None, since=None, until=None, after=None, limit=CONVERSATION_PAGE_SIZE):
+    """按时间顺序返回一页对话记录（字典列表）
+
+    user_id 只看一个用户；since / until 是 created_at 的时间范围（含 since、不含 until，
+    格式同数据库里的 "YYYY-MM-DD HH:MM:SS"）；after 是上一页最后一行的 (created_at, id)。
+    """
+    limit = max(1, min(limit, CONVERSATION_MAX_PAGE_SIZE))
+    conditions, params = [], []
+    for condition, value in (("user_id = ?", user_id), ("created_at >= ?", since), ("created_at < ?", until)):
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+    if after is not None:
+        conditions.append("(created_at, id) > (?, ?)")
+        params.extend(after)
+    params.append(limit)
+    sql = SELECT_CONVERSATIONS_PAGE.format(conditions=" AND ".join(conditions) or "1")
+    with pool.connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return [dict(zip(CONVERSATION_COLUMNS, row)) for row in rows]
+
+
+# sqlite3 是阻塞调用，异步接口放到线程池里执行，避免卡住 uvicorn 的事件循环
+def _to_thread(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with timed(func.__name__, DB_SECONDS):
+            return await asyncio.to_thread(func, *args, **kwargs)
+    return wrapper
+
+asave_conversation_summary = _to_thread(save_conversation_summary)
+aget_conversations_page = _to_thread(get_conversations_page)
+aload_session = _to_thread(load_session)
+asave_sessions = _to_thread(save_sessions)
+
+async def aiter_conversation_pages(user_id=None, since=None, until=None, page_size=CONVERSATION_MAX_PAGE_SIZE):
+    """逐页产出符合条件的全部对话记录；一次只在内存里保留一页，每页之间归还连接"""
+    after = None
+    while True:
+        rows = await aget_conversations_page(user_id, since, until, after, page_size)
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        after = (rows[-1]["created_at"], rows[-1]["id"])
@@ -0,0 +1,139 @@
+import json
+import re
+
+from app.core.config import get_settings
+
+# 结构化的故事状态：每轮原地更新，各部分都有上限，渲染出的上下文长度不随故事变长而增长
+STATE_VERSION = 1
+RECENT_CHAPTERS = get_settings().story_recent_chapters
+EARLIER_CHAPTERS = get_settings().story_earlier_chapters
+MAX_CHARACTERS = 10
+MAX_VOCABULARY = 60
+MAX_OPEN_THREADS = 3
+CHAPTER_SUMMARY_CHARS = 240
+EARLIER_SUMMARY_CHARS = 100
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_PROPER_NOUN = re.compile(r"\b[A-Z][a-z]+(?:\s[A-Z][a-z]+)?\b")
+_NOT_NAMES = {
+    "The", "A", "An", "He", "She", "They", "It", "We", "You", "I", "His", "Her", "Their",
+    "One", "Once", "Then", "When", "What", "Where", "Who", "Why", "How", "Do", "Did",
+    "Can", "Will", "Would", "Let", "Yes", "No", "Oh", "Wow", "Hello", "Hi", "In", "On",
+    "At", "And", "But", "So", "Suddenly", "Finally", "Today", "This", "That", "There",
+}
+
+
+def new_story_state(character_name=None):
+    return {
+        "version": STATE_VERSION,
+        "character": character_name,
+        "chapter_count": 0,
+        "earlier": [],
+        "chapters": [],
+        "characters": [character_name] if character_name else [],
+        "vocabulary": [],
+        "open_threads": [],
+    }
+
+
+def load_story_state(raw):
+    """把 story_state 表里的文本解析成结构化状态；兼容旧版本存的纯文本"""
+    if not raw:
+        return new_story_state()
+    try:
+        state = json.loads(raw)
+        if isinstance(state, dict) and state.get("version") == STATE_VERSION:
+            return state
+    except json.JSONDecodeError:
+        pass
+    # 旧数据是 "child reply:... <原始 LLM 输出>"，只保留一段截断的文本作为前情
+    state = new_story_state()
+    state["earlier"].append(_truncate(raw, CHAPTER_SUMMARY_CHARS))
+    return state
+
+
+def dump_story_state(state):
+    return json.dumps(state, ensure_ascii=False, separators=(",", ":"))
+
+
+def _truncate(text, limit):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[: limit - 3].rstrip() + "..."
+
+
+def _summarize_chapter(story):
+    """不额外调用 LLM：取第一句和最后一句作为章节摘要"""
+    sentences = [s for s in _SENTENCE_END.split(" ".join(story.split())) if s]
+    if len(sentences) > 2:
+        sentences = [sentences[0], sentences[-1]]
+    return _truncate(" ".join(sentences), CHAPTER_SUMMARY_CHARS)
+
+
+def _extract_characters(story):
+    counts = {}
+    for name in _PROPER_NOUN.findall(story):
+        if name.split()[0] not in _NOT_NAMES:
+            counts[name] = counts.get(name, 0) + 1
+    return [name for name, count in counts.items() if count >= 2]
+
+
+def _append_unique(items, new_items, limit):
+    seen = {item.lower() for item in items}
+    for item in new_items:
+        if item and item.lower() not in seen:
+            items.append(item)
+            seen.add(item.lower())
+    # 超出上限时丢掉最早的条目
+    del items[:-limit]
+
+
+def update_story_state(state, character_name, answer, story, question=None, words=()):
+    """把新生成的一章合并进状态（原地修改并返回）"""
+    if character_name:
+        state["character"] = character_name
+    state["chapter_count"] += 1
+
+    # 上一章的问题已经被孩子回答，从未完成的线索里移出并记到上一章
+    if state["open_threads"]:
+        answered = state["open_threads"].pop()
+        if state["chapters"] and answer:
+            state["chapters"][-1]["choice"] = _truncate(f"{answered} -> {answer}", CHAPTER_SUMMARY_CHARS)
+
+    state["chapters"].append({
+        "n": state["chapter_count"],
+        "summary": _summarize_chapter(story or ""),
+    })
+    # 较早的章节压缩成一行，只保留第一章（故事开头）和最近的几章
+    while len(state["chapters"]) > RECENT_CHAPTERS:
+        old = state["chapters"].pop(0)
+        state["earlier"].append(_truncate(f"Ch{old['n']}: {old['summary']}", EARLIER_SUMMARY_CHARS))
+    if len(state["earlier"]) > EARLIER_CHAPTERS:
+        state["earlier"] = state["earlier"][:1] + state["earlier"][-(EARLIER_CHAPTERS - 1):]
+
+    _append_unique(state["characters"], [character_name] + _extract_characters(story or ""), MAX_CHARACTERS)
+    _append_unique(state["vocabulary"], [w.strip().lower() for w in words if w], MAX_VOCABULARY)
+    if question:
+        state["open_threads"].append(_truncate(question, CHAPTER_SUMMARY_CHARS))
+        del state["open_threads"][:-MAX_OPEN_THREADS]
+    return state
+
+
+def render_story_context(state):
+    """渲染给 generate_story.jinja2 的紧凑上下文；没有历史时返回 None"""
+    if not state["chapter_count"] and not state["earlier"]:
+        return None
+    lines = [f"Chapters written so far: {state['chapter_count']}"]
+    if state["earlier"]:
+        lines.append("Earlier chapters: " + " | ".join(state["earlier"]))
+    for chapter in state["chapters"]:
+        line = f"Chapter {chapter['n']}: {chapter['summary']}"
+        if chapter.get("choice"):
+            line += f" (question and child's answer: {chapter['choice']})"
+        lines.append(line)
+    if state["characters"]:
+        lines.append("Characters: " + ", ".join(state["characters"]))
+    if state["vocabulary"]:
+        lines.append("Words already taught (do not reuse as new words): " + ", ".join(state["vocabulary"]))
+    if state["open_threads"]:
+        lines.append("Open question waiting for the child's answer: " + state["open_threads"][-1])
+    return "\n".join(lines)
@@ -0,0 +1,92 @@
+import logging
+import os
+import threading
+from io import BytesIO
+
+from PIL import Image
+
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# 默认是 backend/character_images，和启动时的工作目录无关
+CHARACTER_IMAGE_DIR = get_settings().character_image_dir
+# 找不到角色定妆照时使用的参考图（与之前的固定行为一致）
+DEFAULT_CHARACTER = "snow_white"
+# SDXL image-to-image 需要的尺寸
+INIT_IMAGE_SIZE = (1024, 1024)
+
+# LLM 返回的角色名（中英文）到定妆照文件名的映射
+CHARACTER_ALIASES = {
+    "snow white": "snow_white",
+    "白雪公主": "snow_white",
+    "灰姑娘": "cinderella",
+    "托马斯": "thomas",
+    "thomas the tank engine": "thomas",
+    "my little pony": "pony",
+    "小马宝莉": "pony",
+    "小马宝利": "pony",
+}
+
+
+def character_image_path(character_name):
+    """把角色名解析成 character_images/ 下的定妆照路径，未知角色返回默认参考图"""
+    name = (character_name or "").strip().lower()
+    name = CHARACTER_ALIASES.get(name, name).replace(" ", "_").replace("-", "_")
+    path = os.path.join(CHARACTER_IMAGE_DIR, f"{name}.png")
+    if name and os.path.exists(path):
+        return path
+    logger.warning("No reference image for character %r, using %s", character_name, DEFAULT_CHARACTER)
+    return os.path.join(CHARACTER_IMAGE_DIR, f"{DEFAULT_CHARACTER}.png")
+
+
+def prepare_init_image(path, size=INIT_IMAGE_SIZE):
+    """解码、转 RGB、缩放并重新编码成可以直接上传的 PNG 字节"""
+    with open(path, "rb") as image_file:
+        init_image = Image.open(image_file).convert("RGB")
+        init_image = init_image.resize(size)
+        buffer = BytesIO()
+        init_image.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+
+class CharacterAssetRegistry:
+    """缓存预处理好的定妆照字节，源文件的修改时间或大小变化时重新处理"""
+
+    def __init__(self, directory=CHARACTER_IMAGE_DIR, size=INIT_IMAGE_SIZE):
+        self.directory = directory
+        self.size = size
+        self._entries = {}  # (path, size) -> ((mtime_ns, file_size), bytes)
+        self._lock = threading.Lock()
+
+    def get(self, path, size=None):
+        """返回缩放到 size（默认 self.size）的定妆照 PNG 字节，不同尺寸分别缓存"""
+        size = size or self.size
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        key = (os.path.normpath(path), tuple(size))
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        data = prepare_init_image(path, size)
+        with self._lock:
+            self._entries[key] = (version, data)
+        return data
+
+    def preload(self):
+        """启动时预处理目录下的所有定妆照"""
+        if not os.path.isdir(self.directory):
+            return 0
+        count = 0
+        for name in sorted(os.listdir(self.directory)):
+            if name.lower().endswith(".png"):
+                try:
+                    self.get(os.path.join(self.directory, name))
+                    count += 1
+                except Exception as e:
+                    logger.warning("Failed to preprocess %s: %s", name, e)
+        return count
+
+
+character_assets = CharacterAssetRegistry()
@@ -1,34 +1,88 @@
-import os
-import requests
-from PIL import Image
-from io import BytesIO
-from dotenv import load_dotenv
+import asyncio
+import logging
 import base64
+from io import BytesIO
+from typing import NamedTuple, Optional
+from PIL import Image
+from app.core.clients import get_http_client
+from app.core.config import get_settings
+from app.core.rendering.character_assets import character_assets
+from app.core.rendering.media_store import save_image
+from app.core.resilience import BackendUnavailable, image_backend
+
+logger = logging.getLogger(__name__)
+
+
+class ImageAPIError(RuntimeError):
+    """图片接口返回 429 或 5xx，由 image_backend 重试并计入熔断"""
+
+    def __init__(self, status_code, detail):
+        super().__init__(f"image API returned {status_code}: {detail}")
+        self.status_code = status_code
+
+# REST API 的基础 URL（STABILITY_API_URL 可指向本地 stub 服务）
+settings = get_settings()
+REST_API_URL = settings.stability_api_url
+IMAGE_OUTPUT_FORMAT = settings.image_output_format.lower()
+
+
+class ImageTier(NamedTuple):
+    """一档图片质量：请求的引擎、步数和初始图尺寸，以及保存时的最大边长和编码质量"""
+    name: str
+    api_url: str
+    steps: int
+    size: int
+    output_size: int
+    quality: int
 
-# 加载 .env 环境变量
-load_dotenv()
-stability_api_key = os.getenv("STABILITY_API_KEY")
 
-# REST API 的基础 URL
-REST_API_URL = "https://api.stability.ai/v1/generation/stable-diffusion-xl-1024-v1-0/image-to-image"
+FULL_TIER = ImageTier("full", REST_API_URL, settings.image_steps, settings.image_size,
+                      settings.image_output_size, settings.image_quality)
+PREVIEW_TIER: Optional[ImageTier] = ImageTier(
+    "preview", settings.image_preview_api_url or REST_API_URL, settings.image_preview_steps,
+    settings.image_preview_size, settings.image_preview_output_size, settings.image_preview_quality,
+) if settings.image_preview_enabled else None
 
-# 请求头部信息
-HEADERS = {
-    "Authorization": f"Bearer {stability_api_key}"
-}
 
-def generate_image(story_text, character_image_path):
+def _headers():
+    # 请求头部信息
+    return {"Authorization": f"Bearer {get_settings().stability_api_key}"}
+
+def encode_for_web(data, max_size, quality, fmt=IMAGE_OUTPUT_FORMAT):
+    """把生成的 PNG 缩小到最大边长 max_size 并重新编码，返回 (字节, 扩展名)"""
+    with Image.open(BytesIO(data)) as image:
+        image = image.convert("RGB")
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+        buffer = BytesIO()
+        options = {"optimize": True} if fmt == "png" else {"quality": quality}
+        image.save(buffer, format=fmt.upper(), **options)
+        return buffer.getvalue(), "jpg" if fmt == "jpeg" else fmt
+
+
+def store_image(user_id, data, tier=FULL_TIER, turn_id=None):
+    """重新编码后保存；编码失败时保存原始 PNG"""
+    try:
+        encoded, extension = encode_for_web(data, tier.output_size, tier.quality)
+    except Exception as e:
+        logger.warning("Failed to re-encode image, keeping the PNG: %s", e)
+        encoded, extension = data, "png"
+    return save_image(user_id, encoded, extension, tier.name, turn_id)
+
+
+async def generate_image(story_text, character_image_path, user_id=None, tier=FULL_TIER, turn_id=None,
+                         raise_errors=False):
+    """按 tier 生成一张图片，保存后返回 URL；失败时返回 None
+
+    raise_errors 为 True 时，图片接口的错误（包括熔断）原样抛出，由后台任务判断是否值得重试。
+    """
     prompt = f"Generate an image based on the following story: {story_text}"
 
     try:
-        with open("character_images/snow_white.png", "rb") as image_file:
-            init_image = Image.open(image_file).convert("RGB")
-            init_image = init_image.resize((1024, 1024))  # resize to valid SDXL size
-            buffer = BytesIO()
-            init_image.save(buffer, format="PNG")
-            init_image_bytes = buffer.getvalue()
+        # 预处理好的定妆照字节有缓存，只有第一次或源文件变化时才在线程里做 PIL 处理
+        init_image_bytes = await asyncio.to_thread(
+            character_assets.get, character_image_path, (tier.size, tier.size))
     except Exception as e:
-        print("❌ Failed to load or process character image:", e)
+        logger.warning("Failed to load or process character image: %s", e)
         return None
 
     # 构造 POST 请求的数据
@@ -40,18 +94,31 @@ def generate_image(story_text, character_image_path):
         "text_prompts[0][text]": prompt,
         "cfg_scale": 7,
         "image_strength": 0.35,
-        "steps": 50,
+        "steps": tier.steps,
         "samples": 1,
     }
 
+    async def post():
+        response = await get_http_client().post(tier.api_url, headers=_headers(), files=files, data=payload)
+        if response.status_code == 429 or response.status_code >= 500:
+            raise ImageAPIError(response.status_code, response.text[:200])
+        return response
+
     try:
-        response = requests.post(REST_API_URL, headers=HEADERS, files=files, data=payload)
+        response = await image_backend.call(post)
+    except BackendUnavailable as e:
+        if raise_errors:
+            raise
+        logger.info("Skipping %s image: %s", tier.name, e)
+        return None
     except Exception as e:
-        print("❌ Request failed:", e)
+        if raise_errors:
+            raise
+        logger.warning("Image request failed: %s", e)
         return None
 
     if response.status_code != 200:
-        print("❌ Error response from API:", response.status_code, response.text)
+        logger.warning("Error response from image API: %s %s", response.status_code, response.text)
         return None
 
     try:
@@ -59,27 +126,28 @@ def generate_image(story_text, character_image_path):
         artifacts = result.get("artifacts", [])
         for idx, artifact in enumerate(artifacts):
             if artifact.get("finishReason") == "CONTENT_FILTERED":
-                print("🚫 Content was filtered by safety system.")
+                logger.info("Image was filtered by the safety system")
                 return None
             if "base64" in artifact:
                 image_data = base64.b64decode(artifact["base64"])
-                os.makedirs("static", exist_ok=True)
-                image_path = f"static/generated_{idx}.png"
-                with open(image_path, "wb") as f:
-                    f.write(image_data)
-                print(f"✅ Image saved to: {image_path}")
-                return f"/{image_path}"
+                # 缩小、重新编码后按用户和内容哈希保存，并发用户不会互相覆盖
+                image_url = await asyncio.to_thread(store_image, user_id, image_data, tier, turn_id)
+                logger.debug("%s image saved to %s", tier.name, image_url)
+                return image_url
     except Exception as e:
-        print("❌ Failed to parse image from response:", e)
+        logger.warning("Failed to parse image from response: %s", e)
 
-    print("⚠️ No image was returned.")
+    logger.warning("No image was returned")
     return None
 
 
 if __name__ == "__main__":
+    from app.core.config import load_env_file
+
+    load_env_file()
     test_story = "A beautiful girl with black hair and pale skin lives in a forest with seven dwarfs."
-    test_image_path = "C:/Users/Steven/Downloads/StoryBot-Final-Project/backend/character_images/snow_white.png"
-    result = generate_image_http(test_story, test_image_path)
+    test_image_path = "character_images/snow_white.png"
+    result = asyncio.run(generate_image(test_story, test_image_path))
     if result:
         print(f"✅ Image generated at: {result}")
     else:
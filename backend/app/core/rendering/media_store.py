@@ -0,0 +1,122 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+
+from app.core.config import get_settings
+from app.core.memory.session_manager import add_image, add_audio_response, get_recent_media_urls
+from app.utils.metrics import DB_SECONDS, timed
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+# 生成的媒体文件的目录，以 MEDIA_URL_PREFIX 挂载为静态文件
+MEDIA_ROOT = settings.media_root
+MEDIA_URL_PREFIX = "/static"
+IMAGE_DIR = os.path.join(MEDIA_ROOT, "images")
+TTS_DIR = os.path.join(MEDIA_ROOT, "tts")
+# 清理器只管理应用自己写入的目录，static/ 下其他文件不动
+MANAGED_DIRS = (IMAGE_DIR, TTS_DIR)
+
+MEDIA_MAX_BYTES = settings.media_max_bytes
+MEDIA_MAX_AGE_SECONDS = settings.media_max_age_seconds
+# 最近这段时间内被写入、访问或记录到 images / audio_responses 的文件视为仍在使用，不会被删除
+MEDIA_IN_USE_SECONDS = settings.media_in_use_seconds
+MEDIA_JANITOR_INTERVAL = settings.media_janitor_interval
+
+
+def _user_dir(user_id):
+    # 用户 ID 做哈希后作为目录名，避免特殊字符进入路径
+    return hashlib.sha256((user_id or "anonymous").encode("utf-8")).hexdigest()[:16]
+
+
+def media_url(path):
+    """MEDIA_ROOT 下的文件路径 -> 前端使用的 URL（/static/...）"""
+    return MEDIA_URL_PREFIX + "/" + os.path.relpath(path, MEDIA_ROOT).replace(os.sep, "/")
+
+
+def media_path(url):
+    """media_url 的逆操作"""
+    return os.path.join(MEDIA_ROOT, *url[len(MEDIA_URL_PREFIX):].strip("/").split("/"))
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def save_image(user_id, data, extension="png", tier="full", turn_id=None):
+    """按用户和内容哈希保存生成的图片，记录到 images 表，返回 URL"""
+    digest = hashlib.sha256(data).hexdigest()[:24]
+    path = os.path.join(IMAGE_DIR, _user_dir(user_id), f"{digest}.{extension}")
+    if os.path.exists(path):
+        os.utime(path)
+    else:
+        _write_atomic(path, data)
+    url = media_url(path)
+    if user_id:
+        with timed("add_image", DB_SECONDS):
+            add_image(user_id, url, tier, turn_id)
+    return url
+
+
+def record_audio(user_id, audio_url):
+    """把本轮使用的语音 URL 记录到 audio_responses 表"""
+    if user_id and audio_url:
+        add_audio_response(user_id, audio_url)
+
+
+def sweep(max_bytes=None, max_age=None, in_use_seconds=None, now=None):
+    """删除过期文件，并在总大小超出预算时从最旧的文件开始删除；仍在使用的文件不删"""
+    max_bytes = MEDIA_MAX_BYTES if max_bytes is None else max_bytes
+    max_age = MEDIA_MAX_AGE_SECONDS if max_age is None else max_age
+    in_use_seconds = MEDIA_IN_USE_SECONDS if in_use_seconds is None else in_use_seconds
+    now = time.time() if now is None else now
+
+    files = []
+    for directory in MANAGED_DIRS:
+        for root, _, names in os.walk(directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((max(stat.st_mtime, stat.st_atime), stat.st_size, path))
+    files.sort()
+
+    referenced = get_recent_media_urls(in_use_seconds)
+    total = sum(size for _, size, _ in files)
+    removed, freed = 0, 0
+    for used_at, size, path in files:
+        expired = now - used_at > max_age
+        if not expired and total <= max_bytes:
+            break
+        if now - used_at <= in_use_seconds or media_url(path) in referenced:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+        freed += size
+    if removed:
+        logger.info("Media janitor removed %d files (%d bytes), %d bytes remain", removed, freed, total)
+    return {"removed": removed, "freed_bytes": freed, "total_bytes": total}
+
+
+async def run_janitor(interval=None):
+    """后台定期清理，直到任务被取消"""
+    interval = MEDIA_JANITOR_INTERVAL if interval is None else interval
+    while True:
+        try:
+            await asyncio.to_thread(sweep)
+        except Exception:
+            logger.exception("Media janitor failed")
+        await asyncio.sleep(interval)
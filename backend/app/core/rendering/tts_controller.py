@@ -1,26 +1,263 @@
-import openai
+import asyncio
+import hashlib
+import logging
 import os
+import re
 import uuid
-from dotenv import load_dotenv
+from collections import OrderedDict
+from app.core.clients import get_openai_client
+from app.core.config import get_settings
+from app.core.rendering.media_store import TTS_DIR, media_path, media_url
+from app.core.resilience import tts_backend, use_deadline, wait_shared
 
-# 加载 .env 文件中的环境变量
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
+settings = get_settings()
+TTS_MODEL = settings.tts_model
+TTS_CACHE_DIR = TTS_DIR
+TTS_CACHE_MAX_BYTES = settings.tts_cache_max_bytes
 
-def generate_tts(text, voice="fable"):
-    audio_filename = f"{uuid.uuid4()}.mp3"
-    audio_file_path = os.path.join("static", audio_filename)
 
-    response = openai.audio.speech.create(
-        model="tts-1",
-        voice=voice,
-        input=text
-    )
+class TTSCache:
+    """按 (text, voice, model) 的哈希缓存 TTS 音频文件，超过容量时按 LRU 淘汰"""
 
-    # 保存音频到文件
-    with open(audio_file_path, "wb") as f:
-        f.write(response.content)
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = None  # key -> 文件大小，按最近使用排序
+        self._total_bytes = 0
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.bytes_saved = 0
 
-    print(f"Generated Audio URL: /static/{audio_filename}")
-    return f"/static/{audio_filename}"
+    @staticmethod
+    def key(text, voice, model):
+        return hashlib.sha256(f"{model}\0{voice}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def url(self, key):
+        return media_url(self.path(key))
+
+    def _scan(self):
+        # 第一次使用时扫描已有文件，重启后缓存依然有效；按修改时间近似 LRU 顺序
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".mp3"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        return OrderedDict((key, size) for _, key, size in sorted(files))
+
+    async def _load(self):
+        if self._entries is not None:
+            return
+        entries = await asyncio.to_thread(self._scan)
+        # 并发的第一次使用各自扫描，先完成的生效
+        if self._entries is None:
+            self._entries = entries
+            self._total_bytes = sum(entries.values())
+
+    @staticmethod
+    def _touch(path):
+        """刷新修改时间：重启后的 LRU 顺序和媒体清理器都以它判断文件是否仍在使用；文件已不存在时返回 False"""
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    @staticmethod
+    def _write(path, content):
+        # 先写临时文件再重命名，避免读到写了一半的音频
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _remove(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    # 文件系统操作都放到线程里，合成每一段语音时不阻塞事件循环
+    async def lookup(self, key):
+        await self._load()
+        size = self._entries.get(key)
+        if size is None:
+            return None
+        if not await asyncio.to_thread(self._touch, self.path(key)):
+            self._forget(key)
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.bytes_saved += size
+        return self.url(key)
+
+    async def store(self, key, content):
+        await self._load()
+        await asyncio.to_thread(self._write, self.path(key), content)
+        self._forget(key)
+        self._entries[key] = len(content)
+        self._total_bytes += len(content)
+        await self._evict()
+        return self.url(key)
+
+    def _forget(self, key):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    async def _evict(self):
+        evicted = []
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            evicted.append(self.path(key))
+        if evicted:
+            await asyncio.to_thread(self._remove, evicted)
+
+    async def get_or_create(self, key, synthesize):
+        """命中缓存直接返回 URL；同一个 key 的并发请求共享一次合成"""
+        url = await self.lookup(key)
+        if url is not None:
+            return url
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            url = await wait_shared(task)
+            self.bytes_saved += self._entries.get(key, 0)
+            return url
+
+        self.misses += 1
+
+        async def run():
+            try:
+                return await self.store(key, await synthesize())
+            finally:
+                self._inflight.pop(key, None)
+
+        # 共享的合成不继承第一个调用方的截止时间；每个调用方只按自己的截止时间放弃等待
+        with use_deadline(None):
+            task = asyncio.ensure_future(run())
+        self._inflight[key] = task
+        return await wait_shared(task)
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "evictions": self.evictions,
+            "entries": len(self._entries or ()),
+            "bytes": self._total_bytes,
+        }
+
+
+tts_cache = TTSCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES)
+
+
+async def generate_tts(text, voice="fable"):
+    key = TTSCache.key(text, voice, TTS_MODEL)
+
+    async def synthesize():
+        # 异步客户端，TTS 请求不会阻塞事件循环（OPENAI_BASE_URL 可指向本地 stub 服务）；
+        # 并发、限速、超时、重试和熔断由 tts_backend 控制
+        response = await tts_backend.call(
+            get_openai_client().audio.speech.create,
+            model=TTS_MODEL,
+            voice=voice,
+            input=text
+        )
+        return response.content
+
+    audio_url = await tts_cache.get_or_create(key, synthesize)
+    logger.debug("Generated audio URL: %s", audio_url)
+    return audio_url
+
+
+# 分段合成：第一段尽量短，让播放可以在一次短合成后就开始；后面的段落合并到接近上限，减少请求数
+TTS_FIRST_CHUNK_CHARS = settings.tts_first_chunk_chars
+TTS_CHUNK_CHARS = settings.tts_chunk_chars
+TTS_CHUNK_CONCURRENCY = settings.tts_chunk_concurrency
+
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?。！？])\s+|\s*-->\s*|\n+")
+
+
+def split_text_chunks(text, first_chunk_chars=None, chunk_chars=None):
+    """按句子切分文本，再把相邻的短句合并成不超过上限的段落"""
+    first_chunk_chars = TTS_FIRST_CHUNK_CHARS if first_chunk_chars is None else first_chunk_chars
+    chunk_chars = TTS_CHUNK_CHARS if chunk_chars is None else chunk_chars
+    chunks, current = [], ""
+    for sentence in _SENTENCE_BREAK.split(text or ""):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        limit = first_chunk_chars if not chunks else chunk_chars
+        if current and len(current) + 1 + len(sentence) > limit:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def iter_tts_chunks(text, voice="fable", concurrency=None):
+    """分段并行合成（并发数有上限），按原文顺序产出 (index, url)；每段单独走缓存"""
+    semaphore = asyncio.Semaphore(TTS_CHUNK_CONCURRENCY if concurrency is None else concurrency)
+
+    async def synthesize(chunk):
+        async with semaphore:
+            return await generate_tts(chunk, voice=voice)
+
+    tasks = [asyncio.ensure_future(synthesize(chunk)) for chunk in split_text_chunks(text)]
+    produced, error = False, None
+    try:
+        for index, task in enumerate(tasks):
+            try:
+                yield index, await task
+                produced = True
+            except Exception as e:
+                # 单段失败时跳过，其余段落照常播放
+                logger.warning("TTS chunk %d failed: %s", index, e)
+                error = e
+        # 全部失败时抛出最后一个错误，调用方（例如后台任务）能据此判断是否值得重试
+        if not produced and error is not None:
+            raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def stitch_audio(urls):
+    """把各段 MP3 按顺序拼接成一个完整文件（MP3 帧可以直接拼接），结果同样按内容缓存"""
+    if not urls:
+        return None
+    if len(urls) == 1:
+        return urls[0]
+    paths = [media_path(url) for url in urls]
+    key = TTSCache.key("\n".join(paths), "playlist", TTS_MODEL)
+
+    async def concatenate():
+        def read_all():
+            parts = []
+            for path in paths:
+                with open(path, "rb") as f:
+                    parts.append(f.read())
+            return b"".join(parts)
+        return await asyncio.to_thread(read_all)
+
+    return await tts_cache.get_or_create(key, concatenate)
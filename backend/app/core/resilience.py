@@ -0,0 +1,369 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import random
+import time
+from collections import Counter
+
+from app.core.config import get_settings
+from app.utils.metrics import BACKEND_CALLS
+
+logger = logging.getLogger(__name__)
+
+# 所有上游调用（LLM、图片、TTS）都经过这里：每个后端有自己的并发上限、令牌桶限速、单次请求超时、
+# 带抖动的指数退避重试和熔断器。HTTP 请求的截止时间放在 contextvar 里，随任务一起传到每一次上游调用，
+# 剩余时间不够时不再排队、等待限速或重试，而是直接放弃。
+settings = get_settings()
+BACKEND_MAX_ATTEMPTS = settings.backend_max_attempts
+BACKEND_RETRY_BASE_DELAY = settings.backend_retry_base_delay
+BACKEND_RETRY_MAX_DELAY = settings.backend_retry_max_delay
+CIRCUIT_FAILURE_THRESHOLD = settings.circuit_failure_threshold
+CIRCUIT_RESET_TIMEOUT = settings.circuit_reset_timeout
+MAX_IN_FLIGHT_REQUESTS = settings.max_in_flight_requests
+
+
+class BackendUnavailable(RuntimeError):
+    """后端熔断中，或者截止时间之前等不到并发名额 / 限速令牌；调用方应当降级而不是报错"""
+
+
+class CircuitOpen(BackendUnavailable):
+    pass
+
+
+class DeadlineExceeded(BackendUnavailable):
+    pass
+
+
+_deadline = contextvars.ContextVar("storybot_deadline", default=None)
+
+
+@contextlib.contextmanager
+def use_deadline(deadline):
+    """把截止时间（time.monotonic() 的绝对值，None 表示不限）设为 deadline，不和外层的比较"""
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+@contextlib.contextmanager
+def deadline_scope(timeout):
+    """在 timeout 秒内必须完成；这个范围里创建的任务也继承它，嵌套时取更早的截止时间"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    current = _deadline.get()
+    if current is not None and (deadline is None or current < deadline):
+        deadline = current
+    with use_deadline(deadline):
+        yield deadline
+
+
+def current_deadline():
+    return _deadline.get()
+
+
+def time_left():
+    """距离截止时间还有多少秒，没有截止时间时为 None"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def cap_timeout(timeout):
+    """把一个超时时间限制在剩余时间以内"""
+    left = time_left()
+    if left is None:
+        return timeout
+    left = max(left, 0.0)
+    return left if timeout is None else min(timeout, left)
+
+
+async def wait_shared(task):
+    """等待多个调用方共享的任务，只受当前调用方自己的截止时间限制；放弃等待不会取消任务
+
+    共享任务应当在 use_deadline(None) 下创建，否则会继承第一个调用方的截止时间，
+    让其他调用方跟着一起失败。
+    """
+    timeout = cap_timeout(None)
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), timeout)
+    except TimeoutError:
+        if timeout is None or task.done():
+            raise
+        raise DeadlineExceeded("gave up waiting for a shared call at the request deadline") from None
+
+
+def is_transient(error):
+    """超时、连接错误、429 和 5xx 值得重试，也计入熔断；参数错误、鉴权失败等重试也没用"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    # httpx / openai 的连接和超时错误；按类名判断，这里不导入这两个库
+    return any(cls.__name__ in ("TransportError", "APIConnectionError") for cls in type(error).__mro__)
+
+
+def already_retried(error):
+    """错误来自熔断 / 截止时间，或者已经按后端的策略重试过（非暂时性错误则是不值得重试）"""
+    return isinstance(error, BackendUnavailable) or getattr(error, "backend_attempts", 0) > 0
+
+
+class TokenBucket:
+    """令牌桶：平均每秒 rate 个请求，最多 burst 个的突发；rate 为 0 时不限速
+
+    令牌可以预支成负数，等待的请求按到达顺序依次拿到令牌。
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def reserve(self):
+        """取一个令牌，返回拿到它之前需要等待的秒数"""
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def refund(self):
+        """放弃等待时把预支的令牌还回去"""
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+
+class CircuitBreaker:
+    """连续失败 failure_threshold 次后断开，reset_timeout 秒内直接拒绝；之后只放一个试探请求，成功才恢复"""
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probing = False
+
+    @property
+    def available(self):
+        """现在发起的调用会不会被放行（不占用试探名额）"""
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+        return not self._probing
+
+    def allow(self):
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info("%s circuit closed", self.name)
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self._probing = False
+        self.failures += 1
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+            self.trips += 1
+            logger.warning("%s circuit opened after %d failures, retrying in %ss",
+                           self.name, self.failures, self.reset_timeout)
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """调用没有得到结论（被取消、截止时间已到、非暂时性错误）时让出试探名额"""
+        self._probing = False
+
+
+class Backend:
+    """一个上游服务的调用策略：并发上限、限速、单次超时、重试和熔断"""
+
+    def __init__(self, name, concurrency, rate=0.0, burst=1, timeout=None,
+                 max_attempts=BACKEND_MAX_ATTEMPTS, retry_base_delay=BACKEND_RETRY_BASE_DELAY,
+                 retry_max_delay=BACKEND_RETRY_MAX_DELAY, failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_attempts = max(max_attempts, 1)
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self._slots = asyncio.Semaphore(concurrency) if concurrency else None
+        self.in_flight = 0
+        self.waiting = 0
+        self.outcomes = Counter()
+        self.retries = 0
+        self.throttled = 0
+
+    @property
+    def available(self):
+        return self.breaker.available
+
+    async def call(self, func, *args, **kwargs):
+        """await func(*args, **kwargs)；暂时性错误按退避重试，熔断或截止时间不够时抛出 BackendUnavailable"""
+        attempt = 0
+        while True:
+            attempt += 1
+            if not self.breaker.allow():
+                self._count("rejected")
+                raise CircuitOpen(f"{self.name} backend is unavailable (circuit open)")
+            try:
+                result = await self._attempt(func, args, kwargs)
+            except BackendUnavailable:
+                self.breaker.release()
+                self._count("deadline")
+                raise
+            except Exception as e:
+                # 标记已经按本后端的策略处理过，外层（例如后台任务）不必再重试
+                e.backend_attempts = attempt
+                if not is_transient(e):
+                    self.breaker.release()
+                    self._count("error")
+                    raise
+                self.breaker.record_failure()
+                self._count("timeout" if isinstance(e, TimeoutError) else "failure")
+                # 全抖动的指数退避，同时失败的调用不会一起重试；剩余时间不够等到下一次时不再重试
+                delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** (attempt - 1)))
+                left = time_left()
+                if attempt >= self.max_attempts or not self.breaker.available \
+                        or (left is not None and delay >= left):
+                    raise
+                self.retries += 1
+                logger.info("%s call failed (%s: %s), retry %d in %.2fs",
+                            self.name, type(e).__name__, e, attempt, delay)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            self._count("success")
+            return result
+
+    async def _attempt(self, func, args, kwargs):
+        wait = self.bucket.reserve()
+        if wait:
+            left = time_left()
+            if left is not None and wait >= left:
+                self.bucket.refund()
+                raise DeadlineExceeded(f"{self.name} rate limit wait {wait:.2f}s exceeds the deadline")
+            self.throttled += 1
+            await asyncio.sleep(wait)
+
+        # 排队等并发名额的时间只受截止时间限制，不算作后端超时，也不计入熔断
+        if self._slots is not None:
+            self.waiting += 1
+            try:
+                async with asyncio.timeout(time_left()):
+                    await self._slots.acquire()
+            except TimeoutError:
+                raise DeadlineExceeded(f"{self.name} had no free slot before the deadline") from None
+            finally:
+                self.waiting -= 1
+        try:
+            left = time_left()
+            if left is not None and left <= 0:
+                raise DeadlineExceeded(f"{self.name} call skipped, deadline already passed")
+            timeout = cap_timeout(self.timeout)
+            self.in_flight += 1
+            try:
+                async with asyncio.timeout(timeout):
+                    return await func(*args, **kwargs)
+            except TimeoutError:
+                # 是请求的截止时间先到了，而不是后端太慢
+                if left is not None and (self.timeout is None or left < self.timeout):
+                    raise DeadlineExceeded(f"{self.name} call cut off by the deadline") from None
+                raise
+            finally:
+                self.in_flight -= 1
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+    def _count(self, outcome):
+        self.outcomes[outcome] += 1
+        BACKEND_CALLS.inc(backend=self.name, outcome=outcome)
+
+    def stats(self):
+        return {
+            "state": self.breaker.state,
+            "open": self.breaker.state != "closed",
+            "trips": self.breaker.trips,
+            "consecutive_failures": self.breaker.failures,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "concurrency": self.concurrency,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            **{outcome: self.outcomes[outcome]
+               for outcome in ("success", "failure", "timeout", "error", "rejected", "deadline")},
+        }
+
+
+llm_backend = Backend("llm", settings.llm_concurrency, settings.llm_rate_limit, settings.llm_rate_burst,
+                      settings.llm_request_timeout)
+image_backend = Backend("image", settings.image_concurrency, settings.image_rate_limit,
+                        settings.image_rate_burst, settings.image_request_timeout)
+tts_backend = Backend("tts", settings.tts_concurrency, settings.tts_rate_limit, settings.tts_rate_burst,
+                      settings.tts_request_timeout)
+backends = {backend.name: backend for backend in (llm_backend, image_backend, tts_backend)}
+
+
+class AdmissionController:
+    """准入控制：同时处理的请求超过上限，或者这个接口必需的后端熔断时立即拒绝，而不是排队直到超时"""
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT_REQUESTS):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = Counter()
+
+    def try_admit(self, required=()):
+        """可以处理时占用一个名额并返回 None，否则返回拒绝的原因；required 是这个请求必需的后端"""
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            reason = "overloaded"
+        else:
+            reason = next((f"{backend.name}_unavailable" for backend in required
+                           if not backend.available), None)
+        if reason is not None:
+            self.rejected[reason] += 1
+            return reason
+        self.in_flight += 1
+        self.admitted += 1
+        return None
+
+    def release(self):
+        self.in_flight -= 1
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "admitted": self.admitted,
+            "rejected": sum(self.rejected.values()),
+            **{f"rejected_{reason}": count for reason, count in sorted(self.rejected.items())},
+        }
+
+
+admission = AdmissionController()
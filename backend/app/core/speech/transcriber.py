@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.config import get_settings
+from app.utils.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# 本地语音转文字：每个 worker 进程只加载一次 Whisper 模型，所有请求共用。
+# 30 秒以内的片段（孩子说的一句话）凑成一批，一次前向推理解码；更长的音频单独转写。
+settings = get_settings()
+WHISPER_MODEL = settings.whisper_model
+WHISPER_DEVICE = settings.whisper_device
+WHISPER_LANGUAGE = settings.whisper_language
+WHISPER_PRELOAD = settings.whisper_preload
+WHISPER_MAX_BATCH = settings.whisper_max_batch
+WHISPER_BATCH_WINDOW = settings.whisper_batch_window
+WHISPER_MAX_UPLOAD_BYTES = settings.whisper_max_upload_bytes
+
+SAMPLE_RATE = 16000
+BATCHABLE_SECONDS = 30
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+class TranscriptionUnavailable(RuntimeError):
+    """没有安装 openai-whisper（或 ffmpeg）时抛出"""
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def _import_whisper():
+    try:
+        import whisper
+    except ImportError as e:
+        raise TranscriptionUnavailable(
+            "speech-to-text needs `pip install -r requirements-stt.txt` and ffmpeg") from e
+    return whisper
+
+
+async def save_upload(upload, max_bytes=None):
+    """把上传的音频按块写到临时文件，不把整个请求体读进内存；返回文件路径，调用方负责删除"""
+    max_bytes = WHISPER_MAX_UPLOAD_BYTES if max_bytes is None else max_bytes
+    suffix = os.path.splitext(upload.filename or "")[1] or ".audio"
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"audio upload exceeds {max_bytes} bytes")
+                await asyncio.to_thread(f.write, chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+class Transcriber:
+    """共享的 Whisper 模型和批处理队列；推理在单独的一个线程里串行执行"""
+
+    def __init__(self, model_size=WHISPER_MODEL, device=WHISPER_DEVICE, language=WHISPER_LANGUAGE,
+                 max_batch=WHISPER_MAX_BATCH, batch_window=WHISPER_BATCH_WINDOW):
+        self.model_size = model_size
+        self.device = device
+        self.language = language
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self._model = None
+        self._loading = None
+        # PyTorch 推理本身会用满多个核，多个线程同时推理只会互相争抢
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper")
+        self._queue = None
+        self._batcher = None
+        self.requests = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.errors = 0
+        self.load_seconds = 0.0
+        self.audio_seconds = 0.0
+        self.inference_seconds = 0.0
+
+    def _load_model(self):
+        whisper = _import_whisper()
+        started = time.perf_counter()
+        model = whisper.load_model(self.model_size, device=self.device)
+        self.load_seconds = time.perf_counter() - started
+        logger.info("Loaded Whisper %s on %s in %.1fs", self.model_size, self.device, self.load_seconds)
+        return model
+
+    async def warm(self):
+        """加载模型（只加载一次）；启动时调用可以让第一个语音请求不用等模型加载"""
+        if self._model is not None:
+            return self._model
+        if self._loading is None:
+            loop = asyncio.get_running_loop()
+            self._loading = loop.run_in_executor(self._executor, self._load_model)
+        try:
+            self._model = await asyncio.shield(self._loading)
+        except BaseException:
+            self._loading = None
+            raise
+        return self._model
+
+    async def transcribe_file(self, path):
+        """转写一个音频文件，返回 {"text", "language", "duration"}"""
+        whisper = _import_whisper()
+        # ffmpeg 解码在普通线程里并发进行，不占用推理线程
+        audio = await asyncio.to_thread(whisper.load_audio, path)
+        return await self.transcribe_audio(audio)
+
+    async def transcribe_audio(self, audio):
+        """转写 16kHz 单声道 float32 音频数组"""
+        await self.warm()
+        self.requests += 1
+        duration = len(audio) / SAMPLE_RATE
+        self.audio_seconds += duration
+        with timed("stt"):
+            if duration > BATCHABLE_SECONDS or self.max_batch <= 1:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self._executor, self._transcribe_long, audio)
+            else:
+                result = await self._enqueue(audio)
+        return {**result, "duration": round(duration, 2)}
+
+    def _transcribe_long(self, audio):
+        started = time.perf_counter()
+        try:
+            result = self._model.transcribe(audio, fp16=False, language=self.language)
+        finally:
+            self.inference_seconds += time.perf_counter() - started
+        return {"text": result["text"].strip(), "language": result.get("language")}
+
+    async def _enqueue(self, audio):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._batcher is None or self._batcher.done():
+            self._batcher = asyncio.ensure_future(self._run_batches())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((audio, future))
+        return await future
+
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            # 第一条请求到达后再等一个很短的窗口，把同时到达的请求凑成一批
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            batch = [(audio, future) for audio, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+            self.batches += 1
+            self.batched_requests += len(batch)
+            try:
+                results = await loop.run_in_executor(self._executor, self._decode_batch,
+                                                     [audio for audio, _ in batch])
+            except Exception as e:
+                self.errors += 1
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def _decode_batch(self, audios):
+        """把多段 30 秒以内的音频拼成一个 mel 批次，一次解码"""
+        import torch
+
+        whisper = _import_whisper()
+        started = time.perf_counter()
+        try:
+            mels = torch.stack([
+                whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), n_mels=self._model.dims.n_mels)
+                for audio in audios
+            ]).to(self._model.device)
+            options = whisper.DecodingOptions(language=self.language, fp16=False, without_timestamps=True)
+            results = whisper.decode(self._model, mels, options)
+        finally:
+            self.inference_seconds += time.perf_counter() - started
+        return [{"text": r.text.strip(), "language": r.language} for r in results]
+
+    def stats(self):
+        return {
+            "model": self.model_size,
+            "loaded": self._model is not None,
+            "requests": self.requests,
+            "batches": self.batches,
+            "avg_batch_size": self.batched_requests / self.batches if self.batches else 0.0,
+            "errors": self.errors,
+            "load_seconds": round(self.load_seconds, 3),
+            "audio_seconds": round(self.audio_seconds, 3),
+            "inference_seconds": round(self.inference_seconds, 3),
+            # 实时率：推理耗时 / 音频时长，小于 1 表示比实时快
+            "real_time_factor": self.inference_seconds / self.audio_seconds if self.audio_seconds else 0.0,
+        }
+
+
+transcriber = Transcriber()
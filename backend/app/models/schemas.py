@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel
 
 class StoryRequest(BaseModel):
@@ -9,3 +11,17 @@ class StoryRequest(BaseModel):
 class InteractionRequest(BaseModel):
     user_id: str
     user_input: str
+
+# LLM 结构化输出：字段名已经统一成小写，见 app/core/agents/structured_output.py
+class DialogResult(BaseModel):
+    intent: str = "user_dialogue"
+    character: Optional[str] = None
+    next_action: Optional[str] = None
+    reply: Optional[str] = None
+
+class StoryResult(BaseModel):
+    story: str
+    question: Optional[str] = None
+    word1: Optional[str] = None
+    word2: Optional[str] = None
+    word3: Optional[str] = None
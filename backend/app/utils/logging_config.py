@@ -0,0 +1,32 @@
+import json
+import logging
+
+from app.core.config import get_settings
+
+# LOG_FORMAT=json 时每行输出一个 JSON 对象，logger 调用里的 extra 字段原样带上，方便日志系统检索
+# LogRecord 自带的属性，其余的都是调用方通过 extra 传入的字段
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in _RESERVED})
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level=None, fmt=None):
+    settings = get_settings()
+    handler = logging.StreamHandler()
+    if (fmt or settings.log_format) == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logging.basicConfig(level=level or settings.log_level, handlers=[handler], force=True)
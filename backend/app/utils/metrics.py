@@ -0,0 +1,143 @@
+import bisect
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# 进程内的指标：直方图和计数器都是固定大小的数组，记录一次只是一次二分查找加几次加法，
+# 可以在生产环境一直开着。/metrics 按 Prometheus 文本格式输出。
+
+# 秒级的默认分桶，覆盖数据库调用（毫秒级）到图片生成（几十秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in sorted(items):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-1]!r}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+    def snapshot(self):
+        """{labels: (count, sum)}，给负载测试之类的代码直接读取"""
+        with self._lock:
+            return {key: (sum(series[:-1]), series[-1]) for key, series in self._series.items()}
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_format_labels(key)} {value}" for key, value in items)
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help):
+        metric = Counter(name, help)
+        self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, prefix, stats):
+        """把已有的 stats() 字典（缓存命中率等）作为 gauge 输出，读取时才调用"""
+        self._collectors.append((prefix, stats))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for prefix, stats in self._collectors:
+            for key, value in stats().items():
+                if isinstance(value, (int, float)):
+                    name = re.sub(r"[^a-zA-Z0-9_]", "_", f"{prefix}_{key}")
+                    lines.append(f"# TYPE {name} gauge")
+                    lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    "storybot_stage_seconds", "Duration of each stage of a story turn")
+STAGE_ERRORS = registry.counter(
+    "storybot_stage_errors_total", "Stages that raised or timed out")
+DB_SECONDS = registry.histogram(
+    "storybot_db_seconds", "Duration of database calls, including the thread hop")
+LLM_TOKENS = registry.counter(
+    "storybot_llm_tokens_total", "Estimated LLM tokens by call and direction")
+BACKEND_CALLS = registry.counter(
+    "storybot_backend_calls_total", "Upstream calls by backend and outcome, including retries")
+LLM_BATCH_SIZE = registry.histogram(
+    "storybot_llm_batch_size", "Prompts sent in one upstream LLM request", buckets=(1, 2, 4, 8, 16, 32))
+
+
+@contextmanager
+def timed(stage, histogram=STAGE_SECONDS, **labels):
+    """记录一个阶段的耗时；抛出异常时同时计入错误数"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        STAGE_ERRORS.inc(stage=stage, error=type(e).__name__)
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - started, stage=stage, **labels)
@@ -0,0 +1,25 @@
+import functools
+import os
+
+# 提示词模板按包内的相对位置查找，和启动时的工作目录无关；每个模板只读取、编译一次
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts")
+
+
+@functools.lru_cache(maxsize=None)
+def _environment():
+    from jinja2 import Environment, FileSystemLoader
+
+    return Environment(loader=FileSystemLoader(PROMPTS_DIR), auto_reload=False)
+
+
+@functools.lru_cache(maxsize=None)
+def get_template(name):
+    return _environment().get_template(name)
+
+
+def preload_templates():
+    """启动时编译全部模板，第一个请求不再承担这部分开销"""
+    names = [name for name in sorted(os.listdir(PROMPTS_DIR)) if name.endswith(".jinja2")]
+    for name in names:
+        get_template(name)
+    return len(names)
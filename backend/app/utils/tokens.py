@@ -0,0 +1,5 @@
+def estimate_tokens(text):
+    """粗略估算 token 数（英文约 4 个字符一个 token），不依赖具体模型的 tokenizer"""
+    if not text:
+        return 0
+    return len(text) // 4 + 1
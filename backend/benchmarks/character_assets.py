@@ -0,0 +1,39 @@
+"""每次图片请求准备定妆照的 CPU 时间：每次都用 PIL 处理 vs 注册表缓存
+
+    python -m benchmarks.character_assets --requests 50
+"""
+import argparse
+import time
+
+from app.core.rendering.character_assets import (
+    CharacterAssetRegistry, character_image_path, prepare_init_image
+)
+
+CHARACTERS = ["Snow White", "Cinderella", "Thomas", "My Little Pony"]
+
+
+def measure(label, load, requests):
+    started = time.process_time()
+    for i in range(requests):
+        load(character_image_path(CHARACTERS[i % len(CHARACTERS)]))
+    per_request = (time.process_time() - started) / requests * 1000
+    print(f"{label:<10} {per_request:8.2f} ms CPU per request")
+    return per_request
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    before = measure("before", prepare_init_image, args.requests)
+    registry = CharacterAssetRegistry()
+    started = time.process_time()
+    registry.preload()
+    print(f"preload    {(time.process_time() - started) * 1000:8.2f} ms CPU once at startup")
+    after = measure("after", registry.get, args.requests)
+    print(f"speedup    {before / max(after, 1e-6):8.0f}x")
+
+
+if __name__ == "__main__":
+    main()
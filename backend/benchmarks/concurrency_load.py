@@ -0,0 +1,87 @@
+"""并发负载测试：同时发起 N 个 /story/process 请求，检查它们是否在同一个 worker 上重叠执行
+
+后端和 stub 服务都在本地子进程里启动，不调用任何付费 API：
+    python -m benchmarks.concurrency_load --concurrency 10
+
+如果请求是排队执行的，总耗时约等于 N * 单次耗时；真正异步时总耗时接近单次耗时。
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_server(module, port, env):
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", module, "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+
+
+async def wait_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"server at {url} did not start")
+
+
+async def one_turn(client, base_url, user_id):
+    started = time.monotonic()
+    response = await client.post(f"{base_url}/story/process",
+                                 json={"user_id": user_id, "user_input": "Thomas"})
+    if response.status_code != 200:
+        raise RuntimeError(f"{response.status_code}: {response.text}")
+    return time.monotonic() - started
+
+
+async def run(args):
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ,
+               OPENAI_API_KEY="stub", STABILITY_API_KEY="stub",
+               OPENAI_BASE_URL=f"{stub_url}/v1",
+               STABILITY_API_URL=f"{stub_url}/v1/generation/stub/image-to-image",
+               STORYBOT_DB=os.path.join(workdir, "bench.db"), MEDIA_ROOT=os.path.join(workdir, "static"))
+    procs = [start_server("benchmarks.stub_servers:app", args.stub_port, env),
+             start_server("run_agent:app", args.app_port, env)]
+    try:
+        await wait_ready(stub_url + "/docs")
+        await wait_ready(app_url + "/")
+        async with httpx.AsyncClient(timeout=None) as client:
+            single = await one_turn(client, app_url, "warmup")
+            started = time.monotonic()
+            latencies = await asyncio.gather(*[
+                one_turn(client, app_url, f"child-{i}") for i in range(args.concurrency)
+            ])
+            wall = time.monotonic() - started
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+
+    overlap = sum(latencies) / wall
+    print(f"single turn:        {single:.2f}s")
+    print(f"{args.concurrency} concurrent turns: {wall:.2f}s wall, "
+          f"max latency {max(latencies):.2f}s")
+    print(f"overlap factor:     {overlap:.1f}x (1.0x = fully serialized)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--stub-port", type=int, default=8100)
+    parser.add_argument("--app-port", type=int, default=8001)
+    asyncio.run(run(parser.parse_args()))
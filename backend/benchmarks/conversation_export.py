@@ -0,0 +1,101 @@
+"""/story/conversations 的读取方式对比：一次性 fetchall 和键集分页 / NDJSON 流式导出
+
+    python -m benchmarks.conversation_export --rows 500000
+
+在一个临时库里生成指定行数的对话，分别测量
+  - 旧实现：SELECT * ... fetchall() 再整体 json.dumps 的耗时和 Python 内存峰值；
+  - 第一页、翻到表尾附近的一页、按用户 + 时间范围过滤的一页的延迟；
+  - 流式导出全部行的耗时、吞吐和内存峰值（应当与行数无关）。
+内存峰值用 tracemalloc 统计，只包含 Python 对象。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.history_reads import USERS, fill
+
+
+def measure(func):
+    """返回 (结果, 耗时秒数, Python 内存峰值 MB)；tracemalloc 会拖慢很多，耗时取不跟踪的那一次"""
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak / 1e6
+
+
+def full_table(session_manager):
+    with session_manager.pool.connection() as conn:
+        rows = conn.execute("SELECT * FROM conversation_memory ORDER BY created_at").fetchall()
+    return len(json.dumps({"conversations": rows}, ensure_ascii=False))
+
+
+def stream_export(session_manager):
+    async def run():
+        size = 0
+        with open(os.devnull, "w") as sink:
+            async for rows in session_manager.aiter_conversation_pages():
+                chunk = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+                sink.write(chunk)
+                size += len(chunk)
+        return size
+    return asyncio.run(run())
+
+
+def page_latency(func, samples):
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=500000)
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--skip-full-table", action="store_true", help="不运行旧的一次性读取（行数很大时很慢）")
+    args = parser.parse_args()
+
+    os.environ["STORYBOT_DB"] = os.path.join(tempfile.mkdtemp(), "export.db")
+    from app.core.memory import session_manager
+    session_manager.create_tables()
+    with session_manager.pool.connection() as conn:
+        fill(conn, 0, args.rows)
+        last = conn.execute("SELECT created_at, id FROM conversation_memory ORDER BY created_at DESC, id DESC "
+                            "LIMIT 1 OFFSET ?", (session_manager.CONVERSATION_PAGE_SIZE * 2,)).fetchone()
+        since = conn.execute("SELECT created_at FROM conversation_memory ORDER BY created_at "
+                             "LIMIT 1 OFFSET ?", (args.rows // 2,)).fetchone()[0]
+    print(f"{args.rows} rows, {os.path.getsize(os.environ['STORYBOT_DB']) / 1e6:.0f} MB database")
+
+    if not args.skip_full_table:
+        size, elapsed, peak = measure(lambda: full_table(session_manager))
+        print(f"fetchall + json.dumps: {elapsed:8.2f}s  peak {peak:8.1f} MB  ({size / 1e6:.0f} MB response)")
+
+    first = page_latency(lambda: session_manager.get_conversations_page(), args.samples)
+    deep = page_latency(lambda: session_manager.get_conversations_page(after=tuple(last)), args.samples)
+    filtered = page_latency(lambda: session_manager.get_conversations_page(
+        user_id=f"child-{random.randrange(USERS)}", since=since), args.samples)
+    print(f"first page:            {first:8.3f} ms")
+    print(f"page near the end:     {deep:8.3f} ms")
+    print(f"user + since page:     {filtered:8.3f} ms")
+
+    size, elapsed, peak = measure(lambda: stream_export(session_manager))
+    print(f"NDJSON export:         {elapsed:8.2f}s  peak {peak:8.1f} MB  "
+          f"({args.rows / elapsed:,.0f} rows/s, {size / 1e6:.0f} MB streamed)")
+
+
+if __name__ == "__main__":
+    main()
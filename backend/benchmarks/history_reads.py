@@ -0,0 +1,69 @@
+"""按用户读取对话历史和故事状态的延迟，随数据库行数增长的变化
+
+    python -m benchmarks.history_reads --sizes 100000,1000000,3000000
+
+逐步把一个临时库填充到指定的行数（约 1/3 写入 story_state），每个规模下测量一轮
+所需的读取：最近 N 轮对话 + 最新故事状态。加了索引后延迟应当基本不随行数变化；
+--no-index 可以对比迁移前的全表扫描。
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+USERS = 5000
+
+
+def fill(conn, start, stop):
+    batch = 50000
+    for offset in range(start, stop, batch):
+        rows = [(f"child-{random.randrange(USERS)}", f"message {i}", '{"intent": "continue_story"}')
+                for i in range(offset, min(stop, offset + batch))]
+        with conn:
+            conn.executemany(
+                "INSERT INTO conversation_memory (user_id, message, response, created_at) "
+                "VALUES (?, ?, ?, datetime('now', ?))",
+                [(u, m, r, f"-{len(rows) - j} seconds") for j, (u, m, r) in enumerate(rows)])
+            conn.executemany(
+                "INSERT INTO story_state (user_id, current_state) VALUES (?, ?)",
+                [(u, "child reply: ...") for u, _, _ in rows[::3]])
+
+
+def measure(session_manager, samples):
+    timings = []
+    for _ in range(samples):
+        user_id = f"child-{random.randrange(USERS)}"
+        started = time.perf_counter()
+        session_manager.get_conversation_memory(user_id)
+        session_manager.get_story_state(user_id)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), statistics.quantiles(timings, n=100)[94]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100000,1000000,3000000")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--no-index", action="store_true", help="跳过迁移，测量未加索引时的延迟")
+    args = parser.parse_args()
+
+    os.environ["STORYBOT_DB"] = os.path.join(tempfile.mkdtemp(), "history.db")
+    from app.core.memory import session_manager
+    if args.no_index:
+        session_manager.migrate = lambda conn: None
+    session_manager.create_tables()
+
+    filled = 0
+    print(f"{'rows':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    with session_manager.pool.connection() as conn:
+        for size in (int(s) for s in args.sizes.split(",")):
+            fill(conn, filled, size)
+            filled = size
+            p50, p95 = measure(session_manager, args.samples)
+            print(f"{size:>10} {p50:>8.3f} {p95:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
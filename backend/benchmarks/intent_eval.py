@@ -0,0 +1,105 @@
+"""快速意图分类器的离线评估：用 conversation_memory 里 LLM 给出的意图作为标注
+
+    python -m benchmarks.intent_eval --db storybot.db
+
+按用户、按时间顺序回放对话，用之前的 LLM 结果推算孩子当时已经选定的角色，
+统计分类器能直接处理的比例（即省掉的 LLM 调用）以及与 LLM 标注一致的比例。
+JSON 解析失败的兜底回复和分类器自己产生的记录不参与评估。
+另外检查一组手工标注的输入（CASES），其中否定、结束的说法必须交给 LLM。
+"""
+import argparse
+import json
+import sqlite3
+import time
+from collections import Counter
+
+from app.core.agents.intent_classifier import classify_intent
+from app.core.config import get_settings
+
+FALLBACK_REPLY = "I am sorry, I am not able to understand you. do you like Cinderella?"
+
+# (输入, 当时已选的角色, 期望的快速路径意图)；None 表示必须交给 LLM
+CASES = [
+    ("Thomas", None, "choose_character"),
+    ("change to cinderella", "Thomas", "change_character"),
+    ("换成灰姑娘", "Thomas", "change_character"),
+    ("continue", "Thomas", "continue_story"),
+    ("don't change to cinderella", "Thomas", None),
+    ("我不要换成灰姑娘", "Thomas", None),
+    ("I don't want to switch to thomas", "Cinderella", None),
+    ("switch to thomas", "Thomas", None),
+    ("no more", "Thomas", None),
+    ("next time", "Thomas", None),
+    ("不要了", "Thomas", None),
+]
+
+
+def load_rows(database):
+    conn = sqlite3.connect(f"file:{database}?mode=ro", uri=True)
+    try:
+        return conn.execute(
+            "SELECT user_id, message, response FROM conversation_memory ORDER BY user_id, created_at, id"
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def check_cases(threshold=None):
+    """返回与期望不一致的 [(输入, 期望, 实际)]"""
+    failures = []
+    for message, current, expected in CASES:
+        prediction = classify_intent(message, current, threshold)
+        actual = prediction and prediction["intent"]
+        if actual != expected:
+            failures.append((message, expected, actual))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default=get_settings().database)
+    parser.add_argument("--threshold", type=float, default=None)
+    args = parser.parse_args()
+
+    failures = check_cases(args.threshold)
+    print(f"hand-labelled cases: {len(CASES) - len(failures)}/{len(CASES)} as expected")
+    for message, expected, actual in failures:
+        print(f"  {message!r}: expected {expected}, got {actual}")
+
+    total = fast = correct = 0
+    confusion = Counter()
+    current = {}
+    elapsed = 0.0
+    for user_id, message, response in load_rows(args.db):
+        try:
+            label = json.loads(response)
+        except json.JSONDecodeError:
+            continue
+        if not isinstance(label, dict) or label.get("source") or label.get("reply") == FALLBACK_REPLY:
+            continue
+
+        started = time.perf_counter()
+        prediction = classify_intent(message, current.get(user_id), args.threshold)
+        elapsed += time.perf_counter() - started
+
+        total += 1
+        if prediction is not None:
+            fast += 1
+            confusion[(label.get("intent"), prediction["intent"])] += 1
+            correct += prediction["intent"] == label.get("intent")
+        if label.get("character"):
+            current[user_id] = label["character"]
+
+    if not total:
+        print("no labelled rows found")
+        return
+    print(f"labelled turns:      {total}")
+    print(f"LLM calls avoided:   {fast} ({fast / total:.0%})")
+    print(f"fast-path accuracy:  {correct / fast:.0%}" if fast else "fast-path accuracy:  n/a")
+    print(f"classifier latency:  {elapsed / total * 1e6:.1f} us/turn")
+    for (expected, predicted), count in sorted(confusion.items()):
+        print(f"  llm={expected:<18} fast={predicted:<18} {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""LLM 批处理对吞吐的影响：逐个请求 vs 并发请求攒批成一次 completions 调用
+
+    python -m benchmarks.llm_batching
+    python -m benchmarks.llm_batching --users 1,8,32 --upstream-concurrency 4 --llm-latency 0.5
+
+启动本地 stub 服务，N 个并发“用户”各自顺序发出若干个意图 prompt，分别直接调用 LangChain
+OpenAI 和经过 LLMBatcher，报告吞吐、p50/p95 延迟、上游收到的请求数和实际的批大小。
+--upstream-concurrency 模拟上游按请求数限流（同时只处理这么多个请求）：
+不限流时批处理省掉的是请求次数和往返开销，限流时直接体现为吞吐的差别。
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import httpx
+
+from benchmarks.concurrency_load import start_server, wait_ready
+
+PROMPT = "你是一个儿童绘本助手。孩子说：{i}，请判断意图并以 JSON 回复。"
+
+
+def quantile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run(llm, users, calls):
+    latencies = []
+
+    async def user(u):
+        for i in range(calls):
+            started = time.perf_counter()
+            await llm.ainvoke(PROMPT.format(i=f"{u}-{i}"))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(u) for u in range(users)))
+    return time.perf_counter() - started, latencies
+
+
+async def upstream_requests(client, stub_url):
+    return (await client.get(f"{stub_url}/stub/stats")).json()["llm_requests"]
+
+
+async def main(args):
+    from langchain_openai import OpenAI
+    from app.core.agents.llm_batcher import LLMBatcher
+
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    env = dict(os.environ, STUB_LLM_LATENCY=str(args.llm_latency),
+               STUB_LLM_CONCURRENCY=str(args.upstream_concurrency), STUB_LATENCY_JITTER="0")
+    stub = start_server("benchmarks.stub_servers:app", args.stub_port, env)
+    try:
+        await wait_ready(stub_url + "/docs")
+        # 所有模式共用一个连接池，对比的只是请求次数和批大小
+        async with httpx.AsyncClient(timeout=30) as client:
+            print(f"stub latency {args.llm_latency}s, upstream concurrency "
+                  f"{args.upstream_concurrency or 'unlimited'}, {args.calls} calls per user")
+            print(f"\n{'users':>5} {'mode':<9}{'calls/s':>9}{'p50 s':>8}{'p95 s':>8}"
+                  f"{'upstream':>10}{'avg batch':>11}")
+            for users in (int(u) for u in args.users.split(",")):
+                for mode in ("direct", "batched"):
+                    llm = OpenAI(api_key="stub", base_url=f"{stub_url}/v1", max_retries=0,
+                                 http_async_client=client)
+                    if mode == "batched":
+                        llm = LLMBatcher(llm, max_batch=args.max_batch, window=args.window, timeout=60)
+                    before = await upstream_requests(client, stub_url)
+                    elapsed, latencies = await run(llm, users, args.calls)
+                    requests = await upstream_requests(client, stub_url) - before
+                    avg_batch = llm.stats()["avg_batch_size"] if mode == "batched" else 1.0
+                    print(f"{users:>5} {mode:<9}{len(latencies) / elapsed:>9.1f}"
+                          f"{statistics.median(latencies):>8.3f}{quantile(latencies, 0.95):>8.3f}"
+                          f"{requests:>10}{avg_batch:>11.2f}")
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", default="1,4,16,32")
+    parser.add_argument("--calls", type=int, default=10)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--upstream-concurrency", type=int, default=4)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--window", type=float, default=0.01)
+    parser.add_argument("--stub-port", type=int, default=8100)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,91 @@
+"""LLM 响应缓存的效果：重复 prompt、并发的相同 prompt、重启后（只剩磁盘层）的命中，
+以及合并的请求里一个调用方的截止时间不影响其他调用方
+
+    python -m benchmarks.llm_cache --latency 1.5 --concurrency 20
+
+用固定延迟的假 LLM 代替上游，数据库放在临时目录里，不调用任何付费 API。
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ["STORYBOT_DB"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+
+from app.core.agents.llm_cache import CachedLLM, LLMCache  # noqa: E402
+from app.core.memory.session_manager import create_tables  # noqa: E402
+from app.core.resilience import DeadlineExceeded, deadline_scope  # noqa: E402
+
+
+class SlowLLM:
+    _identifying_params = {"model_name": "stub", "temperature": 0.7}
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    async def ainvoke(self, prompt, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return '{"story": "Once upon a time...", "question": "Red or blue?"}'
+
+
+async def timed(coro):
+    started = time.perf_counter()
+    await coro
+    return time.perf_counter() - started
+
+
+async def run(args):
+    create_tables()
+    upstream = SlowLLM(args.latency)
+    cache = LLMCache()
+    llm = CachedLLM(upstream, cache, enabled=True)
+    prompt = "你是一个互动绘本作家...\n  Main character: Elsa  \n\n"
+
+    cold = await timed(llm.ainvoke(prompt, max_tokens=1000))
+    # 只有空白不同的 prompt 也应该命中
+    warm = await timed(llm.ainvoke(prompt.replace("  ", " "), max_tokens=1000))
+    print(f"cold call:            {cold:.3f}s")
+    print(f"repeated prompt:      {warm * 1000:.2f}ms")
+
+    calls = upstream.calls
+    burst = await timed(asyncio.gather(*(llm.ainvoke(f"{prompt} burst", max_tokens=1000)
+                                         for _ in range(args.concurrency))))
+    print(f"{args.concurrency} concurrent same: {burst:.3f}s, {upstream.calls - calls} upstream call(s)")
+
+    # 模拟重启：新的缓存对象，内存层是空的
+    restarted = CachedLLM(upstream, LLMCache(), enabled=True)
+    disk = await timed(restarted.ainvoke(prompt, max_tokens=1000))
+    print(f"after restart (disk): {disk * 1000:.2f}ms")
+
+    calls = upstream.calls
+    await llm.ainvoke(prompt, max_tokens=500)
+    print(f"different params:     {upstream.calls - calls} upstream call(s)")
+
+    # 相同 prompt：第一个调用方的截止时间很短，第二个不限时；共享的上游调用不能继承前者的截止时间
+    async def short_deadline():
+        with deadline_scope(args.latency / 10):
+            return await llm.ainvoke(f"{prompt} deadline", max_tokens=1000)
+
+    async def no_deadline():
+        await asyncio.sleep(0.01)
+        return await llm.ainvoke(f"{prompt} deadline", max_tokens=1000)
+
+    short, unlimited = await asyncio.gather(short_deadline(), no_deadline(), return_exceptions=True)
+    assert isinstance(short, DeadlineExceeded), short
+    assert isinstance(unlimited, str), unlimited
+    print(f"coalesced deadlines:  short -> {type(short).__name__}, no deadline -> response")
+    print("stats:", cache.stats())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=1.5)
+    parser.add_argument("--concurrency", type=int, default=20)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""离线负载测试：在本地 stub 服务上模拟多个孩子的多轮会话，报告吞吐量、各阶段延迟分位数和数据库增长
+
+    python -m benchmarks.load_test --sessions 20 --turns 5 --concurrency 10
+    python -m benchmarks.load_test --llm-latency 1.0 --image-failure-rate 0.2 --budget turn=6 --budget story=2.5
+
+后端（run_agent.py）和 stub 服务都在本地子进程里启动，不调用任何付费 API。
+客户端侧的阶段是流式接口各事件的到达时间（intent、story、首段语音、image、audio、done），
+服务端侧的阶段来自 /metrics 里的直方图（按分桶插值估算分位数）。
+--budget stage=秒 给某个阶段的 p95 设上限，超出时以非零状态退出，可以在部署前发现性能回退。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.concurrency_load import start_server, wait_ready
+
+# 孩子在一次会话里典型的输入：先选角色，然后回答故事里的问题，偶尔闲聊或换角色
+OPENING_INPUTS = ["Elsa", "I like Thomas", "Snow White please", "我想听白雪公主", "Cinderella!"]
+ANSWER_INPUTS = ["red", "blue", "the forest", "the castle", "yes", "continue", "继续", "I think the bird",
+                 "she should go home", "more please"]
+CHAT_INPUTS = ["why is the sky blue?", "I have a dog", "what is your name?"]
+CHANGE_INPUTS = ["I want Thomas now", "换成艾莎", "can we have Cinderella instead"]
+
+CLIENT_STAGES = ("intent", "story", "first_audio", "image_preview", "image_url", "audio_url", "done")
+
+
+def session_inputs(turns, rng):
+    inputs = [rng.choice(OPENING_INPUTS)]
+    while len(inputs) < turns:
+        roll = rng.random()
+        if roll < 0.1:
+            inputs.append(rng.choice(CHANGE_INPUTS))
+        elif roll < 0.2:
+            inputs.append(rng.choice(CHAT_INPUTS))
+        else:
+            inputs.append(rng.choice(ANSWER_INPUTS))
+    return inputs
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * q
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+async def one_turn(client, app_url, user_id, user_input, timings, errors):
+    started = time.monotonic()
+    seen = set()
+    try:
+        async with client.stream("POST", f"{app_url}/story/process/stream",
+                                 json={"user_id": user_id, "user_input": user_input}) as response:
+            if response.status_code != 200:
+                errors[f"http_{response.status_code}"] += 1
+                return False
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                name = event["event"]
+                if name == "audio_segment":
+                    name = "first_audio"
+                if name == "error":
+                    errors["turn_error"] += 1
+                    return False
+                if name in ("image_url", "audio_url") and event.get(name) is None:
+                    errors[f"{name}_missing"] += 1
+                if name in CLIENT_STAGES and name not in seen:
+                    seen.add(name)
+                    timings[name].append(time.monotonic() - started)
+    except httpx.HTTPError as e:
+        errors[type(e).__name__] += 1
+        return False
+    return "done" in seen
+
+
+async def run_session(client, app_url, index, turns, seed, semaphore, timings, errors, counts):
+    rng = random.Random(seed + index)
+    user_id = f"load-{seed}-{index}"
+    async with semaphore:
+        for user_input in session_inputs(turns, rng):
+            ok = await one_turn(client, app_url, user_id, user_input, timings, errors)
+            counts["ok" if ok else "failed"] += 1
+
+
+# 报告为阶段耗时的直方图 -> 阶段名的前缀
+TIMING_METRICS = {"storybot_stage_seconds": "", "storybot_db_seconds": "db:"}
+
+_BUCKET = re.compile(r'^(\w+)_bucket\{(.*)\} (\S+)$')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_histograms(text):
+    """{(metric, "stage label=value"): [(le, cumulative), ...]}"""
+    histograms = defaultdict(list)
+    for line in text.splitlines():
+        match = _BUCKET.match(line)
+        if not match:
+            continue
+        labels = dict(_LABEL.findall(match.group(2)))
+        le = float(labels.pop("le"))
+        stage = labels.pop("stage", "")
+        name = stage + "".join(f" {k}={v}" for k, v in sorted(labels.items()))
+        histograms[(match.group(1), name)].append((le, float(match.group(3))))
+    return histograms
+
+
+def histogram_quantile(buckets, q):
+    """和 Prometheus 的 histogram_quantile 一样在分桶内线性插值"""
+    buckets = sorted(buckets)
+    total = buckets[-1][1] if buckets else 0
+    if not total:
+        return None
+    rank = q * total
+    previous_le, previous_count = 0.0, 0.0
+    for le, count in buckets:
+        if count >= rank:
+            if le == float("inf"):
+                return previous_le
+            width = count - previous_count
+            return previous_le + (le - previous_le) * ((rank - previous_count) / width if width else 0)
+        previous_le, previous_count = le, count
+    return previous_le
+
+
+def db_snapshot(database):
+    """(字节数, {表: 行数})；先做一次 WAL 检查点，否则新写入都还在 -wal 文件里"""
+    if not os.path.exists(database):
+        return 0, {}
+    conn = sqlite3.connect(database)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        rows = {t: conn.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0] for t in tables}
+    finally:
+        conn.close()
+    size = sum(os.path.getsize(path) for path in (database, database + "-wal") if os.path.exists(path))
+    return size, rows
+
+
+def fmt(value):
+    return "      -" if value is None else f"{value:7.3f}"
+
+
+async def run(args):
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    # 数据库和媒体文件都放在临时目录里：不写进仓库的 static/，也不复用上一次运行的 TTS 缓存
+    workdir = tempfile.mkdtemp()
+    database = os.path.join(workdir, "load.db")
+    env = dict(os.environ,
+               OPENAI_API_KEY="stub", STABILITY_API_KEY="stub",
+               OPENAI_BASE_URL=f"{stub_url}/v1",
+               STABILITY_API_URL=f"{stub_url}/v1/generation/stub/image-to-image",
+               STORYBOT_DB=database, MEDIA_ROOT=os.path.join(workdir, "static"),
+               LOG_LEVEL="WARNING",
+               STUB_LLM_LATENCY=str(args.llm_latency),
+               STUB_TTS_LATENCY=str(args.tts_latency),
+               STUB_IMAGE_LATENCY=str(args.image_latency),
+               STUB_LLM_FAILURE_RATE=str(args.llm_failure_rate),
+               STUB_TTS_FAILURE_RATE=str(args.tts_failure_rate),
+               STUB_IMAGE_FAILURE_RATE=str(args.image_failure_rate),
+               STUB_LATENCY_JITTER=str(args.jitter))
+    procs = [start_server("benchmarks.stub_servers:app", args.stub_port, env),
+             start_server("run_agent:app", args.app_port, env)]
+    timings = defaultdict(list)
+    errors = defaultdict(int)
+    counts = defaultdict(int)
+    try:
+        await wait_ready(stub_url + "/docs")
+        await wait_ready(app_url + "/")
+        db_before = db_snapshot(database)
+        limits = httpx.Limits(max_connections=args.concurrency + 4)
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+            semaphore = asyncio.Semaphore(args.concurrency)
+            started = time.monotonic()
+            await asyncio.gather(*(
+                run_session(client, app_url, i, args.turns, args.seed, semaphore, timings, errors, counts)
+                for i in range(args.sessions)
+            ))
+            wall = time.monotonic() - started
+            metrics_text = (await client.get(f"{app_url}/metrics")).text
+        # 等后台的摘要刷新等写入落盘
+        await asyncio.sleep(1)
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+    db_after = db_snapshot(database)
+
+    turns = counts["ok"] + counts["failed"]
+    print(f"sessions {args.sessions} x {args.turns} turns, concurrency {args.concurrency}: "
+          f"{turns} turns in {wall:.1f}s = {turns / wall:.2f} turns/s, {counts['failed']} failed")
+    if errors:
+        print("errors:  " + ", ".join(f"{k}={v}" for k, v in sorted(errors.items())))
+
+    report = {}
+    print(f"\n{'client stage (s)':<34}{'p50':>8}{'p95':>8}{'p99':>8}{'n':>6}")
+    for stage in CLIENT_STAGES:
+        values = timings.get(stage, [])
+        qs = [percentile(values, q) for q in (0.5, 0.95, 0.99)]
+        report[stage] = qs[1]
+        print(f"{stage:<34}{fmt(qs[0])} {fmt(qs[1])} {fmt(qs[2])}{len(values):6d}")
+
+    histograms = parse_histograms(metrics_text)
+    print(f"\n{'server stage (s, from /metrics)':<34}{'p50':>8}{'p95':>8}{'p99':>8}")
+    for (metric, labels), buckets in sorted(histograms.items()):
+        if metric not in TIMING_METRICS:
+            continue
+        qs = [histogram_quantile(buckets, q) for q in (0.5, 0.95, 0.99)]
+        name = TIMING_METRICS[metric] + labels
+        report.setdefault(name, qs[1])
+        print(f"{name:<34}{fmt(qs[0])} {fmt(qs[1])} {fmt(qs[2])}")
+
+    # 批大小是每次上游请求里的 prompt 数，不是耗时，单独按分桶报告
+    batch_sizes = sorted(histograms.get(("storybot_llm_batch_size", ""), []))
+    if batch_sizes and batch_sizes[-1][1]:
+        requests = batch_sizes[-1][1]
+        prompts = float(re.search(r"^storybot_llm_batch_size_sum (\S+)$", metrics_text, re.M).group(1))
+        buckets, previous = [], 0
+        for le, count in batch_sizes:
+            if count > previous:
+                buckets.append(f"<={le:g}: {count - previous:.0f}")
+            previous = count
+        print(f"\nllm batch size: {prompts / requests:.2f} prompts/request over {requests:.0f} requests "
+              f"({', '.join(buckets)})")
+
+    size_before, rows_before = db_before
+    size_after, rows_after = db_after
+    growth = size_after - size_before
+    print(f"\ndatabase: {size_before / 1024:.0f}KB -> {size_after / 1024:.0f}KB "
+          f"(+{growth / 1024:.0f}KB, {growth / max(turns, 1):.0f} bytes/turn)")
+    for table in sorted(rows_after):
+        added = rows_after[table] - rows_before.get(table, 0)
+        if added:
+            print(f"  {table:<24} +{added} rows")
+
+    failed_budgets = []
+    for budget in args.budget:
+        stage, limit = budget.split("=")
+        value = report.get(stage)
+        if value is None or value > float(limit):
+            failed_budgets.append(f"{stage} p95 {fmt(value).strip()}s > {limit}s")
+    if args.max_failure_rate is not None and turns and counts["failed"] / turns > args.max_failure_rate:
+        failed_budgets.append(f"failure rate {counts['failed'] / turns:.2%} > {args.max_failure_rate:.2%}")
+    for failure in failed_budgets:
+        print("BUDGET EXCEEDED:", failure)
+    return 1 if failed_budgets else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--tts-latency", type=float, default=0.5)
+    parser.add_argument("--image-latency", type=float, default=1.0)
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--tts-failure-rate", type=float, default=0.0)
+    parser.add_argument("--image-failure-rate", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--budget", action="append", default=[], metavar="STAGE=SECONDS",
+                        help="p95 上限，例如 --budget turn=6 --budget story=2.5")
+    parser.add_argument("--max-failure-rate", type=float, default=None)
+    parser.add_argument("--stub-port", type=int, default=8100)
+    parser.add_argument("--app-port", type=int, default=8001)
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""弹性策略的故障注入测试：上游故障、恢复、过载和截止时间
+
+    python -m benchmarks.resilience
+    python -m benchmarks.resilience --max-in-flight 8 --reset-timeout 3
+
+启动本地 stub 服务和后端（熔断阈值、重置时间、并发上限调小），通过 POST /stub/faults 在运行中注入故障，
+依次运行以下场景并报告每个场景的结果、耗时和上游收到的请求数：
+  healthy        没有故障，每一轮都有图片和语音；
+  image_outage   图片接口全部返回 500：熔断之后的轮次只返回文字和语音（degraded 事件），不再请求图片接口；
+  image_recovery 故障恢复，重置时间过后试探请求成功，图片恢复；
+  overload       LLM 变慢时同时发出远超并发上限的请求：超出的部分立即得到 503，而不是排队到超时；
+  deadline       X-Request-Timeout 比 LLM 延迟短：请求在截止时间附近返回 503，而不是等到 LLM 返回；
+  llm_outage     LLM 接口全部返回 500：熔断之后新请求在准入阶段立即得到 503。
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+
+from benchmarks.concurrency_load import start_server, wait_ready
+
+INPUTS = ["Elsa", "red", "the forest", "continue", "blue", "the castle", "yes", "I think the bird"]
+
+
+async def stream_turn(client, app_url, user_id, user_input):
+    """发起一轮流式请求，返回 (HTTP 状态码, 事件名集合, 耗时)"""
+    started = time.monotonic()
+    events = set()
+    try:
+        async with client.stream("POST", f"{app_url}/story/process/stream",
+                                 json={"user_id": user_id, "user_input": user_input}) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return response.status_code, events, time.monotonic() - started
+            async for line in response.aiter_lines():
+                if line:
+                    event = json.loads(line)
+                    if event.get(event["event"], True) is not None:
+                        events.add(event["event"])
+    except httpx.HTTPError as e:
+        events.add(type(e).__name__)
+    return 200, events, time.monotonic() - started
+
+
+async def run_turns(client, app_url, name, turns, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            return await stream_turn(client, app_url, f"{name}-{i % concurrency}", f"{INPUTS[i % len(INPUTS)]} {i}")
+
+    return await asyncio.gather(*(one(i) for i in range(turns)))
+
+
+async def stub_requests(client, stub_url):
+    return (await client.get(f"{stub_url}/stub/stats")).json()
+
+
+async def set_faults(client, stub_url, **faults):
+    (await client.post(f"{stub_url}/stub/faults", json=faults)).raise_for_status()
+
+
+def summarize(name, results, upstream, backends):
+    statuses = Counter(status for status, _, _ in results)
+    events = Counter(event for _, names, _ in results for event in names)
+    latencies = [elapsed for _, _, elapsed in results]
+    print(f"\n{name}")
+    print("  responses:  " + ", ".join(f"{status}={count}" for status, count in sorted(statuses.items())))
+    print(f"  events:     done={events['done']} story={events['story']} image_url={events['image_url']} "
+          f"audio_url={events['audio_url']} degraded={events['degraded']} error={events['error']}")
+    print(f"  latency:    p50 {statistics.median(latencies):.2f}s  max {max(latencies):.2f}s")
+    print("  upstream:   " + ", ".join(f"{key}+{value}" for key, value in upstream.items()))
+    print("  circuits:   " + ", ".join(f"{backend}={stats['state']}" for backend, stats in backends.items()))
+
+
+async def scenario(client, stub_url, app_url, name, run):
+    before = await stub_requests(client, stub_url)
+    results = await run()
+    after = await stub_requests(client, stub_url)
+    upstream = {key: after[key] - before[key] for key in ("llm_requests", "image_requests", "tts_requests")}
+    backends = (await client.get(f"{app_url}/story/stats/backends")).json()
+    summarize(name, results, upstream, backends)
+    return results
+
+
+async def burst(client, app_url, requests, timeout=None):
+    """同时发出 requests 个非流式请求，返回 (状态码, 事件, 耗时)"""
+    headers = {"X-Request-Timeout": str(timeout)} if timeout else {}
+
+    async def one(i):
+        started = time.monotonic()
+        response = await client.post(f"{app_url}/story/process", headers=headers,
+                                     json={"user_id": f"burst-{i}", "user_input": f"tell me more {i}"})
+        return response.status_code, set(), time.monotonic() - started
+
+    return await asyncio.gather(*(one(i) for i in range(requests)))
+
+
+def status_latency(results, status):
+    latencies = [elapsed for code, _, elapsed in results if code == status]
+    return f"{status}: n={len(latencies)}" + (f" p50 {statistics.median(latencies) * 1000:.0f}ms" if latencies else "")
+
+
+async def main(args):
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ,
+               OPENAI_API_KEY="stub", STABILITY_API_KEY="stub",
+               OPENAI_BASE_URL=f"{stub_url}/v1",
+               STABILITY_API_URL=f"{stub_url}/v1/generation/stub/image-to-image",
+               STORYBOT_DB=os.path.join(workdir, "resilience.db"), MEDIA_ROOT=os.path.join(workdir, "static"),
+               LOG_LEVEL="ERROR", LLM_CACHE_ENABLED="false",
+               STUB_LLM_LATENCY="0.2", STUB_TTS_LATENCY="0.2", STUB_IMAGE_LATENCY="0.5",
+               CIRCUIT_FAILURE_THRESHOLD=str(args.failure_threshold),
+               CIRCUIT_RESET_TIMEOUT=str(args.reset_timeout),
+               BACKEND_RETRY_BASE_DELAY="0.1",
+               MAX_IN_FLIGHT_REQUESTS=str(args.max_in_flight))
+    procs = [start_server("benchmarks.stub_servers:app", args.stub_port, env),
+             start_server("run_agent:app", args.app_port, env)]
+    try:
+        await wait_ready(stub_url + "/docs")
+        await wait_ready(app_url + "/")
+        async with httpx.AsyncClient(timeout=60) as client:
+            turns = lambda name: lambda: run_turns(client, app_url, name, args.turns, args.concurrency)
+
+            await scenario(client, stub_url, app_url, "healthy", turns("healthy"))
+
+            await set_faults(client, stub_url, image_failure_rate=1)
+            await scenario(client, stub_url, app_url, "image_outage", turns("outage"))
+
+            await set_faults(client, stub_url, image_failure_rate=0)
+            await asyncio.sleep(args.reset_timeout + 0.5)
+            await scenario(client, stub_url, app_url, "image_recovery", turns("recovery"))
+
+            await set_faults(client, stub_url, llm_latency=2)
+            results = await scenario(client, stub_url, app_url, "overload",
+                                     lambda: burst(client, app_url, args.max_in_flight * 4))
+            print(f"  {status_latency(results, 200)}   {status_latency(results, 503)}")
+
+            await set_faults(client, stub_url, llm_latency=5)
+            results = await scenario(client, stub_url, app_url, "deadline (X-Request-Timeout: 1)",
+                                     lambda: burst(client, app_url, 2, timeout=1))
+            print(f"  {status_latency(results, 503)}")
+
+            await set_faults(client, stub_url, llm_latency=0.2, llm_failure_rate=1)
+            await scenario(client, stub_url, app_url, "llm_outage", turns("llm-outage"))
+            results = await scenario(client, stub_url, app_url, "llm_outage (after the circuit opened)",
+                                     lambda: burst(client, app_url, args.concurrency))
+            print(f"  {status_latency(results, 503)}")
+            admission = (await client.get(f"{app_url}/story/stats/admission")).json()
+            print("\nadmission: " + ", ".join(f"{key}={value}" for key, value in admission.items()))
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=12)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--max-in-flight", type=int, default=8)
+    parser.add_argument("--failure-threshold", type=int, default=3)
+    parser.add_argument("--reset-timeout", type=float, default=3.0)
+    parser.add_argument("--stub-port", type=int, default=8100)
+    parser.add_argument("--app-port", type=int, default=8001)
+    asyncio.run(main(parser.parse_args()))
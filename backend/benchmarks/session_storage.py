@@ -0,0 +1,106 @@
+"""session_manager 存储层微基准：连接池 + WAL + 单事务提交 vs 原来的每次调用都 connect，
+以及会话缓存（热会话不读库、写入攒批落库）
+
+    python -m benchmarks.session_storage --turns 2000
+
+一个“轮次”模拟 /story/process 的数据库访问：读角色、读对话历史、读故事状态、更新角色，
+再写入对话记录和故事状态。
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+
+
+def legacy_turn(database, user_id, i):
+    # 原 session_manager 的写法：每个函数单独 connect / commit / close
+    def call(sql, params, fetch=None):
+        conn = sqlite3.connect(database)
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        result = cursor.fetchall() if fetch else None
+        conn.commit()
+        conn.close()
+        return result
+
+    call("SELECT character_name FROM users WHERE user_id = ?", (user_id,), fetch=True)
+    call("SELECT message, response FROM conversation_memory WHERE user_id = ? ORDER BY created_at",
+         (user_id,), fetch=True)
+    call("SELECT current_state FROM story_state WHERE user_id = ? ORDER BY created_at DESC LIMIT 1",
+         (user_id,), fetch=True)
+    call("UPDATE users SET character_name = ? WHERE user_id = ?", ("Thomas", user_id))
+    call("INSERT INTO conversation_memory (user_id, message, response) VALUES (?, ?, ?)",
+         (user_id, f"message {i}", "{}"))
+    call("INSERT INTO story_state (user_id, current_state) VALUES (?, ?)", (user_id, f"state {i}"))
+
+
+def pooled_turn(session_manager, user_id, i):
+    session_manager.get_user_character(user_id)
+    session_manager.get_conversation_memory(user_id)
+    session_manager.get_story_state(user_id)
+    session_manager.update_user_character(user_id, "Thomas")
+    session_manager.record_turn(user_id, conversation=(f"message {i}", "{}"),
+                                story_state=f"state {i}")
+
+
+def cached_turns(session_cache, turns, users):
+    """和 pooled_turn 相同的读写，经过会话缓存；结束时把剩余的写入落库，计入耗时"""
+    async def run():
+        for i in range(turns):
+            user_id = f"child-{i % users}"
+            session = await session_cache.get(user_id)
+            session.history()
+            await session_cache.update_character(user_id, "Thomas")
+            await session_cache.record_turn(user_id, conversation=(f"message {i}", "{}"),
+                                            story_state=f"state {i}")
+            # 让出事件循环，后台落库任务有机会运行
+            await asyncio.sleep(0)
+        await session_cache.close()
+    asyncio.run(run())
+
+
+def measure(label, turn, turns, users):
+    started = time.perf_counter()
+    for i in range(turns):
+        turn(f"child-{i % users}", i)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<10} {turns / elapsed:10.1f} turns/s  ({elapsed:.2f}s for {turns} turns)")
+    return turns / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ["STORYBOT_DB"] = os.path.join(workdir, "pooled.db")
+    from app.core.memory import session_manager
+    session_manager.create_tables()
+
+    # legacy 库复制同样的空表结构，保持默认的 rollback journal 模式，和原来的部署一致
+    legacy_db = os.path.join(workdir, "legacy.db")
+    with session_manager.pool.connection() as src, sqlite3.connect(legacy_db) as dst:
+        src.backup(dst)
+        dst.execute("PRAGMA journal_mode=DELETE")
+
+    legacy = measure("legacy", lambda u, i: legacy_turn(legacy_db, u, i), args.turns, args.users)
+    pooled = measure("pooled", lambda u, i: pooled_turn(session_manager, u, i), args.turns, args.users)
+    print(f"speedup    {pooled / legacy:10.1f}x")
+
+    from app.core.memory.session_cache import SessionCache
+    session_cache = SessionCache(flush_interval=0.05)
+    started = time.perf_counter()
+    cached_turns(session_cache, args.turns, args.users)
+    elapsed = time.perf_counter() - started
+    stats = session_cache.stats()
+    print(f"{'cached':<10} {args.turns / elapsed:10.1f} turns/s  ({elapsed:.2f}s for {args.turns} turns, "
+          f"{stats['misses']} session loads, {stats['flushes']} flushes)")
+    print(f"speedup    {args.turns / elapsed / pooled:10.1f}x over pooled")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""推测式生成的端到端测试：用假的 LLM 驱动 generate_story，比较开关推测时的章节延迟、命中率和浪费的 token
+
+    python -m benchmarks.speculation
+    python -m benchmarks.speculation --children 8 --turns 6 --hit-rate 0.5 --llm-latency 0.5
+
+每个“孩子”读完一章（--think 秒）后回答：按 --hit-rate 的比例选章节末尾问题里的某个选项，
+其余时候说一句和选项无关的话。假 LLM 有固定延迟，并统计收到的调用次数，不调用任何付费 API；
+数据库和媒体目录放在临时目录里。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+workdir = tempfile.mkdtemp()
+os.environ["STORYBOT_DB"] = os.path.join(workdir, "speculation.db")
+os.environ["MEDIA_ROOT"] = os.path.join(workdir, "static")
+
+from app.core import clients  # noqa: E402
+from app.core.agents import story_agent  # noqa: E402
+from app.core.memory.session_manager import create_tables  # noqa: E402
+
+OPTIONS = ["the forest", "the castle", "the sea"]
+OFF_SCRIPT = ["I want to fly to the moon", "my dog is big", "not the forest", "can we have a picnic"]
+
+
+class FakeStoryLLM:
+    """固定延迟，每一章都以一个三选一的问题结尾"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    async def ainvoke(self, prompt, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return json.dumps({
+            "story": f"Chapter {self.calls}. " + "The friends walked on and found something new. " * 8,
+            "question": f"Should we go to {OPTIONS[0]}, {OPTIONS[1]}, or {OPTIONS[2]}?",
+            "word1": "forest", "word2": "castle", "word3": "sea",
+        })
+
+
+async def child(name, args, rng, latencies):
+    await story_agent.generate_story(name, "Thomas", "Thomas")
+    for _ in range(args.turns):
+        await asyncio.sleep(args.think)
+        answer = rng.choice(OPTIONS[:args.top_k]) if rng.random() < args.hit_rate else rng.choice(OFF_SCRIPT)
+        started = time.perf_counter()
+        await story_agent.generate_story(name, answer, "Thomas")
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_mode(args, enabled):
+    llm = FakeStoryLLM(args.llm_latency)
+    clients._llm = llm
+    speculator = story_agent.Speculator(story_agent._generate_candidate, enabled=enabled, top_k=args.top_k,
+                                        token_budget=args.token_budget)
+    story_agent.speculator = speculator
+    rng = random.Random(args.seed)
+    latencies = []
+    prefix = "spec" if enabled else "plain"
+    await asyncio.gather(*(child(f"{prefix}-{i}", args, rng, latencies) for i in range(args.children)))
+    # 等丢弃的候选跑完，浪费的 token 才会计入
+    await asyncio.sleep(args.llm_latency * 2)
+    latencies.sort()
+    print(f"\nspeculation {'on' if enabled else 'off'}")
+    print(f"  chapter latency:  p50 {statistics.median(latencies) * 1000:.0f}ms  "
+          f"p95 {latencies[int(0.95 * (len(latencies) - 1))] * 1000:.0f}ms")
+    print(f"  llm calls:        {llm.calls}")
+    if enabled:
+        stats = speculator.stats()
+        print(f"  hits / misses:    {stats['hits']} / {stats['misses']} ({stats['hit_rate']:.0%})")
+        print(f"  tokens:           used {stats['used_tokens']}  wasted {stats['wasted_tokens']}  "
+              f"(skipped for budget: {stats['skipped_budget']})")
+        return stats
+
+
+async def main(args):
+    create_tables()
+    await run_mode(args, enabled=False)
+    stats = await run_mode(args, enabled=True)
+    assert stats["hits"] > 0 or args.hit_rate == 0, "no speculative chapter was served"
+    assert stats["wasted_tokens"] > 0 or stats["misses"] == 0, "discarded candidates were not counted"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--children", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--hit-rate", type=float, default=0.6)
+    parser.add_argument("--top-k", type=int, default=2)
+    parser.add_argument("--token-budget", type=int, default=100000)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--think", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
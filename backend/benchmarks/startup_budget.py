@@ -0,0 +1,162 @@
+"""冷启动回归检查：导入耗时、导入时的文件 I/O、启动到就绪的时间和第一个请求的延迟
+
+    python -m benchmarks.startup_budget
+    python -m benchmarks.startup_budget --import-budget 1.0 --first-request-budget 3.0 --skip-server
+
+1. 在一个干净的子进程里用 python -X importtime 导入 run_agent（工作目录设为临时目录、不设置 API key），
+   报告总耗时和最慢的模块，并检查 LangChain / openai 这类重量级依赖没有在导入时被加载；
+2. 用审计钩子记录导入期间打开的非代码文件，导入应该不读写任何数据文件（模板、.env、数据库等）；
+3. 启动后端（指向本地 stub 服务），测量从进程启动到就绪的时间、第一个和第二个请求的延迟。
+任何一项超出预算时以非零状态退出。
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.concurrency_load import BACKEND_DIR, start_server, wait_ready
+
+# 只应在第一次调用时才导入的模块
+LAZY_MODULES = ("langchain", "langchain_openai", "langchain_core", "openai")
+
+AUDIT_SCRIPT = r"""
+import json, os, sys
+opened = []
+code_suffixes = (".py", ".pyc", ".so", ".pth", ".pyd")
+def hook(event, args):
+    if event == "open" and isinstance(args[0], str):
+        path = os.path.abspath(args[0])
+        if not path.endswith(code_suffixes) and not path.startswith(sys.base_prefix) \
+                and not path.startswith(sys.prefix) and "site-packages" not in path:
+            opened.append(path)
+sys.addaudithook(hook)
+sys.path.insert(0, sys.argv[1])
+import run_agent
+print(json.dumps({"opened": opened, "modules": sorted(sys.modules)}))
+"""
+
+
+def clean_env():
+    env = {k: v for k, v in os.environ.items()
+           if not k.startswith(("OPENAI_", "STABILITY_", "STORYBOT_", "PYTHON"))}
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def measure_import(runs):
+    """返回 (最好一次的总耗时秒数, [(模块, 自身耗时微秒)])"""
+    best, slowest = None, []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {BACKEND_DIR!r}); import run_agent"],
+            cwd=tempfile.gettempdir(), env=clean_env(), capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"import run_agent failed:\n{result.stderr[-2000:]}")
+        rows = []
+        total = None
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line or "self [us]" in line:
+                continue
+            self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+            rows.append((name, int(self_us)))
+            if name == "run_agent":
+                total = int(cumulative_us) / 1e6
+        if best is None or total < best:
+            best, slowest = total, sorted(rows, key=lambda r: r[1], reverse=True)[:10]
+    return best, slowest
+
+
+def audit_import():
+    result = subprocess.run([sys.executable, "-c", AUDIT_SCRIPT, BACKEND_DIR],
+                            cwd=tempfile.gettempdir(), env=clean_env(), capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import run_agent failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+async def measure_server(args):
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ,
+               OPENAI_API_KEY="stub", STABILITY_API_KEY="stub",
+               OPENAI_BASE_URL=f"{stub_url}/v1",
+               STABILITY_API_URL=f"{stub_url}/v1/generation/stub/image-to-image",
+               STORYBOT_DB=os.path.join(workdir, "startup.db"), MEDIA_ROOT=os.path.join(workdir, "static"),
+               LOG_LEVEL="WARNING")
+    stub = start_server("benchmarks.stub_servers:app", args.stub_port, env)
+    procs = [stub]
+    try:
+        await wait_ready(stub_url + "/docs")
+        started = time.monotonic()
+        procs.append(start_server("run_agent:app", args.app_port, env))
+        await wait_ready(app_url + "/", timeout=60)
+        ready = time.monotonic() - started
+        latencies = []
+        async with httpx.AsyncClient(timeout=None) as client:
+            for i in range(2):
+                t0 = time.monotonic()
+                response = await client.post(f"{app_url}/story/process",
+                                             json={"user_id": f"startup-{i}", "user_input": "Thomas"})
+                response.raise_for_status()
+                latencies.append(time.monotonic() - t0)
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+    return ready, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--import-budget", type=float, default=1.5, help="导入 run_agent 的最长秒数")
+    parser.add_argument("--ready-budget", type=float, default=10.0, help="进程启动到就绪的最长秒数")
+    parser.add_argument("--first-request-budget", type=float, default=3.0)
+    parser.add_argument("--skip-server", action="store_true")
+    parser.add_argument("--stub-port", type=int, default=8100)
+    parser.add_argument("--app-port", type=int, default=8001)
+    args = parser.parse_args()
+
+    failures = []
+    total, slowest = measure_import(args.runs)
+    print(f"import run_agent:      {total:.3f}s (best of {args.runs}, budget {args.import_budget}s)")
+    for name, self_us in slowest:
+        print(f"  {self_us / 1000:8.1f}ms  {name}")
+    if total > args.import_budget:
+        failures.append(f"import took {total:.3f}s")
+
+    audit = audit_import()
+    eager = sorted({m.split(".")[0] for m in audit["modules"]} & set(LAZY_MODULES))
+    print(f"eagerly imported:      {', '.join(eager) or 'none of ' + ', '.join(LAZY_MODULES)}")
+    print(f"files opened on import: {len(audit['opened'])}")
+    for path in audit["opened"]:
+        print(f"  {path}")
+    if eager:
+        failures.append(f"heavy modules imported eagerly: {', '.join(eager)}")
+    if audit["opened"]:
+        failures.append(f"{len(audit['opened'])} data files opened during import")
+
+    if not args.skip_server:
+        ready, latencies = asyncio.run(measure_server(args))
+        print(f"process start -> ready: {ready:.2f}s (budget {args.ready_budget}s)")
+        print(f"first request:          {latencies[0]:.2f}s (budget {args.first_request_budget}s)")
+        print(f"second request:         {latencies[1]:.2f}s")
+        if ready > args.ready_budget:
+            failures.append(f"startup took {ready:.2f}s")
+        if latencies[0] > args.first_request_budget:
+            failures.append(f"first request took {latencies[0]:.2f}s")
+
+    for failure in failures:
+        print("BUDGET EXCEEDED:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""流式接口的首字节时间：对比 /story/process 和 /story/process/stream 各事件的到达时间
+
+    python -m benchmarks.stream_ttfb
+
+后端指向本地 stub 服务，不调用任何付费 API。
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.concurrency_load import start_server, wait_ready
+
+
+async def run(args):
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ,
+               OPENAI_API_KEY="stub", STABILITY_API_KEY="stub",
+               OPENAI_BASE_URL=f"{stub_url}/v1",
+               STABILITY_API_URL=f"{stub_url}/v1/generation/stub/image-to-image",
+               STORYBOT_DB=os.path.join(workdir, "bench.db"), MEDIA_ROOT=os.path.join(workdir, "static"))
+    procs = [start_server("benchmarks.stub_servers:app", args.stub_port, env),
+             start_server("run_agent:app", args.app_port, env)]
+    body = {"user_id": "child-stream", "user_input": "Thomas"}
+    try:
+        await wait_ready(stub_url + "/docs")
+        await wait_ready(app_url + "/")
+        async with httpx.AsyncClient(timeout=None) as client:
+            started = time.monotonic()
+            response = await client.post(f"{app_url}/story/process", json=body)
+            print(f"/story/process          complete response   {time.monotonic() - started:6.2f}s")
+
+            started = time.monotonic()
+            async with client.stream("POST", f"{app_url}/story/process/stream", json=body) as response:
+                first_byte = None
+                async for line in response.aiter_lines():
+                    if first_byte is None:
+                        first_byte = time.monotonic() - started
+                        print(f"/story/process/stream   first byte          {first_byte:6.2f}s")
+                    if line:
+                        event = json.loads(line)["event"]
+                        print(f"/story/process/stream   {event:<19} {time.monotonic() - started:6.2f}s")
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stub-port", type=int, default=8100)
+    parser.add_argument("--app-port", type=int, default=8001)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,134 @@
+"""结构化输出解析的语料评估：收集到的各种不规范 LLM 输出，逐条检查解析和修复结果
+
+    python -m benchmarks.structured_output_eval [-v]
+
+每条语料给出期望的字段值；任何一条不符合时以非零状态退出，可以直接放进 CI。
+对比的基线是原来的 json.loads + 大写字段名：失败就丢掉整次生成。
+"""
+import argparse
+import json
+import sys
+import time
+
+from app.core.agents.structured_output import parse_structured, split_question
+from app.models.schemas import DialogResult, StoryResult
+
+STORY = "Elsa walked into the snowy forest. She found a little rabbit."
+QUESTION = "What color was the rabbit?"
+
+# (名称, 模型, 原始输出, 期望字段)；期望为 None 表示应该解析失败
+CORPUS = [
+    ("story: clean lowercase keys (what the prompt asks for)", StoryResult,
+     json.dumps({"story": STORY, "question": QUESTION, "word1": "snow", "word2": "forest", "word3": "rabbit"}),
+     {"story": STORY, "question": QUESTION, "word1": "snow", "word3": "rabbit"}),
+    ("story: capitalized keys", StoryResult,
+     json.dumps({"Story": STORY, "Question": QUESTION, "Word1": "snow"}),
+     {"story": STORY, "question": QUESTION, "word1": "snow"}),
+    ("story: fenced json block", StoryResult,
+     "```json\n" + json.dumps({"story": STORY, "question": QUESTION}) + "\n```",
+     {"story": STORY, "question": QUESTION}),
+    ("story: prose before and after the object", StoryResult,
+     "Sure! Here is the next part of the story:\n" + json.dumps({"story": STORY, "question": QUESTION})
+     + "\nI hope you enjoy it!",
+     {"story": STORY, "question": QUESTION}),
+    ("story: trailing commas", StoryResult,
+     '{"story": "%s", "question": "%s", "word1": "snow",}' % (STORY, QUESTION),
+     {"story": STORY, "question": QUESTION, "word1": "snow"}),
+    ("story: smart quotes", StoryResult,
+     '{“story”: “%s”, “question”: “%s”}' % (STORY, QUESTION),
+     {"story": STORY, "question": QUESTION}),
+    ("story: single-quoted python dict", StoryResult,
+     "{'story': 'Elsa walked into the snowy forest.', 'question': 'Where did Elsa go?'}",
+     {"story": "Elsa walked into the snowy forest.", "question": "Where did Elsa go?"}),
+    ("story: raw newlines inside strings", StoryResult,
+     '{"story": "Elsa walked into the snowy forest.\nShe found a little rabbit.", "question": "%s"}' % QUESTION,
+     {"story": "Elsa walked into the snowy forest.\nShe found a little rabbit.", "question": QUESTION}),
+    ("story: truncated by max_tokens inside the story", StoryResult,
+     '{"story": "Elsa walked into the snowy forest. She found a little',
+     {"story": "Elsa walked into the snowy forest. She found a little"}),
+    ("story: truncated after a key", StoryResult,
+     '{"story": "%s", "question": "%s", "word1"' % (STORY, QUESTION),
+     {"story": STORY, "question": QUESTION}),
+    ("story: words given as a list", StoryResult,
+     json.dumps({"story": STORY, "question": QUESTION, "words": ["snow", "forest", "rabbit"]}),
+     {"word1": "snow", "word2": "forest", "word3": "rabbit"}),
+    ("story: alias keys", StoryResult,
+     json.dumps({"Story Text": STORY, "Questions": QUESTION}),
+     {"story": STORY, "question": QUESTION}),
+    ("story: markdown labels instead of json", StoryResult,
+     "**Story:** %s\n\n**Question:** %s\n\nword1: snow\nword2: forest\nword3: rabbit" % (STORY, QUESTION),
+     {"story": STORY, "question": QUESTION, "word1": "snow", "word3": "rabbit"}),
+    ("story: plain text, question split from the end", StoryResult,
+     STORY + " " + QUESTION,
+     {"story": STORY + " " + QUESTION}),
+    ("story: empty completion", StoryResult, "", None),
+
+    ("dialog: clean", DialogResult,
+     json.dumps({"intent": "continue_story", "character": "Elsa", "next_action": "generate_story", "reply": None}),
+     {"intent": "continue_story", "character": "Elsa", "next_action": "generate_story"}),
+    ("dialog: capitalized and camelCase keys", DialogResult,
+     json.dumps({"Intent": "change_character", "Character": "Thomas", "nextAction": "generate_story"}),
+     {"intent": "change_character", "character": "Thomas", "next_action": "generate_story"}),
+    ("dialog: fenced with explanation", DialogResult,
+     "The user wants to continue.\n```\n{\"intent\": \"continue_story\", \"character\": \"Elsa\"}\n```",
+     {"intent": "continue_story", "character": "Elsa"}),
+    ("dialog: plain-text reply to the child", DialogResult,
+     "What a lovely idea! Which princess do you like best?",
+     {"intent": "user_dialogue", "reply": "What a lovely idea! Which princess do you like best?"}),
+    ("dialog: label lines", DialogResult,
+     "intent: ask_question\ncharacter: Elsa\nreply: Elsa loves snow!",
+     {"intent": "ask_question", "character": "Elsa", "reply": "Elsa loves snow!"}),
+    ("dialog: python literals", DialogResult,
+     '{"intent": "user_dialogue", "character": None, "reply": "Hi!", "done": True}',
+     {"intent": "user_dialogue", "reply": "Hi!"}),
+    ("dialog: whitespace only", DialogResult, "  \n ", None),
+]
+
+
+def baseline(text, model):
+    """原来的做法：严格 json.loads，故事取大写字段"""
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if model is StoryResult:
+        return data if data.get("Story") and data.get("Question") else None
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    failures, baseline_ok = [], 0
+    started = time.perf_counter()
+    for name, model, text, expected in CORPUS:
+        result, status = parse_structured(text, model, text_field="story" if model is StoryResult else "reply")
+        baseline_ok += baseline(text, model) is not None
+        got = result.model_dump() if result is not None else None
+        if expected is None:
+            ok = got is None
+        else:
+            ok = got is not None and all(got.get(k) == v for k, v in expected.items())
+        if not ok:
+            failures.append((name, expected, got))
+        if args.verbose or not ok:
+            print(f"{'ok  ' if ok else 'FAIL'} [{status:8}] {name}")
+    elapsed = time.perf_counter() - started
+
+    # 纯文本故事的结尾问句可以拆成单独的问题
+    story, question = split_question(STORY + " " + QUESTION)
+    if (story, question) != (STORY, QUESTION):
+        failures.append(("split_question", (STORY, QUESTION), (story, question)))
+
+    print(f"corpus:   {len(CORPUS)} responses, {elapsed / len(CORPUS) * 1e6:.0f}us per parse")
+    print(f"baseline: {baseline_ok}/{len(CORPUS)} usable with json.loads")
+    print(f"parsed:   {len(CORPUS) - len(failures)}/{len(CORPUS)} as expected")
+    for name, expected, got in failures:
+        print(f"  {name}\n    expected {expected}\n    got      {got}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
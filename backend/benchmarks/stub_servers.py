@@ -0,0 +1,158 @@
+"""本地 stub 服务：模拟 OpenAI completions / TTS 和 Stability image-to-image 接口
+
+用法：
+    STUB_LLM_LATENCY=0.5 python -m uvicorn benchmarks.stub_servers:app --port 8100
+
+每个接口的延迟和失败率都可以配置：STUB_{LLM,TTS,IMAGE}_LATENCY（秒）、
+STUB_{LLM,TTS,IMAGE}_FAILURE_RATE（0-1，失败时返回 500），
+STUB_LATENCY_JITTER 让每次延迟在 ±比例 内随机浮动。
+图片接口的延迟按请求的 steps 缩放（STUB_IMAGE_LATENCY 对应 50 步），返回和 init_image 同样尺寸的 PNG，
+这样预览图（步数少、尺寸小）和完整渲染的耗时、体积差别在本地也能复现。
+STUB_LLM_CONCURRENCY 限制同时处理的 completions 请求数（模拟上游按请求数限流，0 表示不限），
+GET /stub/stats 返回各接口收到的请求数和 prompt 数。
+运行中可以用 POST /stub/faults 改变故障注入，例如 {"image_failure_rate": 1, "llm_latency": 5}
+（键名是去掉 STUB_ 前缀的小写环境变量名），模拟上游故障和恢复。
+
+然后让后端指向它：
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1
+    STABILITY_API_URL=http://127.0.0.1:8100/v1/generation/stub/image-to-image
+"""
+import asyncio
+import base64
+import contextlib
+import functools
+import json
+import os
+import random
+import time
+import uuid
+from io import BytesIO
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from PIL import Image
+
+# 当前的故障注入配置，POST /stub/faults 可以在运行中修改
+faults = {
+    "llm_latency": float(os.getenv("STUB_LLM_LATENCY", "0.5")),
+    "tts_latency": float(os.getenv("STUB_TTS_LATENCY", "0.5")),
+    "image_latency": float(os.getenv("STUB_IMAGE_LATENCY", "1.0")),
+    "llm_failure_rate": float(os.getenv("STUB_LLM_FAILURE_RATE", "0")),
+    "tts_failure_rate": float(os.getenv("STUB_TTS_FAILURE_RATE", "0")),
+    "image_failure_rate": float(os.getenv("STUB_IMAGE_FAILURE_RATE", "0")),
+    "latency_jitter": float(os.getenv("STUB_LATENCY_JITTER", "0")),
+}
+LLM_CONCURRENCY = int(os.getenv("STUB_LLM_CONCURRENCY", "0"))
+
+app = FastAPI()
+
+_llm_slots = asyncio.Semaphore(LLM_CONCURRENCY) if LLM_CONCURRENCY else contextlib.nullcontext()
+stats = {"llm_requests": 0, "llm_prompts": 0, "tts_requests": 0, "image_requests": 0}
+
+
+@functools.lru_cache(maxsize=8)
+def _png(size):
+    # 带一点噪声，编码后的体积接近真实图片而不是纯色块
+    noise = Image.effect_noise(size, 64).convert("RGB")
+    image = Image.blend(Image.new("RGB", size, (255, 200, 220)), noise, 0.3)
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+DIALOG_REPLY = json.dumps({
+    "intent": "continue_story",
+    "character": "Thomas",
+    "next_action": "generate_story",
+    "reply": "Let's go on an adventure with Thomas!",
+})
+
+STORY_REPLY = json.dumps({
+    "story": "Thomas the little train went up the green hill. He saw a red bird. "
+             "The bird was singing a happy song. Thomas said hello to the bird.",
+    "question": "What color was the bird? Red or blue?",
+    "word1": "hill",
+    "word2": "bird",
+    "word3": "song",
+})
+
+
+async def _simulate(latency, failure_rate):
+    """按配置的延迟等待；按失败率返回 500 响应，否则返回 None"""
+    jitter = faults["latency_jitter"]
+    if jitter:
+        latency *= random.uniform(1 - jitter, 1 + jitter)
+    await asyncio.sleep(max(latency, 0))
+    if failure_rate and random.random() < failure_rate:
+        return JSONResponse({"error": {"message": "injected failure", "type": "server_error"}}, status_code=500)
+    return None
+
+
+def _complete(prompt):
+    return STORY_REPLY if "互动绘本作家" in prompt else DIALOG_REPLY
+
+
+@app.post("/v1/completions")
+async def completions(request: Request):
+    body = await request.json()
+    prompts = body.get("prompt", "")
+    if isinstance(prompts, str):
+        prompts = [prompts]
+    stats["llm_requests"] += 1
+    stats["llm_prompts"] += len(prompts)
+    async with _llm_slots:
+        failure = await _simulate(faults["llm_latency"], faults["llm_failure_rate"])
+    if failure is not None:
+        return failure
+    return {
+        "id": f"cmpl-{uuid.uuid4().hex}",
+        "object": "text_completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [
+            {"text": _complete(p), "index": i, "logprobs": None, "finish_reason": "stop"}
+            for i, p in enumerate(prompts)
+        ],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+@app.get("/stub/stats")
+async def get_stats():
+    return stats
+
+
+@app.post("/stub/faults")
+async def set_faults(request: Request):
+    """修改故障注入配置，返回修改后的完整配置；未知的键返回 400"""
+    changes = await request.json()
+    unknown = sorted(set(changes) - set(faults))
+    if unknown:
+        return JSONResponse({"error": f"unknown fault settings: {unknown}"}, status_code=400)
+    faults.update({key: float(value) for key, value in changes.items()})
+    return faults
+
+
+@app.post("/v1/audio/speech")
+async def speech(request: Request):
+    await request.body()
+    stats["tts_requests"] += 1
+    failure = await _simulate(faults["tts_latency"], faults["tts_failure_rate"])
+    if failure is not None:
+        return failure
+    return Response(content=b"ID3" + os.urandom(1024), media_type="audio/mpeg")
+
+
+@app.post("/v1/generation/{engine}/image-to-image")
+async def image_to_image(engine: str, request: Request):
+    form = await request.form()
+    steps = int(form.get("steps", 50))
+    size = (64, 64)
+    init_image = form.get("init_image")
+    if init_image is not None and hasattr(init_image, "read"):
+        with Image.open(BytesIO(await init_image.read())) as image:
+            size = image.size
+    stats["image_requests"] += 1
+    failure = await _simulate(faults["image_latency"] * steps / 50, faults["image_failure_rate"])
+    if failure is not None:
+        return failure
+    return {"artifacts": [{"base64": _png(size), "seed": 0, "finishReason": "SUCCESS"}]}
@@ -0,0 +1,75 @@
+"""语音转文字基准：模型加载时间、单条延迟、并发吞吐和实时率（推理耗时 / 音频时长）
+
+    python -m benchmarks.transcribe_bench
+    python -m benchmarks.transcribe_bench --model small --concurrency 8 --clip-seconds 5
+
+把 test.mp3 切成若干短片段（模拟孩子说的一句话），分别用
+  - 逐条转写（max_batch=1，相当于旧的每次调用 model.transcribe）
+  - 批处理转写（max_batch=N，同时到达的片段拼成一个 mel 批次解码）
+跑同样的并发负载，对比 p50/p95 延迟和每秒处理的音频秒数。需要安装 requirements-stt.txt（openai-whisper）和 ffmpeg。
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from benchmarks.concurrency_load import BACKEND_DIR
+from app.core.speech.transcriber import SAMPLE_RATE, Transcriber, _import_whisper
+
+
+def load_clips(path, clip_seconds, count):
+    audio = _import_whisper().load_audio(path)
+    step = int(clip_seconds * SAMPLE_RATE)
+    clips = [audio[i:i + step] for i in range(0, len(audio), step) if len(audio[i:i + step]) >= SAMPLE_RATE]
+    return [clips[i % len(clips)] for i in range(count)]
+
+
+def quantile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run(transcriber, clips, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(clip):
+        async with semaphore:
+            started = time.perf_counter()
+            await transcriber.transcribe_audio(clip)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(clip) for clip in clips))
+    return time.perf_counter() - started, latencies
+
+
+async def main(args):
+    clips = load_clips(args.audio, args.clip_seconds, args.requests)
+    audio_seconds = sum(len(clip) for clip in clips) / SAMPLE_RATE
+    print(f"{len(clips)} clips, {audio_seconds:.1f}s of audio, concurrency {args.concurrency}")
+
+    for label, max_batch in (("sequential", 1), (f"batched x{args.max_batch}", args.max_batch)):
+        transcriber = Transcriber(model_size=args.model, device=args.device, max_batch=max_batch)
+        await transcriber.warm()
+        await transcriber.transcribe_audio(clips[0])  # 预热
+        elapsed, latencies = await run(transcriber, clips, args.concurrency)
+        stats = transcriber.stats()
+        print(f"\n{label}")
+        print(f"  model load:     {stats['load_seconds']:.2f}s")
+        print(f"  latency p50:    {statistics.median(latencies):.3f}s  p95: {quantile(latencies, 0.95):.3f}s")
+        print(f"  throughput:     {len(clips) / elapsed:.2f} clips/s, {audio_seconds / elapsed:.1f} audio s/s")
+        print(f"  real-time factor: {stats['real_time_factor']:.3f}  avg batch: {stats['avg_batch_size']:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--audio", default=os.path.join(BACKEND_DIR, "test.mp3"))
+    parser.add_argument("--model", default="base")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--clip-seconds", type=float, default=10.0)
+    asyncio.run(main(parser.parse_args()))
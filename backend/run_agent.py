@@ -1,36 +1,93 @@
 # run_agent.py
+from app.core.config import load_env_file
+
+# 加载 .env 文件中的环境变量；要在导入其他模块（它们会读取配置）之前完成
+load_env_file()
+
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
+from app.api.admission import AdmissionMiddleware
 from app.api.routes import story
+from app.core.agents.llm_batcher import llm_batcher
+from app.core.agents.llm_cache import llm_cache
+from app.core.agents.story_agent import speculator
+from app.core.agents.structured_output import parse_stats
+from app.core.rendering.tts_controller import tts_cache
+from app.core.speech.transcriber import WHISPER_PRELOAD, transcriber
+from app.utils.logging_config import configure_logging
+from app.utils.metrics import registry
 from app.core.memory.session_manager import create_tables
+from app.core.memory.session_cache import sessions
+from app.core.rendering.character_assets import character_assets
+from app.core.jobs.job_queue import job_queue
+from app.core.rendering.media_store import MEDIA_ROOT, run_janitor
+from app.core.clients import aclose_clients, warm_clients
+from app.core.resilience import admission, backends
+from app.utils.templates import preload_templates
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 import os
-from dotenv import load_dotenv
-
-# 加载 .env 文件中的环境变量
-load_dotenv()
 
-# 设置日志记录
-logging.basicConfig(level=logging.INFO)
+# 设置日志记录（LOG_LEVEL、LOG_FORMAT=json）
+configure_logging()
 logger = logging.getLogger(__name__)
 
+# 各组件已有的 stats() 在 /metrics 里以 gauge 形式输出
+registry.register_stats("storybot_tts_cache", tts_cache.stats)
+registry.register_stats("storybot_llm_cache", llm_cache.stats)
+registry.register_stats("storybot_llm_batch", llm_batcher.stats)
+registry.register_stats("storybot_speculation", speculator.stats)
+registry.register_stats("storybot_jobs", job_queue.stats)
+registry.register_stats("storybot_sessions", sessions.stats)
+registry.register_stats("storybot_transcriber", transcriber.stats)
+registry.register_stats("storybot_structured_output", lambda: dict(parse_stats))
+registry.register_stats("storybot_admission", admission.stats)
+for name, backend in backends.items():
+    registry.register_stats(f"storybot_backend_{name}", backend.stats)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Creating tables...")
     create_tables()
     logger.info("Tables created successfully.")
+    os.makedirs(MEDIA_ROOT, exist_ok=True)
+    logger.info("Compiled %d prompt templates.", preload_templates())
+    count, _ = await asyncio.gather(asyncio.to_thread(character_assets.preload),
+                                    asyncio.to_thread(warm_clients))
+    logger.info("Preprocessed %d character images.", count)
+    if WHISPER_PRELOAD:
+        # 语音输入的模型很大，默认在第一次转写时才加载
+        try:
+            await transcriber.warm()
+        except Exception as e:
+            logger.warning("Whisper model not loaded: %s", e)
+    await sessions.start()
+    await job_queue.start()
+    janitor = asyncio.ensure_future(run_janitor())
     yield
     logger.info("Shutting down...")
+    janitor.cancel()
+    await job_queue.stop()
+    # 进程退出前把会话缓存里还没落库的写入写完
+    await sessions.close()
+    await aclose_clients()
 
 app = FastAPI(lifespan=lifespan)
 
+# 服务饱和或 LLM 熔断时 /story/process* 直接返回 503，并给每个请求设置截止时间
+app.add_middleware(AdmissionMiddleware)
+
 app.include_router(story.router, prefix="/story", tags=["story"])
 
-# 提供静态文件服务
-if not os.path.exists("static"):
-    os.makedirs("static")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# 提供静态文件服务（目录在启动时创建，导入本模块不做文件 I/O）
+app.mount("/static", StaticFiles(directory=MEDIA_ROOT, check_dir=False), name="static")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # Prometheus 文本格式
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 def read_root():